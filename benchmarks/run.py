@@ -0,0 +1,250 @@
+"""マップの大きさごとに、broccoliの主な処理の速度とメモリ使用量を計測するスクリプト。
+
+HeadlessGameCanvas2Dを使うので、ディスプレイのない環境(CIなど)でも動作します。
+
+    python benchmarks/run.py --output before.json
+    (変更を加える)
+    python benchmarks/run.py --output after.json --compare before.json
+
+のように、コミットごとの結果をJSONに保存して比較できます。
+計測する処理は--benchmarksで、マップの大きさは--sizesで絞り込めます。
+
+各処理は、準備(マップの作成など)を済ませた後に、計測したい部分だけを2回実行します。
+1回目で経過時間を、2回目でtracemallocによるメモリ使用量のピークを計測します。
+tracemallocは処理を遅くするため、経過時間の計測には使いません。
+
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# リポジトリ内のbroccoliを計測する
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broccoli import const, register, serializers
+from broccoli.canvas import HeadlessGameCanvas2D
+from broccoli.funcstions.generic import return_false
+from broccoli.img.loader import NoDirection
+from broccoli.layer import (
+    EmptyItemLayer, EmptyObjectLayer, FlyweightSimpleTileLayer, RandomObjectLayer, RandomTileLayer, SimpleTileLayer,
+)
+from broccoli.material import BaseTile, RogueLikeObject
+from broccoli.system import RogueNoPlayer
+
+DEFAULT_SIZES = [10, 50, 100, 500, 1000]
+TURNS = 10  # act_objectsで進めるターン数
+EMPTY_SPACE_TRIES = 1000  # get_random_empty_spaceを呼ぶ回数
+
+
+# ヘッドレスキャンバスは画像を読み込まないので、画像ファイルは存在しなくても構いません
+@register.tile
+class BenchFloor(BaseTile):
+    name = 'ベンチマーク用の床'
+    image = NoDirection('bench_floor.png')
+
+
+@register.tile
+class BenchWall(BaseTile):
+    name = 'ベンチマーク用の壁'
+    image = NoDirection('bench_wall.png')
+    is_public = return_false
+
+
+@register.object
+class BenchMonster(RogueLikeObject):
+    name = 'ベンチマーク用のモンスター'
+    image = NoDirection('bench_monster.png')
+    kind = const.ENEMY
+    hp = 20
+
+
+@register.object
+class BenchHero(RogueLikeObject):
+    name = 'ベンチマーク用の勇者'
+    image = NoDirection('bench_hero.png')
+    kind = const.PLAYER
+    hp = 10000
+
+
+def create_canvas(tile_layer, object_layer=None):
+    """計測用のキャンバスを作成する。広いマップでも扱えるよう、表示範囲だけを描画します。"""
+    class BenchCanvas(HeadlessGameCanvas2D):
+        culling = True
+
+    return BenchCanvas(
+        tile_layer=tile_layer,
+        object_layer=object_layer or EmptyObjectLayer(),
+        item_layer=EmptyItemLayer(),
+        system=RogueNoPlayer(),
+    )
+
+
+def get_number_of_monsters(size):
+    """マップの大きさに対する、モンスターの数。セル50個に1体です。"""
+    return max(1, size * size // 50)
+
+
+def bench_tile_layer_create(size):
+    canvas = create_canvas(SimpleTileLayer(10, 10, BenchFloor, BenchWall))
+    tile_layer = SimpleTileLayer(size, size, BenchFloor, BenchWall)
+    tile_layer.canvas = canvas
+    canvas.tile_layer = tile_layer
+    return tile_layer.create
+
+
+def bench_flyweight_tile_layer_create(size):
+    canvas = create_canvas(SimpleTileLayer(10, 10, BenchFloor, BenchWall))
+    tile_layer = FlyweightSimpleTileLayer(size, size, BenchFloor, BenchWall)
+    tile_layer.canvas = canvas
+    canvas.tile_layer = tile_layer
+    return tile_layer.create
+
+
+def bench_random_tile_layer_create(size):
+    canvas = create_canvas(SimpleTileLayer(10, 10, BenchFloor, BenchWall))
+    tile_layer = RandomTileLayer(size, size, BenchFloor, BenchWall)
+    tile_layer.canvas = canvas
+    canvas.tile_layer = tile_layer
+    return tile_layer.create
+
+
+def bench_json_round_trip(size):
+    canvas = create_canvas(
+        SimpleTileLayer(size, size, BenchFloor, BenchWall),
+        RandomObjectLayer([BenchMonster], get_number_of_monsters(size)),
+    )
+
+    def run():
+        for layer in (canvas.tile_layer, canvas.object_layer):
+            text = json.dumps(layer, cls=serializers.JsonEncoder)
+            json.loads(text, cls=serializers.JsonDecoder)
+    return run
+
+
+def bench_act_objects(size):
+    # 4体に1体は勇者にして、モンスターが追いかける相手を作る
+    canvas = create_canvas(
+        RandomTileLayer(size, size, BenchFloor, BenchWall),
+        RandomObjectLayer([BenchMonster, BenchMonster, BenchMonster, BenchHero], get_number_of_monsters(size)),
+    )
+
+    def run():
+        canvas.run(TURNS)
+    return run
+
+
+def bench_get_random_empty_space(size):
+    canvas = create_canvas(
+        SimpleTileLayer(size, size, BenchFloor, BenchWall),
+        RandomObjectLayer([BenchMonster], get_number_of_monsters(size)),
+    )
+    object_layer = canvas.object_layer
+
+    def run():
+        for _ in range(EMPTY_SPACE_TRIES):
+            object_layer.get_random_empty_space()
+    return run
+
+
+# {ベンチマーク名: 準備を行い、計測する関数を返す関数}
+BENCHMARKS = {
+    'tile_layer_create': bench_tile_layer_create,
+    'flyweight_tile_layer_create': bench_flyweight_tile_layer_create,
+    'random_tile_layer_create': bench_random_tile_layer_create,
+    'json_round_trip': bench_json_round_trip,
+    'act_objects': bench_act_objects,
+    'get_random_empty_space': bench_get_random_empty_space,
+}
+
+
+def measure(setup, size, memory=True):
+    """1つのベンチマークを計測し、(経過秒数, メモリ使用量のピーク)を返す。"""
+    gc.collect()
+    run = setup(size)
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        run = setup(size)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def get_commit():
+    """計測したコミットのハッシュを返す。gitが使えなければNoneです。"""
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(results, base_path):
+    """以前の結果と比較し、経過時間とメモリの比率を表示する。"""
+    with open(base_path, 'r', encoding='utf-8') as file:
+        base = json.load(file)
+    base_results = {(result['benchmark'], result['size']): result for result in base['results']}
+    print('\n{} との比較 (今回 / 前回)'.format(base_path))
+    for result in results:
+        base_result = base_results.get((result['benchmark'], result['size']))
+        if base_result is None:
+            continue
+        time_ratio = result['seconds'] / base_result['seconds'] if base_result['seconds'] else float('nan')
+        line = '{:<30} {:>5}  time x{:.2f}'.format(result['benchmark'], result['size'], time_ratio)
+        if result['peak_memory'] and base_result.get('peak_memory'):
+            line += '  memory x{:.2f}'.format(result['peak_memory'] / base_result['peak_memory'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='broccoliのベンチマークを実行します。')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='マップの縦横のセル数')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--output', default='benchmark.json', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較する、以前の結果のJSONファイル')
+    parser.add_argument('--no-memory', action='store_true', help='メモリ使用量を計測しない')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.benchmarks:
+        for size in args.sizes:
+            seconds, peak = measure(BENCHMARKS[name], size, memory=not args.no_memory)
+            results.append({'benchmark': name, 'size': size, 'seconds': seconds, 'peak_memory': peak})
+            print('{:<30} {:>5}x{:<5} {:>10.4f}s {:>12}'.format(
+                name, size, size, seconds, '-' if peak is None else '{:.1f}KiB'.format(peak / 1024)
+            ))
+
+    data = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': datetime.datetime.now().isoformat(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=4)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
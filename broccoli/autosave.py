@@ -0,0 +1,217 @@
+"""ゲームのオートセーブを、バックグラウンドで行うモジュール。
+
+JSONへのエンコードとファイルへの書き込みを全てメインスレッドで行うと、その間はTkの画面が固まってしまいます。
+AutoSaverは、処理を次の2つに分けます。
+
+- メインスレッドでは、前回のスナップショットから変更されたセル(layer.pop_dirty)だけをJSONエンコードし、
+  セルごとのJSONの文字列を並べたスナップショットを作ります。
+- ワーカースレッドでは、スナップショットをdump_streamと同じ形式で一時ファイルに書き込み、
+  fsyncした後にos.replaceで保存先のファイルと入れ替えます。書き込み中に終了しても、前回のセーブは壊れません。
+
+セルのJSONの文字列は変更されないので、スナップショットは各行のリストを共有します。
+メインスレッドは、スナップショットを渡した後に初めて変更する行だけをコピーします(コピーオンライト)。
+
+    class MyManager(SimpleGameManager):
+        autosave_path = 'autosave.jsonl'
+        autosave_turns = 10
+
+のように、SimpleGameManagerのクラス属性で設定してください。保存したファイルは、普通のセーブと同じくロードできます。
+
+"""
+import os
+import queue
+import threading
+import time
+from broccoli import serializers
+
+
+class AutoSaver:
+    """マネージャーの状態を、ワーカースレッドで定期的に保存するクラス。
+
+    turnsターンごと、またはseconds秒ごとに保存します。どちらもNoneならば、save_nowを呼んだ時だけ保存します。
+    ワーカースレッドで起きた例外はerrorに格納され、次のscheduleかstopで送出されます。
+
+    """
+    tracker_name = 'autosave'  # レイヤの、変更されたセルの記録の名前
+    check_interval = 500  # 保存するタイミングかを調べる間隔(ミリ秒)
+
+    def __init__(self, manager, file_path, turns=None, seconds=None):
+        self.manager = manager
+        self.file_path = file_path
+        self.turns = turns
+        self.seconds = seconds
+        self.canvas = None
+        self.rows = {}  # {レイヤ名: [[セルのJSON, ...], ...]}
+        self.owned_rows = {}  # {レイヤ名: 前回のスナップショットの後にコピーした行番号のset}
+        self.last_turn = 0
+        self.last_time = time.monotonic()
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        """ワーカースレッドを開始する。"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='broccoli-autosave', daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=None):
+        """最後のスナップショットを作って保存してから、ワーカースレッドを終了する。
+
+        ワーカースレッドでの保存に失敗していた場合は、例外を送出します。
+
+        """
+        if self.thread is not None:
+            if self.manager.current_canvas is not None:
+                self.save_now()
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+        self.raise_error()
+
+    def schedule(self):
+        """check_intervalミリ秒ごとに、checkを呼ぶようにする。
+
+        ワーカースレッドでの保存に失敗していた場合は、次のタイマーを設定してから例外を送出します。
+
+        """
+        root = self.manager.root
+        if root is not None:
+            root.after(self.check_interval, self._on_timer)
+        self.raise_error()
+
+    def raise_error(self):
+        """ワーカースレッドで起きた例外があれば、送出する。同じ例外は1度だけ送出します。"""
+        error = self.error
+        if error is not None:
+            self.error = None
+            raise Exception('オートセーブに失敗しました。') from error
+
+    def _on_timer(self):
+        self.check()
+        self.schedule()
+
+    def check(self):
+        """保存するタイミングならば、スナップショットを作ってワーカースレッドに渡す。保存したらTrueを返します。"""
+        canvas = self.manager.current_canvas
+        if canvas is None:
+            return False
+
+        # マップが変わると、ターン数は0から数えなおしになる
+        turn = getattr(canvas.system, 'turn', 0)
+        if canvas is not self.canvas:
+            self.last_turn = 0
+
+        due = False
+        if self.turns is not None and turn - self.last_turn >= self.turns:
+            due = True
+        if self.seconds is not None and time.monotonic() - self.last_time >= self.seconds:
+            due = True
+        if due:
+            self.save_now()
+        return due
+
+    def save_now(self):
+        """すぐにスナップショットを作り、ワーカースレッドに渡す。"""
+        snapshot = self.take_snapshot()
+        canvas = self.manager.current_canvas
+        self.last_turn = getattr(canvas.system, 'turn', 0)
+        self.last_time = time.monotonic()
+
+        # 前のスナップショットがまだ書き込まれていなければ、新しいものに差し替える
+        try:
+            self.queue.put_nowait(snapshot)
+        except queue.Full:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put(snapshot)
+
+    def take_snapshot(self):
+        """メインスレッドで、現在の状態のスナップショットを作る。
+
+        スナップショットは、(マネージャーのヘッダのJSON, [(レイヤーのヘッダのJSON, 各行のリスト), ...])です。
+
+        """
+        encoder = serializers.JsonEncoder()
+        manager = self.manager
+        canvas = manager.current_canvas
+        if canvas is not self.canvas:
+            self._encode_all(canvas, encoder)
+        else:
+            self._encode_dirty(canvas, encoder)
+
+        header = encoder.encode({
+            'kind': serializers.MANAGER,
+            'format': serializers.STREAM,
+            'name': manager.current_canvas_name,
+            'vars': encoder.default(manager.vars),
+        })
+        layers = []
+        for layer_name in serializers.LAYER_NAMES:
+            layer = getattr(canvas, layer_name)
+            rows = self.rows[layer_name]
+            layer_header = encoder.layer_header_to_json(layer)
+            layer_header.update({
+                'format': serializers.STREAM,
+                'rows': len(rows),
+            })
+            # 各行はワーカースレッドと共有し、次に変更する際にコピーする
+            layers.append((encoder.encode(layer_header), list(rows)))
+            self.owned_rows[layer_name] = set()
+        return header, layers
+
+    def _encode_all(self, canvas, encoder):
+        """マップ全体をエンコードし、以降の変更の記録を始める。"""
+        self.canvas = canvas
+        self.rows = {}
+        for layer_name in serializers.LAYER_NAMES:
+            layer = getattr(canvas, layer_name)
+            layer.start_tracking(self.tracker_name)
+            self.rows[layer_name] = [[encoder.encode(cell) for cell in row] for row in encoder.layer_rows_to_json(layer)]
+
+    def _encode_dirty(self, canvas, encoder):
+        """前回のスナップショットから変更されたセルだけを、エンコードしなおす。"""
+        for layer_name in serializers.LAYER_NAMES:
+            layer = getattr(canvas, layer_name)
+            rows = self.rows[layer_name]
+            owned_rows = self.owned_rows[layer_name]
+            for x, y in layer.pop_dirty(self.tracker_name):
+                if y not in owned_rows:
+                    rows[y] = list(rows[y])
+                    owned_rows.add(y)
+                rows[y][x] = encoder.encode(encoder.layer_cell_to_json(layer, x, y))
+
+    def run(self):
+        """ワーカースレッドの処理。スナップショットを受け取り、ファイルに書き込む。"""
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                break
+            try:
+                self.write(snapshot)
+            except Exception as e:
+                self.error = e
+
+    def write(self, snapshot):
+        """スナップショットを一時ファイルに書き込み、保存先のファイルと入れ替える。"""
+        header, layers = snapshot
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(header + '\n')
+            for layer_header, rows in layers:
+                file.write(layer_header + '\n')
+                for row in rows:
+                    file.write('[' + ', '.join(row) + ']\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.file_path)
+
+        # 入れ替えたことも、ディレクトリをfsyncして確実に書き込む
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(os.path.dirname(os.path.abspath(self.file_path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
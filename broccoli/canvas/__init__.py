@@ -1 +1,3 @@
+from .animation import *
 from .base import *
+from .headless import *
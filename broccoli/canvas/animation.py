@@ -0,0 +1,158 @@
+"""キャンバス上のアニメーションを管理するモジュール。
+
+canvas.after(ms)のように、コールバックなしでafterを呼ぶとその間イベントループが止まってしまい、
+敵が攻撃するたびにゲーム全体が固まってしまいます。
+
+このモジュールのTimelineクラスは、アニメーションをジェネレータとして受け取り、
+after(ms, callback)で少しずつ進めていきます。アニメーションはkey(多くはキャンバスアイテムのID)ごとのトラックに積まれ、
+同じトラックのアニメーションは順番に、違うトラックのアニメーションは同時に再生されます。
+
+"""
+from collections import deque
+from broccoli.conf import settings
+
+
+class Timeline:
+    """ブロックしないアニメーションの再生を管理するクラス。
+
+    アニメーションは、1フレーム分の描画を行うたびに次のフレームまでの待ち時間(ミリ秒)をyieldするジェネレータです。
+
+        def blink():
+            canvas.itemconfig(id, state='hidden')
+            yield 100
+            canvas.itemconfig(id, state='normal')
+
+        canvas.timeline.add(blink(), key=id)
+
+    speedは再生速度の倍率で、2ならば倍速になります。0ならばアニメーションを全てスキップし、
+    追加されたアニメーションはすぐに最後まで進められます。
+
+    """
+
+    def __init__(self, canvas, speed=None):
+        self.canvas = canvas
+        self.speed = settings.ANIMATION_SPEED if speed is None else speed
+
+        # {key: 再生待ちのアニメーションのdeque}。先頭のアニメーションが再生中のもの
+        self.tracks = {}
+
+        # {key: after_id}。次のフレームの予約
+        self.after_ids = {}
+
+        # 全てのアニメーションが終わった際に呼ぶ関数
+        self.callbacks = []
+
+    def add(self, animation, key=None):
+        """アニメーションを追加する。
+
+        keyのトラックが空ならば、最初のフレームはその場で描画されます。
+        keyを省略した場合は、他のどのアニメーションとも同時に再生されます。
+
+        """
+        if key is None:
+            key = object()
+
+        if self.speed <= 0:
+            # スキップする場合でも、同じトラックの順番は守る
+            if key in self.tracks:
+                self.tracks[key].append(animation)
+                self.finish(key)
+            else:
+                self._exhaust(animation)
+            return
+
+        if key in self.tracks:
+            self.tracks[key].append(animation)
+        else:
+            self.tracks[key] = deque([animation])
+            self._step(key)
+
+    def call(self, func, *args, key=None, **kwargs):
+        """keyのトラックのアニメーションが終わった後に、関数を呼ぶ。
+
+        トラックが空ならば、すぐに呼ばれます。
+
+        """
+        def animation():
+            func(*args, **kwargs)
+            yield from ()
+        self.add(animation(), key=key)
+
+    def is_running(self, key=None):
+        """アニメーションが再生中かを返す。keyを省略すると、どれか1つでも再生中ならTrueです。"""
+        if key is None:
+            return bool(self.tracks)
+        return key in self.tracks
+
+    def wait(self, callback):
+        """全てのアニメーションが終わったら、callbackを呼ぶ。再生中でなければ、すぐに呼びます。"""
+        if self.tracks:
+            self.callbacks.append(callback)
+        else:
+            callback()
+
+    def finish(self, key=None):
+        """アニメーションを最後まで早送りする。
+
+        keyを省略すると、全てのトラックを早送りします。
+
+        """
+        keys = list(self.tracks) if key is None else [key]
+        for key in keys:
+            self._cancel(key)
+            track = self.tracks.get(key)
+            # 早送り中に、同じトラックへアニメーションが追加されることもある
+            while track:
+                self._exhaust(track.popleft())
+            self.tracks.pop(key, None)
+        self._call_callbacks()
+
+    def clear(self):
+        """再生中・再生待ちのアニメーションを全て破棄する。キャンバスを破棄する前などに呼んでください。"""
+        for key in list(self.tracks):
+            self._cancel(key)
+            for animation in self.tracks.pop(key):
+                animation.close()
+        self.callbacks = []
+
+    def _step(self, key):
+        """keyのトラックを、1フレーム進める。"""
+        self.after_ids.pop(key, None)
+        track = self.tracks[key]
+        while track:
+            try:
+                wait = self.next_frame(track[0])
+            except StopIteration:
+                track.popleft()
+            else:
+                self.after_ids[key] = self.canvas.after(int((wait or 0) / self.speed), self._step, key)
+                return
+
+        del self.tracks[key]
+        self._call_callbacks()
+
+    def _cancel(self, key):
+        after_id = self.after_ids.pop(key, None)
+        if after_id is not None:
+            self.canvas.after_cancel(after_id)
+
+    def next_frame(self, animation):
+        """アニメーションの次のフレームを描画し、その次のフレームまでの待ち時間を返す。
+
+        アニメーションが終わっていれば、StopIterationを送出します。
+
+        """
+        return next(animation)
+
+    def _exhaust(self, animation):
+        while True:
+            try:
+                self.next_frame(animation)
+            except StopIteration:
+                return
+
+    def _call_callbacks(self):
+        if not self.tracks:
+            callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                callback()
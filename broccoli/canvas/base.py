@@ -13,13 +13,17 @@ startメソッドを呼び出すことで、そのマップ又はゲームが動
 tk.Canvasのサブクラスなため、実際の画面への描画や、キャンバス情報の取得、アニメーションといった処理も担当します。
 
 """
+import inspect
 import json
 import tkinter as tk
 from tkinter import filedialog
+from PIL import Image, ImageTk
 from broccoli import parse_xy, serializers
 from broccoli.conf import settings
+from broccoli.img.loader import BaseLoader, get_pil_image
 from broccoli.layer import EmptyObjectLayer, EmptyItemLayer
 from broccoli.system import BaseSystem
+from .animation import Timeline
 
 
 class GameCanvas2D(tk.Canvas):
@@ -30,7 +34,21 @@ class GameCanvas2D(tk.Canvas):
     - アイテム(item)を管理するitem_layer
     の3層で構成されています。
 
+    クラス属性cullingをTrueにすると、表示範囲とその周囲culling_marginセル分だけをキャンバスに描画します。
+    広いマップでも、キャンバス上のアイテム数は表示範囲の大きさで決まるようになります。
+    表示範囲外のマテリアルは、material.idがNoneになります。
+    カメラを動かした際、範囲外になったタイルのキャンバスアイテムは、範囲内になったタイルに使いまわされます。
+
+    クラス属性tile_chunk_sizeに数値(16など)を指定すると、タイルを1枚ずつ描画せず、
+    tile_chunk_size * tile_chunk_sizeセル分のタイルを1枚の画像(チャンク)にまとめて描画します。
+    チャンクは、中のタイルがcreate_materialやdelete_materialで変更された場合にだけ描画しなおされます。
+    この場合、タイルのidはNoneになります。cullingと組み合わせた場合は、表示範囲にかかるチャンクだけを描画します。
+
     """
+    culling = False
+    culling_margin = 2
+    recycle_tags = ('tile',)  # cullingの際に、キャンバスアイテムを使いまわすタグ
+    tile_chunk_size = None
 
     def __init__(self, master=None, name='名前のないマップ', manager=None,
                  tile_layer=None, object_layer=None, item_layer=None, system=None):
@@ -65,25 +83,72 @@ class GameCanvas2D(tk.Canvas):
         self.system = system
         self.system.canvas = self
 
+        # cullingする場合、今描画しているセルの範囲(x0, y0, x1, y1)。最初は左上を表示している
+        self.view = self.get_view_rect(0, 0) if self.culling else None
+        self.image_pool = {tag: [] for tag in self.recycle_tags}
+
+        # タイルのチャンクに関する情報。{(チャンクのx, チャンクのy): (キャンバスアイテムのID, PhotoImage)}
+        self.tile_chunks = {}
+        self.dirty_tile_chunks = set()
+        self._tile_chunk_render_scheduled = True  # 最初の描画は、tile_layer.create()の後にまとめて行う
+
+        # アニメーションの管理
+        self.timeline = Timeline(self)
+
         # マップ全体の高さと幅
         max_height = self.tile_layer.y_length * settings.CELL_HEIGHT
         max_width = self.tile_layer.x_length * settings.CELL_WIDTH
 
         # Canvas内をスクロール可能にし、スクロールの最大値を設定
         scroll_region = (0, 0, max_width, max_height)
-        super().__init__(master=master, scrollregion=scroll_region, width=settings.GAME_WIDTH, height=settings.GAME_HEIGHT)
+        self.create_widget(master, scroll_region)
 
         # マップとシステムの初期設定
         self.tile_layer.create()
+        if self.tile_chunk_size:
+            self.render_tile_chunks()
         self.object_layer.create()
         self.item_layer.create()
         self.system.setup()
 
+    @classmethod
+    def prefetch(cls):
+        """このマップのレイヤーの準備(layer.prepare)と、マテリアルの画像の先読みを行う。
+
+        Tkを使わないので、別スレッドから呼べます。クラス属性のレイヤーを準備するので、
+        インスタンス化の際にレイヤーを引数で渡す場合は意味がありません。
+
+        """
+        material_classes = set()
+        for layer_name in ('tile_layer', 'object_layer', 'item_layer'):
+            layer = getattr(cls, layer_name, None)
+            if layer is not None:
+                layer.prepare()
+                material_classes.update(layer.get_material_classes())
+
+        for material_cls in material_classes:
+            loader = inspect.getattr_static(material_cls, 'image', None)
+            if isinstance(loader, BaseLoader):
+                loader.prefetch()
+
+    def create_widget(self, master, scroll_region):
+        """tk.Canvasとしての初期化を行う。
+
+        Tkを使わずにキャンバスを動かしたい場合(HeadlessGameCanvas2D)は、このメソッドを上書きします。
+
+        """
+        super().__init__(master=master, scrollregion=scroll_region, width=settings.GAME_WIDTH, height=settings.GAME_HEIGHT)
+
     def start(self):
         """このマップを楽しく遊ぶことができます。"""
         # ゲームのシステムクラスを動作させる。
         self.system.start()
 
+    def destroy(self):
+        """キャンバスを破棄する。再生待ちのアニメーションも破棄します。"""
+        self.timeline.clear()
+        super().destroy()
+
     def move_camera(self, x=None, y=None, material=None):
         """ターゲットにピントを合わせる。
 
@@ -104,6 +169,198 @@ class GameCanvas2D(tk.Canvas):
         fractal_y = (y-settings.DISPLAY_Y_NUM//2) / self.tile_layer.y_length
         self.xview_moveto(fractal_x)
         self.yview_moveto(fractal_y)
+        if self.culling:
+            self.update_view(self.get_view_rect(x, y))
+
+    def get_view_rect(self, x, y):
+        """(x, y)にカメラを合わせた際に、描画すべきセルの範囲を(x0, y0, x1, y1)として返す。
+
+        move_cameraと同じく、表示範囲の端はマップの端で止まります。
+        範囲には、表示範囲の周囲culling_marginセル分も含まれます。
+
+        """
+        x_length = self.tile_layer.x_length
+        y_length = self.tile_layer.y_length
+        left = max(0, min(x - settings.DISPLAY_X_NUM//2, x_length - settings.DISPLAY_X_NUM))
+        top = max(0, min(y - settings.DISPLAY_Y_NUM//2, y_length - settings.DISPLAY_Y_NUM))
+        margin = self.culling_margin
+        return (
+            max(0, left - margin),
+            max(0, top - margin),
+            min(x_length - 1, left + settings.DISPLAY_X_NUM - 1 + margin),
+            min(y_length - 1, top + settings.DISPLAY_Y_NUM - 1 + margin),
+        )
+
+    def is_in_view(self, x, y):
+        """その座標のセルを描画すべきかを返す。cullingしない場合は常にTrueです。"""
+        if self.view is None:
+            return True
+        x0, y0, x1, y1 = self.view
+        return x0 <= x <= x1 and y0 <= y <= y1
+
+    def update_view(self, view):
+        """描画する範囲を変更し、範囲外になったセルは消し、範囲内になったセルを描画する。"""
+        old_view = self.view
+        self.view = view
+
+        for x, y in self._iter_rect(old_view, exclude=view):
+            for layer, material in self._get_cell_materials(x, y):
+                layer.erase_material(material)
+
+        for x, y in self._iter_rect(view, exclude=old_view):
+            for layer, material in self._get_cell_materials(x, y):
+                if material.id is None:
+                    layer.draw_material(material)
+
+        if self.tile_chunk_size:
+            self.render_tile_chunks()
+
+    def _iter_rect(self, rect, exclude):
+        x0, y0, x1, y1 = rect
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                if exclude is not None and exclude[0] <= x <= exclude[2] and exclude[1] <= y <= exclude[3]:
+                    continue
+                yield x, y
+
+    def _get_cell_materials(self, x, y):
+        """そのセルのマテリアルを、(レイヤ, マテリアル)の形式で下から順に返す。
+
+        タイルをチャンクで描画している場合、タイルは返しません。
+
+        """
+        if not self.tile_chunk_size:
+            yield self.tile_layer, self.tile_layer[y][x]
+        for item in self.item_layer[y][x]:
+            yield self.item_layer, item
+        obj = self.object_layer[y][x]
+        if obj is not None:
+            yield self.object_layer, obj
+
+    def create_material_image(self, material, tag=None):
+        """マテリアルの画像をキャンバスに描画し、そのIDを返す。
+
+        使いまわせるキャンバスアイテムがあれば、新しく作らずにそれを使います。
+
+        """
+        x = material.x * settings.CELL_WIDTH
+        y = material.y * settings.CELL_HEIGHT
+        pool = self.image_pool.get(tag)
+        if pool:
+            id = pool.pop()
+            self.itemconfig(id, image=material.image)
+            self.coords(id, x, y)
+            return id
+        return self.create_image(x, y, image=material.image, anchor='nw', tags=tag)
+
+    def create_material_images(self, materials, tag=None):
+        """複数のマテリアルの画像をまとめてキャンバスに描画し、IDのリストを返す。
+
+        使いまわせるキャンバスアイテムがあればそれから使い、残りは1つのTclスクリプトでまとめて作成します。
+        create_imageを1つずつ呼ぶよりも、Tkとのやり取りが少なく済みます。
+
+        """
+        materials = list(materials)
+        pool = self.image_pool.get(tag) or ()
+        reuse_count = min(len(pool), len(materials))
+        ids = [self.create_material_image(material, tag=tag) for material in materials[:reuse_count]]
+
+        commands = []
+        tags = tag or '{}'
+        for material in materials[reuse_count:]:
+            image = material.image
+            commands.append('[{} create image {} {} -image {} -anchor nw -tags {}]'.format(
+                self._w, material.x * settings.CELL_WIDTH, material.y * settings.CELL_HEIGHT,
+                '{}' if image is None else image, tags
+            ))
+        if commands:
+            result = self.tk.eval('list ' + ' '.join(commands))
+            ids.extend(int(id) for id in self.tk.splitlist(result))
+        return ids
+
+    def update_material_image(self, material):
+        """向きが変わった場合などに、描画済みのマテリアルの画像を更新する。"""
+        self.itemconfig(material.id, image=material.image)
+
+    def delete_material_image(self, id, tag=None):
+        """マテリアルの画像をキャンバス上から消す。
+
+        cullingする場合で、使いまわすタグのものならば削除せずにマップの外へ移動させておきます。
+        消したアイテムを後からアニメーションが動かさないよう、そのアイテムのアニメーションは先に終わらせます。
+
+        """
+        self.timeline.finish(id)
+        if self.culling and tag in self.image_pool:
+            self.coords(id, -settings.CELL_WIDTH, -settings.CELL_HEIGHT)
+            self.image_pool[tag].append(id)
+        else:
+            self.delete(id)
+
+    def mark_tile_chunk(self, x, y):
+        """(x, y)のタイルを含むチャンクを、描画しなおすよう記録する。"""
+        size = self.tile_chunk_size
+        self.dirty_tile_chunks.add((x // size, y // size))
+        if not self._tile_chunk_render_scheduled:
+            self._tile_chunk_render_scheduled = True
+            self.after_idle(self.render_tile_chunks)
+
+    def is_tile_chunk_in_view(self, chunk_x, chunk_y):
+        """そのチャンクが、描画すべき範囲にかかっているかを返す。"""
+        if self.view is None:
+            return True
+        size = self.tile_chunk_size
+        x0, y0, x1, y1 = self.view
+        return (
+            chunk_x * size <= x1 and x0 < (chunk_x + 1) * size and
+            chunk_y * size <= y1 and y0 < (chunk_y + 1) * size
+        )
+
+    def render_tile_chunks(self):
+        """描画しなおす必要のあるチャンクを描画する。
+
+        cullingしている場合、表示範囲外になったチャンクはキャンバスから消し、
+        表示範囲にかかるチャンクだけを描画します。
+
+        """
+        self._tile_chunk_render_scheduled = False
+        for chunk in list(self.tile_chunks):
+            if not self.is_tile_chunk_in_view(*chunk):
+                id, _ = self.tile_chunks.pop(chunk)
+                self.delete(id)
+                self.dirty_tile_chunks.add(chunk)
+
+        for chunk in list(self.dirty_tile_chunks):
+            if self.is_tile_chunk_in_view(*chunk):
+                self.render_tile_chunk(*chunk)
+                self.dirty_tile_chunks.discard(chunk)
+
+    def render_tile_chunk(self, chunk_x, chunk_y):
+        """チャンク内のタイルを1枚の画像に合成し、キャンバスに描画する。"""
+        size = self.tile_chunk_size
+        x0 = chunk_x * size
+        y0 = chunk_y * size
+        x1 = min(x0 + size, self.tile_layer.x_length)
+        y1 = min(y0 + size, self.tile_layer.y_length)
+        image = Image.new('RGBA', ((x1 - x0) * settings.CELL_WIDTH, (y1 - y0) * settings.CELL_HEIGHT))
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                tile = self.tile_layer[y][x]
+                if tile is not None:
+                    dest = ((x - x0) * settings.CELL_WIDTH, (y - y0) * settings.CELL_HEIGHT)
+                    image.alpha_composite(get_pil_image(tile.image), dest)
+        photo_image = ImageTk.PhotoImage(image)
+
+        # 既に描画済みのチャンクならば画像だけ差し替える。PhotoImageは参照を持っておかないと消えてしまう。
+        if (chunk_x, chunk_y) in self.tile_chunks:
+            id, _ = self.tile_chunks[chunk_x, chunk_y]
+            self.itemconfig(id, image=photo_image)
+        else:
+            id = self.create_image(
+                x0 * settings.CELL_WIDTH, y0 * settings.CELL_HEIGHT,
+                image=photo_image, anchor='nw', tags=self.tile_layer.tag
+            )
+            self.lower(id)
+        self.tile_chunks[chunk_x, chunk_y] = (id, photo_image)
 
     def get_current_position_nw(self):
         """今現在表示しているエリアの、左上の座標を返す(px)。
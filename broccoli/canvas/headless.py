@@ -0,0 +1,236 @@
+"""Tkを使わずに動作するゲームキャンバスを提供するモジュール。
+
+HeadlessGameCanvas2Dは、GameCanvas2Dと同じメソッドを持ちますが、ディスプレイやTkのルートウィンドウを必要としません。
+キャンバスへの描画は実際には行わず、何が描画されたかを記録するだけです。
+afterで予約された処理は、仮想的な時計で管理され、updateやadvanceメソッドを呼んだ際に実行されます。
+
+敵AIの確認やゲームバランスの調整、CIでの動作確認のように、ゲームを高速にシミュレートしたい場合に使います。
+
+    class Simulation(HeadlessGameCanvas2D):
+        tile_layer = RandomTileLayer(50, 50, Tile, Wall)
+        object_layer = RandomObjectLayer([Enemy], 100)
+        system = RogueNoPlayer()
+
+    canvas = Simulation()
+    canvas.run(1000)  # 1000ターン進める
+    print(canvas.system.message.messages)
+
+"""
+import heapq
+import itertools
+from broccoli.conf import settings
+from broccoli.dialog import BaseDialog
+from .base import GameCanvas2D
+
+
+class HeadlessRoot:
+    """winfo_toplevelが返す、何もしないルートウィンドウ。"""
+
+    def bind(self, *args, **kwargs):
+        pass
+
+    def unbind(self, *args, **kwargs):
+        pass
+
+
+class HeadlessMessageDialog(BaseDialog):
+    """メッセージを表示せず、messagesリストに保存していくだけのメッセージクラス。"""
+
+    def __init__(self, parent, canvas):
+        super().__init__(parent, canvas)
+        self.messages = []
+
+    def add(self, message):
+        self.messages.append(message)
+
+    def show(self, *args, **kwargs):
+        pass
+
+    def destroy(self, event=None):
+        pass
+
+
+class HeadlessGameCanvas2D(GameCanvas2D):
+    """Tkを使わない2Dゲームキャンバス。
+
+    描画したアイテムは、items属性に{ID: [種類, 座標のリスト, オプションの辞書]}として記録されます。
+    マテリアルの画像は読み込みません。アニメーションは全てスキップされます。
+
+    システムがmessage_class属性を持っていれば、message_classに置き換えてからセットアップします。
+
+    """
+    message_class = HeadlessMessageDialog
+
+    def create_widget(self, master, scroll_region):
+        self.root = HeadlessRoot()
+        self.scroll_region = scroll_region
+        self.scroll_x = 0
+        self.scroll_y = 0
+        self.items = {}
+        self._item_ids = itertools.count(1)
+
+        # afterで予約された処理。(実行時刻, 予約順, ID, 関数, 引数)のヒープです
+        self.time = 0
+        self.tasks = []
+        self.cancelled_tasks = set()
+        self._task_ids = itertools.count(1)
+
+        self.timeline.speed = 0
+        if hasattr(self.system, 'message_class'):
+            self.system.message_class = self.message_class
+
+    def start(self):
+        """システムを開始する。
+
+        キーイベントや、ターン数などの表示枠は使えないので、system.startは呼びません。
+
+        """
+        pass
+
+    def run(self, turns):
+        """system.next_turnを呼び、ターンを進める。1ターン毎に、予約されている処理のうち実行時刻のものを実行します。"""
+        for _ in range(turns):
+            self.system.next_turn()
+            self.update()
+
+    def destroy(self):
+        self.timeline.clear()
+        self.items.clear()
+        self.tasks.clear()
+
+    # 描画に関する処理
+    def _create(self, type, args, kwargs):
+        id = next(self._item_ids)
+        self.items[id] = [type, list(args), kwargs]
+        return id
+
+    def create_image(self, *args, **kwargs):
+        return self._create('image', args, kwargs)
+
+    def create_text(self, *args, **kwargs):
+        return self._create('text', args, kwargs)
+
+    def create_line(self, *args, **kwargs):
+        return self._create('line', args, kwargs)
+
+    def create_rectangle(self, *args, **kwargs):
+        return self._create('rectangle', args, kwargs)
+
+    def create_material_image(self, material, tag=None):
+        # 画像を読み込むとTkが必要になるので、imageは渡さない
+        x = material.x * settings.CELL_WIDTH
+        y = material.y * settings.CELL_HEIGHT
+        # cullingで消したアイテムは、GameCanvas2Dと同じく使いまわす
+        pool = self.image_pool.get(tag)
+        if pool:
+            id = pool.pop()
+            self.coords(id, x, y)
+            return id
+        return self.create_image(x, y, anchor='nw', tags=tag)
+
+    def create_material_images(self, materials, tag=None):
+        return [self.create_material_image(material, tag=tag) for material in materials]
+
+    def update_material_image(self, material):
+        pass
+
+    def render_tile_chunk(self, chunk_x, chunk_y):
+        if (chunk_x, chunk_y) not in self.tile_chunks:
+            size = self.tile_chunk_size
+            id = self.create_image(
+                chunk_x * size * settings.CELL_WIDTH, chunk_y * size * settings.CELL_HEIGHT,
+                anchor='nw', tags=self.tile_layer.tag
+            )
+            self.tile_chunks[chunk_x, chunk_y] = (id, None)
+
+    def find_withtag(self, tag_or_id):
+        if tag_or_id == 'all':
+            return tuple(self.items)
+        if tag_or_id in self.items:
+            return (tag_or_id,)
+        return tuple(id for id, (_, _, kwargs) in self.items.items() if self._has_tag(kwargs, tag_or_id))
+
+    def _has_tag(self, kwargs, tag):
+        tags = kwargs.get('tags', kwargs.get('tag'))
+        if isinstance(tags, (tuple, list)):
+            return tag in tags
+        return tags == tag
+
+    def coords(self, tag_or_id, *args):
+        ids = self.find_withtag(tag_or_id)
+        if args:
+            for id in ids:
+                self.items[id][1] = list(args)
+        elif ids:
+            return self.items[ids[0]][1]
+        else:
+            return []
+
+    def itemconfig(self, tag_or_id, **kwargs):
+        for id in self.find_withtag(tag_or_id):
+            self.items[id][2].update(kwargs)
+
+    def delete(self, *tags_or_ids):
+        for tag_or_id in tags_or_ids:
+            for id in self.find_withtag(tag_or_id):
+                del self.items[id]
+
+    def lift(self, *args):
+        pass
+
+    def lower(self, *args):
+        pass
+
+    def pack(self, *args, **kwargs):
+        pass
+
+    def winfo_toplevel(self):
+        return self.root
+
+    # スクロールに関する処理
+    def xview_moveto(self, fraction):
+        self.scroll_x = max(0, fraction * self.scroll_region[2])
+
+    def yview_moveto(self, fraction):
+        self.scroll_y = max(0, fraction * self.scroll_region[3])
+
+    def canvasx(self, x):
+        return self.scroll_x + x
+
+    def canvasy(self, y):
+        return self.scroll_y + y
+
+    # afterに関する処理
+    def after(self, ms, func=None, *args):
+        """msミリ秒後にfuncを呼ぶよう予約する。funcを省略した場合は、仮想的な時計をmsミリ秒進めます。"""
+        if func is None:
+            self.time += ms
+            return None
+        id = next(self._task_ids)
+        heapq.heappush(self.tasks, (self.time + ms, id, func, args))
+        return id
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, id):
+        self.cancelled_tasks.add(id)
+
+    def advance(self, ms):
+        """仮想的な時計をmsミリ秒進め、その間に予約されていた処理を順番に実行する。"""
+        end = self.time + ms
+        while self.tasks and self.tasks[0][0] <= end:
+            time, id, func, args = heapq.heappop(self.tasks)
+            self.time = max(self.time, time)
+            if id in self.cancelled_tasks:
+                self.cancelled_tasks.discard(id)
+            else:
+                func(*args)
+        self.time = end
+
+    def update(self):
+        """実行時刻になっている、予約済みの処理を実行する。"""
+        self.advance(0)
+
+    def update_idletasks(self):
+        self.update()
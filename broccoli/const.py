@@ -10,3 +10,9 @@ UP = 3
 PLAYER = 0
 ENEMY = 1
 NEUTRAL = 2
+
+# タイルの通行可否に対応する
+PRIVATE = 0  # 誰も通れない(is_publicがgeneric.return_false)
+PUBLIC = 1  # 誰でも通れる(is_publicがgeneric.return_true)
+ONLY_PLAYER = 2  # プレイヤーだけ通れる(is_publicがgeneric.tile.only_player)
+CUSTOM = 3  # その他の関数。実際に関数を呼び出して判定する
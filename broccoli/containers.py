@@ -1,5 +1,8 @@
 """broccoliフレームワークで使う、カスタムコンテナ型を提供する。"""
-from collections import UserDict
+import heapq
+import itertools
+import random
+from collections import OrderedDict, UserDict
 
 
 class IndexDict(UserDict):
@@ -101,3 +104,273 @@ class IndexDict(UserDict):
         """そのキーのインデックスを返す。"""
         dict_keys = list(self.data.keys())
         return dict_keys.index(key)
+
+
+class RandomSet:
+    """要素の追加・削除と、ランダムな要素の取り出しがO(1)でできる集合。
+
+    内部ではリストと、要素からリスト内の位置を引く辞書の2つで要素を管理しています。
+    削除する際は、削除する要素とリストの末尾の要素を入れ替えてから末尾を取り除くため、
+    リストの途中を詰める処理が発生しません。
+
+    レイヤの空いている座標を管理し、その中からランダムに座標を選ぶのに便利です。
+
+    # 追加と削除のテスト
+    >>> random_set = RandomSet([1, 2, 3])
+    >>> len(random_set)
+    3
+    >>> random_set.add(4)
+    >>> random_set.add(4)
+    >>> len(random_set)
+    4
+    >>> random_set.discard(1)
+    >>> random_set.discard(100)
+    >>> 1 in random_set
+    False
+    >>> sorted(random_set)
+    [2, 3, 4]
+    >>> random_set.remove(100)
+    Traceback (most recent call last):
+    ...
+    KeyError: 100
+
+    # ランダムな取り出しのテスト
+    >>> random_set.choice() in (2, 3, 4)
+    True
+    >>> sorted(random_set.sample(3))
+    [2, 3, 4]
+    >>> RandomSet().choice()
+    Traceback (most recent call last):
+    ...
+    IndexError: Cannot choose from an empty sequence
+
+    """
+
+    def __init__(self, iterable=()):
+        self.items = []
+        self.positions = {}
+        for item in iterable:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, item):
+        """要素を追加する。既にある要素ならば何もしません。"""
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        """要素を削除する。要素がなければKeyErrorを送出します。"""
+        index = self.positions.pop(item)
+        last_item = self.items.pop()
+        # 末尾の要素を、削除した要素の位置に移す
+        if index < len(self.items):
+            self.items[index] = last_item
+            self.positions[last_item] = index
+
+    def discard(self, item):
+        """要素があれば削除する。"""
+        if item in self.positions:
+            self.remove(item)
+
+    def choice(self):
+        """ランダムに要素を1つ返す。"""
+        return random.choice(self.items)
+
+    def sample(self, k):
+        """重複しないように、ランダムにk個の要素を返す。"""
+        return random.sample(self.items, k)
+
+
+class TurnQueue:
+    """次に行動する時刻が早い順に、要素を取り出せるキュー。
+
+    内部では(行動する時刻, 追加した順番, 要素)のヒープで要素を管理しています。
+    時刻は整数で、1ターンはturn_lengthです。
+    素早さが2のキャラクターならturn_length // 2後、0.5ならturn_length * 2後に再び追加することで
+    行動の速さが違うキャラクターを、全体を走査せずに順番に行動させることができます。
+
+    削除した要素はヒープにしばらく残りますが、取り出す際に読み飛ばされます。
+
+    # 追加と取り出しのテスト
+    >>> queue = TurnQueue()
+    >>> queue.add('a')
+    >>> queue.add('b', delay=50)
+    >>> queue.add('c', delay=100)
+    >>> len(queue)
+    3
+    >>> list(queue.pop_due())
+    ['a', 'b']
+    >>> queue.time
+    100
+    >>> 'a' in queue
+    False
+
+    # 取り出した要素を再び追加すると、その要素の時刻から数えられる
+    >>> queue.add('a', delay=0)
+    >>> fast = []
+    >>> for item in queue.pop_due():
+    ...     fast.append(item)
+    ...     if item == 'a':
+    ...         queue.add(item, delay=50)
+    >>> fast
+    ['c', 'a', 'a']
+
+    # 削除のテスト
+    >>> queue.add('d')
+    >>> queue.discard('d')
+    >>> queue.discard('d')
+    >>> list(queue.pop_due())
+    ['a']
+    >>> queue.remove('d')
+    Traceback (most recent call last):
+    ...
+    KeyError: 'd'
+
+    """
+
+    def __init__(self, turn_length=100):
+        self.turn_length = turn_length
+        self.time = 0
+        self.heap = []
+        self.entries = {}  # {要素: 追加した順番}。ヒープ内の古いエントリを見分けるのに使う
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, item):
+        return item in self.entries
+
+    def add(self, item, delay=0):
+        """今の時刻からdelay後に行動するよう、要素を追加する。既にある要素ならば、時刻を変更します。"""
+        count = next(self.counter)
+        self.entries[item] = count
+        heapq.heappush(self.heap, (self.time + delay, count, item))
+
+    def remove(self, item):
+        """要素を削除する。ない要素ならばKeyErrorを送出します。"""
+        del self.entries[item]
+
+    def discard(self, item):
+        """要素があれば削除する。"""
+        self.entries.pop(item, None)
+
+    def pop_due(self, turns=1):
+        """今の時刻からturnsターン以内に行動する要素を、時刻順に取り出して返す。
+
+        取り出した要素はキューから外れるので、また行動させたい場合は再びaddしてください。
+        全て取り出し終えると、時刻がturnsターン分進みます。
+
+        """
+        end = self.time + self.turn_length * turns
+        heap = self.heap
+        while heap and heap[0][0] < end:
+            time, count, item = heapq.heappop(heap)
+            # 削除された要素や、時刻を変更された要素の古いエントリ
+            if self.entries.get(item) != count:
+                continue
+            del self.entries[item]
+            self.time = time
+            yield item
+        self.time = end
+
+
+class LRUCache:
+    """要素数と合計サイズに上限がある、最近使われていないものから捨てていくキャッシュ。
+
+    要素を追加する際に、その要素のサイズ(バイト数など)を指定します。
+    max_entriesかmax_bytesを超えると、一番昔に使われた(追加・取得された)要素から削除されます。
+    どちらの上限もNoneならば、要素を捨てることはありません。
+
+    # 要素数の上限のテスト
+    >>> cache = LRUCache(max_entries=2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> 'b' in cache
+    False
+    >>> list(cache)
+    ['a', 'c']
+
+    # サイズの上限のテスト
+    >>> cache = LRUCache(max_bytes=10)
+    >>> cache.put('a', 'aaaa', size=4)
+    >>> cache.put('b', 'bbbbbb', size=6)
+    >>> cache.total_bytes
+    10
+    >>> cache.put('c', 'cc', size=2)
+    >>> list(cache)
+    ['b', 'c']
+    >>> cache.put('d', 'd' * 100, size=100)
+    >>> list(cache), cache.total_bytes
+    (['b', 'c'], 8)
+    >>> cache.get('nothing_key') is None
+    True
+    >>> cache.pop('b')
+    'bbbbbb'
+    >>> cache.pop('b') is None
+    True
+
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # {キー: (値, サイズ)}
+        self.total_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def get(self, key, default=None):
+        """キーの値を返す。取得した要素は、最近使われたものになります。"""
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value, size=0):
+        """要素を追加する。上限を超えた分は、昔に使われたものから削除されます。
+
+        上限より大きな要素は、追加されません。
+
+        """
+        self.pop(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+        while (self.max_entries is not None and len(self.entries) > self.max_entries) or \
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            _, (_, old_size) = self.entries.popitem(last=False)
+            self.total_bytes -= old_size
+
+    def pop(self, key, default=None):
+        """要素を削除し、その値を返す。"""
+        if key not in self.entries:
+            return default
+        value, size = self.entries.pop(key)
+        self.total_bytes -= size
+        return value
+
+    def clear(self):
+        """全ての要素を削除する。"""
+        self.entries.clear()
+        self.total_bytes = 0
@@ -9,4 +9,5 @@ def healing_use(self):
     if self.owner.hp >= self.owner.max_hp:
         self.owner.hp = self.owner.max_hp
     self.owner.items.remove(self)  # 通常は使ったら消える
+    self.owner.mark_dirty()
     self.system.add_message('{}は\n{}を使った!'.format(self.owner.name, self.name))
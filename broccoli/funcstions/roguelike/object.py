@@ -1,4 +1,5 @@
 """ローグライクシステムのオブジェクトに使える関数を提供する。"""
+import math
 from broccoli import register
 from broccoli import const
 
@@ -16,6 +17,25 @@ def action(self):
 
     # 4方向に攻撃できそうなのがいない
     else:
+        # プレイヤーを狙う普通の敵ならば、システムが作ったFlowFieldで次の1歩をすぐに決められる
+        if uses_flow_field(self):
+            field = self.system.get_flow_field(self)
+            target = field.get_target(self)
+            if target is None:
+                self.random_walk()
+                return
+
+            step = field.next_step(self)
+            if step is None:
+                # FlowFieldの範囲外ならば個別に経路を探す。範囲内ならば、道が塞がっているので待つ
+                if not field.is_reachable(self.x, self.y):
+                    self.towards(target)
+            else:
+                direction, x, y = step
+                self.change_direction(direction)
+                self.move(self.canvas.tile_layer[y][x])
+            return
+
         # 周囲の敵対キャラを探す
         enemies = list(self.get_enemies())
 
@@ -29,13 +49,27 @@ def action(self):
             self.random_walk()
 
 
+def uses_flow_field(obj):
+    """objの行動を、システムのFlowFieldで決められるかを返す。
+
+    ENEMYで、is_enemyとget_enemiesがデフォルトのもの(プレイヤーだけを敵とみなす)ならば使えます。
+
+    """
+    return (
+        obj.kind == const.ENEMY
+        and getattr(obj.is_enemy, '__func__', None) is is_enemy
+        and getattr(obj.get_enemies, '__func__', None) is get_enemies
+        and hasattr(obj.system, 'get_flow_field')
+    )
+
+
 @register.function('roguelike.object.random_walk', system='roguelike', attr='random_walk', material='object')
 def random_walk(self):
     """ランダムに移動する"""
     for direction, x, y in self.get_4_positions():
         tile = self.canvas.tile_layer[y][x]
         obj = self.canvas.object_layer[y][x]
-        if tile.is_public(obj=self) and obj is None:
+        if self.canvas.tile_layer.is_public(x, y, obj=self) and obj is None:
             self.change_direction(direction)
             self.move(tile)
             break
@@ -54,15 +88,8 @@ def move(self, tile):
         tile: 移動先の背景
 
     """
-    # object_layer内の移動元にNone(誰もいない状態)にする
-    self.canvas.object_layer[self.y][self.x] = None
-
-    # object_layer内の移動先にキャラクターを設定
-    self.canvas.object_layer[tile.y][tile.x] = self
-
-    # y、x座標を更新
-    self.y = tile.y
-    self.x = tile.x
+    # object_layer内の移動元をNone(誰もいない状態)にし、移動先にキャラクターを設定。x、y座標も更新される
+    self.canvas.object_layer.move_material(self, tile.x, tile.y)
 
     # 移動する
     self.system.simple_move(self.id, material=self)
@@ -76,6 +103,7 @@ def move(self, tile):
             self.items.append(item)
             item.delete()
             messages.append('{}は{}を拾った!'.format(self.name, item.name))
+        self.mark_dirty()
 
         self.system.add_message('\n'.join(messages))
 
@@ -107,7 +135,8 @@ def is_enemy(self, obj):
 @register.function('roguelike.object.on_damage', system='roguelike', attr='on_damage', material='object')
 def on_damage(self, tile, obj):
     """ダメージをうける。"""
-    self.system.simple_damage_line(material=self)
+    # 攻撃したキャラクターのモーションが終わってから、ダメージ線を表示する
+    self.system.simple_damage_line(material=self, key=obj.id)
     self.hp -= obj.power
     self.system.add_message('{}の攻撃!\n{}は{}のダメージを受けた!'.format(obj.name, self.name, obj.power))
     if self.hp <= 0:
@@ -154,7 +183,22 @@ def attack(self, tile, obj):
 
 @register.function('roguelike.object.towards', system='roguelike', attr='towards', material='object')
 def towards(self, material):
-    """対象に向かって移動する。"""
+    """対象に向かって移動する。
+
+    tile_layer.pathfinderの距離マップを使い、壁を回り込んで対象に近づきます。
+    距離マップは対象の座標ごとにキャッシュされるので、同じ相手を追いかけるキャラクター同士で共有されます。
+    探索するのは、視界の広さ(see_x + see_y)の2倍の歩数までです。
+    たどり着けない場合や、近づける道が塞がっている場合は、対象のいる方向へ単純に1歩進もうとします。
+
+    """
+    max_distance = (self.see_x + self.see_y) * 2
+    step = self.canvas.tile_layer.pathfinder.next_step(self, material.x, material.y, max_distance=max_distance)
+    if step is not None:
+        direction, x, y = step
+        self.change_direction(direction)
+        self.move(self.canvas.tile_layer[y][x])
+        return
+
     # 相手が右側にいる
     if self.x < material.x:
         x = self.x + 1
@@ -162,7 +206,7 @@ def towards(self, material):
         if self.canvas.check_position(x, y):
             tile = self.canvas.tile_layer[y][x]
             obj = self.canvas.object_layer[y][x]
-            if tile.is_public(obj=self) and obj is None:
+            if self.canvas.tile_layer.is_public(x, y, obj=self) and obj is None:
                 self.change_direction(const.RIGHT)
                 self.move(tile)
                 return
@@ -174,7 +218,7 @@ def towards(self, material):
         if self.canvas.check_position(x, y):
             tile = self.canvas.tile_layer[y][x]
             obj = self.canvas.object_layer[y][x]
-            if tile.is_public(obj=self) and obj is None:
+            if self.canvas.tile_layer.is_public(x, y, obj=self) and obj is None:
                 self.change_direction(const.LEFT)
                 self.move(tile)
                 return
@@ -186,7 +230,7 @@ def towards(self, material):
         if self.canvas.check_position(x, y):
             tile = self.canvas.tile_layer[y][x]
             obj = self.canvas.object_layer[y][x]
-            if tile.is_public(obj=self) and obj is None:
+            if self.canvas.tile_layer.is_public(x, y, obj=self) and obj is None:
                 self.change_direction(const.DOWN)
                 self.move(tile)
                 return
@@ -198,7 +242,7 @@ def towards(self, material):
         if self.canvas.check_position(x, y):
             tile = self.canvas.tile_layer[y][x]
             obj = self.canvas.object_layer[y][x]
-            if tile.is_public(obj=self) and obj is None:
+            if self.canvas.tile_layer.is_public(x, y, obj=self) and obj is None:
                 self.change_direction(const.UP)
                 self.move(tile)
                 return
@@ -214,10 +258,27 @@ def get_enemies(self, see_x=None, see_y=None):
     """
     see_x = see_x or self.see_x
     see_y = see_y or self.see_y
-    for x, y, obj in self.canvas.object_layer.all(include_none=False):
-        if abs(self.x-x) <= see_x and abs(self.y-y) <= see_y:
-            if self.is_enemy(obj) and obj != self:
-                yield obj
+    for x, y, obj in self.canvas.object_layer.query_rect(self.x-see_x, self.y-see_y, self.x+see_x, self.y+see_y):
+        if self.is_enemy(obj) and obj != self:
+            yield obj
+
+
+@register.function('roguelike.object.get_visible_enemies', system='roguelike', attr='get_enemies', material='object')
+def get_visible_enemies(self, see_x=None, see_y=None):
+    """自分の周りの敵のうち、壁に遮られずに見えているものを返す。
+
+    get_enemiesの代わりに使えます。視界はtile_layer.fovで、自分の位置から求めます。
+    見える範囲はget_enemiesと同じく、see_x、see_yの長方形です。
+
+    """
+    see_x = see_x or self.see_x
+    see_y = see_y or self.see_y
+    # 長方形の角まで届く半径で視界を求め、長方形の外はget_enemiesで除く
+    radius = math.ceil(math.hypot(see_x, see_y))
+    fov = self.canvas.tile_layer.fov
+    for obj in get_enemies(self, see_x, see_y):
+        if fov.is_visible(self.x, self.y, radius, obj.x, obj.y):
+            yield obj
 
 
 @register.function('roguelike.object.simple_talk', system='roguelike', attr='talk', material='object')
@@ -23,6 +23,13 @@ SHOW_MESSAGE_KEY = 'l'  # ログ表示キー
 TALK_KEY = 't'  # 喋る
 SAVE_KEY = 'F1'  # セーブ
 LOAD_KEY = 'F2'  # ロード
+SKIP_ANIMATION_KEY = 'space'  # 再生中のアニメーションを飛ばす
+
+# アニメーションの再生速度の倍率。0にすると、アニメーションを全てスキップする
+ANIMATION_SPEED = 1
+
+# Trueにすると、ゲームシステムの処理時間を計測する(system.profiler.statsで確認できる)
+PROFILE = False
 
 # ゲーム中のテキストのデフォルトフォント
 DEFAULT_TEXT_FONT = 'ＭＳ ゴシック'
@@ -3,6 +3,40 @@ import random
 from PIL import Image, ImageTk
 from broccoli.conf import settings
 
+# PhotoImageの名前と、そのPIL.Imageの対応。get_pil_imageで使います。
+_pil_images = {}
+
+# 画像ファイルのパスと、先読みしてデコードしたPIL.Imageの対応。open_imageで使います。
+_prefetched_images = {}
+
+
+def open_image(path):
+    """画像ファイルを開き、デコードしたPIL.Imageを返す。
+
+    BaseLoader.prefetchで先読みしていれば、その画像を使います。
+
+    """
+    image = _prefetched_images.pop(path, None)
+    if image is None:
+        image = Image.open(path)
+        image.load()
+    return image
+
+
+def get_pil_image(photo_image):
+    """ImageTk.PhotoImageを、RGBAのPIL.Imageに変換して返す。
+
+    タイルを1枚の大きな画像にまとめる場合など、PILで画像を合成したい場合に使います。
+    同じPhotoImageを何度も変換しないよう、結果は保存しておきます。
+
+    """
+    key = str(photo_image)
+    image = _pil_images.get(key)
+    if image is None:
+        image = ImageTk.getimage(photo_image).convert('RGBA')
+        _pil_images[key] = image
+    return image
+
 
 class BaseLoader:
     """読み込み機能の基底クラス。"""
@@ -12,13 +46,39 @@ class BaseLoader:
         self.image = None
 
     def load(self):
-        self.image = ImageTk.PhotoImage(file=self.path)
+        self.image = ImageTk.PhotoImage(open_image(self.path))
 
     def __get__(self, instance, owner):
         if self.image is None:
             self.load()
         return self.image
 
+    def is_loaded(self):
+        """PhotoImageを作成済みかを返す。"""
+        return self.image is not None
+
+    def get_paths(self):
+        """読み込む画像ファイルのパスを、リストで返す。"""
+        return [self.path]
+
+    def prefetch(self):
+        """画像ファイルを読み込み、デコードしておく。
+
+        PhotoImageの作成はTkを使うためメインスレッドで行う必要がありますが、このメソッドはTkを使わないので、
+        別スレッドから呼べます。読み込めないファイルは無視し、実際に使う際にエラーとします。
+
+        """
+        if self.is_loaded():
+            return
+        for path in self.get_paths():
+            if path not in _prefetched_images:
+                try:
+                    image = Image.open(path)
+                    image.load()
+                except OSError:
+                    continue
+                _prefetched_images[path] = image
+
     def get_x_length(self):
         return 1
 
@@ -70,7 +130,13 @@ class MultiDirection(BaseLoader):
         self.images = None
 
     def load(self):
-        self.images = [ImageTk.PhotoImage(file=path) for path in self.path]
+        self.images = [ImageTk.PhotoImage(open_image(path)) for path in self.path]
+
+    def is_loaded(self):
+        return self.images is not None
+
+    def get_paths(self):
+        return list(self.path)
 
     def __get__(self, instance, owner):
         if self.images is None:
@@ -109,7 +175,10 @@ class MultiDirectionWithDiff(MultiDirection):
     """
 
     def load(self):
-        self.images = [[ImageTk.PhotoImage(file=path) for path in row] for row in self.path]
+        self.images = [[ImageTk.PhotoImage(open_image(path)) for path in row] for row in self.path]
+
+    def get_paths(self):
+        return [path for row in self.path for path in row]
 
     def __get__(self, instance, owner):
         if self.images is None:
@@ -152,7 +221,7 @@ class NormalSplite(MultiDirection):
         self.images = None
 
     def load(self):
-        src = Image.open(self.path)
+        src = open_image(self.path)
         width, height = src.size
         yoko = width // settings.CELL_WIDTH
         tate = height // settings.CELL_HEIGHT
@@ -169,6 +238,9 @@ class NormalSplite(MultiDirection):
                 images[y][x] = ImageTk.PhotoImage(image)
         self.images = images
 
+    def get_paths(self):
+        return [self.path]
+
     def __get__(self, instance, owner):
         if self.images is None:
             self.load()
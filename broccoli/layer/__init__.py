@@ -1,5 +1,9 @@
 from .base import *
 from .randomlib import *
 from .tile import *
+from .flyweight import *
+from .binary import *
 from .object import *
 from .item import *
+from .pathfinding import *
+from .fov import *
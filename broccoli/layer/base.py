@@ -6,19 +6,76 @@
 
 """
 import random
-from broccoli.conf import settings
+from broccoli import const
+from broccoli.containers import RandomSet, TurnQueue
+from broccoli.funcstions.generic import return_true, return_false, only_player
+from .fov import FieldOfView
+from .pathfinding import PathFinder
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# is_publicに設定された関数と、通行可否の対応。ここにある関数ならば、関数を呼び出さずに判定できます。
+PASSABILITY_CODES = {
+    return_true: const.PUBLIC,
+    return_false: const.PRIVATE,
+    only_player: const.ONLY_PLAYER,
+}
+
+# 変更されたセルを記録する際に、無視する属性。保存されない属性や、移動のように別途記録している属性です。
+UNTRACKED_ATTRS = frozenset(['x', 'y', 'canvas', 'system', 'layer', 'id'])
 
 
 class BaseLayer:
-    """全てのレイヤの基底クラス。"""
+    """全てのレイヤの基底クラス。
+
+    index_attrsに属性名を書いておくと、その属性の値ごとにマテリアルを分類した索引を作ります。
+    get、filterメソッドにその属性を指定した場合、レイヤ全体を走査せずに索引からマテリアルを探せます。
+    '__class__'を指定すれば、マテリアルのクラスごとの索引になります。
+
+    class MyObjectLayer(JsonObjectLayer):
+        index_attrs = ['name', 'kind']
+
+    のように使います。インスタンスごとに索引を追加したい場合は、add_indexメソッドを使ってください。
+
+    start_trackingを呼ぶと、マテリアルの配置・削除・移動や、レイヤ内のマテリアルの属性の変更があったセルを、
+    (x, y)として記録するようになります。変更されたセルだけを保存する、差分セーブに使います。
+    記録は名前ごとに別々に行われるので、ジャーナルとオートセーブのように、複数の利用者が同時に使えます。
+
+    """
+    index_attrs = []  # 索引を作る属性名を書きます。
+    tag = None  # このレイヤのマテリアルを描画する際に、キャンバス上でつけるタグ
+    random_tries = 16  # 空いている座標をランダムに探す際、何回まで試すか
 
     def __init__(self):
         self.layer = None
         self.canvas = None
+        self.indexes = {attr_name: {} for attr_name in type(self).index_attrs}
+        self._empty_spaces = None
+        self.trackers = {}  # {記録の名前: 変更されたセルのset}
+        self.watched_classes = set()  # 属性の変更を通知するようにした、マテリアルのクラス
+
+    def prepare(self):
+        """レイヤーを作成(create)する前の、描画を伴わない準備を行う。
+
+        ファイルの読み込みやマップの生成のような、Tkを使わない重い処理をここで済ませておくと、
+        SimpleGameManagerが、次のマップを別スレッドで準備できるようになります。
+        準備した内容は、次のcreateで使われます。
+
+        """
+        pass
+
+    def get_material_classes(self):
+        """レイヤーに作成するマテリアルのクラスを返す。画像の先読みに使います。"""
+        return ()
 
     def put_material(self, material, x, y):
         """レイヤに、マテリアルを登録する。"""
         self[y][x] = material
+        self.add_to_indexes(material)
+        self.watch_material(material)
+        self.mark_dirty(x, y)
 
     def all(self, include_none=True):
         """レイヤ内のものを全て返す。
@@ -32,19 +89,151 @@ class BaseLayer:
                 if include_none or col:
                     yield x, y, col
 
+    def materials(self):
+        """レイヤ内に存在するマテリアルを、1つずつ返す。"""
+        for _, _, material in self.all(include_none=False):
+            yield material
+
+    def add_index(self, attr_name):
+        """属性の索引を追加する。既にレイヤ内にあるマテリアルも索引に登録されます。"""
+        self.indexes[attr_name] = {}
+        if self.layer is not None:
+            for material in self.materials():
+                self._add_to_index(material, attr_name, getattr(material, attr_name, None))
+        self.watch_materials()
+
+    def clear_indexes(self):
+        """全ての索引を空にする。レイヤーを作り直す際に呼ばれます。"""
+        for attr_name in self.indexes:
+            self.indexes[attr_name] = {}
+
+    def _add_to_index(self, material, attr_name, value):
+        try:
+            bucket = self.indexes[attr_name].setdefault(value, {})
+        except TypeError:
+            # リストや辞書のようなハッシュ化できない値は、索引に登録しない
+            return
+        bucket[material] = None
+
+    def _remove_from_index(self, material, attr_name, value):
+        index = self.indexes[attr_name]
+        try:
+            bucket = index.get(value)
+        except TypeError:
+            return
+        if bucket is not None and material in bucket:
+            del bucket[material]
+            if not bucket:
+                del index[value]
+            return True
+        return False
+
+    def add_to_indexes(self, material):
+        """マテリアルを、全ての索引に登録する。"""
+        for attr_name in self.indexes:
+            self._add_to_index(material, attr_name, getattr(material, attr_name, None))
+
+    def remove_from_indexes(self, material):
+        """マテリアルを、全ての索引から取り除く。"""
+        for attr_name in self.indexes:
+            self._remove_from_index(material, attr_name, getattr(material, attr_name, None))
+
+    def on_material_change(self, material, attr_name, old_value, new_value):
+        """マテリアルの属性が変更された際に、マテリアルから呼ばれる。
+
+        索引を作っている属性が変更された場合、索引を更新します。
+        レイヤに登録されていない(削除済みや、まだ配置していない)マテリアルは無視されます。
+        変更を記録している場合は、マテリアルのいるセルを記録します。
+
+        """
+        if attr_name in self.indexes:
+            if self._remove_from_index(material, attr_name, old_value):
+                self._add_to_index(material, attr_name, new_value)
+        if self.trackers and attr_name not in UNTRACKED_ATTRS and material.x is not None:
+            self.mark_dirty(material.x, material.y)
+
+    def watches(self, attr_name):
+        """その属性が変更された際に、on_material_changeを呼んでほしいかを返す。"""
+        return attr_name in self.indexes or (bool(self.trackers) and attr_name not in UNTRACKED_ATTRS)
+
+    def is_watching(self):
+        """watchesがTrueになる属性があるか、つまりマテリアルの属性の変更を知りたいかを返す。"""
+        return bool(self.indexes or self.trackers)
+
+    def watch_material(self, material):
+        """属性の変更を知りたい場合は、マテリアルのクラスがレイヤに変更を通知するようにする。"""
+        cls = type(material)
+        if cls not in self.watched_classes and self.is_watching():
+            # TileViewのような、マテリアルではないものは通知しない
+            watch_changes = getattr(cls, 'watch_changes', None)
+            if watch_changes is not None:
+                watch_changes()
+            self.watched_classes.add(cls)
+
+    def watch_materials(self):
+        """レイヤ内の全てのマテリアルについて、watch_materialを呼ぶ。索引や記録を始めた際に使います。"""
+        if self.layer is not None:
+            for material in self.materials():
+                self.watch_material(material)
+
+    def start_tracking(self, name='default'):
+        """nameという名前で、変更されたセルの記録を始める。既に記録していたセルは破棄されます。
+
+        varsのようなリストや辞書の中身を書き換えた場合は記録されないので、マテリアルのmark_dirtyを呼んでください。
+
+        """
+        self.trackers[name] = set()
+        self.watch_materials()
+
+    def stop_tracking(self, name='default'):
+        """nameという名前での、変更されたセルの記録をやめる。"""
+        self.trackers.pop(name, None)
+
+    def mark_dirty(self, x, y):
+        """(x, y)のセルを、全ての記録に変更されたとして記録する。記録していなければ何もしません。"""
+        for dirty in self.trackers.values():
+            dirty.add((x, y))
+
+    def pop_dirty(self, name='default'):
+        """nameという名前で記録した、変更されたセルのセットを返し、記録を空にする。"""
+        dirty = self.trackers.get(name)
+        if dirty is None:
+            return set()
+        self.trackers[name] = set()
+        return dirty
+
+    def _get_candidates(self, kwargs):
+        """検索条件に合うかもしれないマテリアルを返す。
+
+        索引のある属性が検索条件にあれば、その中で一番候補の少ない索引を使います。
+        索引が使えなければ、レイヤ内の全てのマテリアルが候補です。
+
+        """
+        candidates = None
+        for key, value in kwargs.items():
+            index = self.indexes.get(key)
+            if index is None:
+                continue
+            try:
+                bucket = index.get(value, {})
+            except TypeError:
+                continue
+            if candidates is None or len(bucket) < len(candidates):
+                candidates = bucket
+
+        if candidates is None:
+            return self.materials()
+        # 検索中に削除されることもあるので、その時点での一覧を返す
+        return list(candidates)
+
     def get(self, **kwargs):
         """レイヤ内のマテリアルを検索する。"""
-        for _, _, material in self.all():
-            for key, value in kwargs.items():
-                attr = getattr(material, key, None)
-                if attr != value:
-                    break
-            else:
-                return material
+        for material in self.filter(**kwargs):
+            return material
 
     def filter(self, **kwargs):
         """レイヤ内のマテリアルを検索する。"""
-        for _, _, material in self.all():
+        for material in self._get_candidates(kwargs):
             for key, value in kwargs.items():
                 attr = getattr(material, key, None)
                 if attr != value:
@@ -60,48 +249,203 @@ class BaseLayer:
         既にほかの場所で作成したマテリアルを流用したい場合は、インスタンスを渡すだけで済みます。
 
         """
-        canvas = self.canvas
-        system = canvas.system
-
         # x,y座標の指定がなければ座標を探す
         if x is None or y is None:
             x, y = self.get_random_empty_space(material_cls)
 
+        material = self.build_material(material_cls, x, y, kwargs)
+        self.draw_material(material)
+        self.put_material(material, x, y)
+        return material
+
+    def create_materials_bulk(self, materials):
+        """(クラス, x, y, kwargs)のイテラブルから、マテリアルをまとめて生成・配置・描画する。
+
+        create_materialを繰り返し呼ぶのと同じ結果になりますが、キャンバスへの描画はまとめて1度に行い、
+        重なり順もレイヤごとに1度だけ整えます。マップ全体のように、大量のマテリアルを作る場合に使ってください。
+        生成したマテリアルのリストを返します。
+
+        """
+        created = []
+        for material_cls, x, y, kwargs in materials:
+            if x is None or y is None:
+                x, y = self.get_random_empty_space(material_cls)
+            material = self.build_material(material_cls, x, y, kwargs)
+            self.put_material(material, x, y)
+            created.append(material)
+        self.draw_materials(created)
+        return created
+
+    def build_material(self, material_cls, x, y, kwargs):
+        """マテリアルを生成する。レイヤへの配置や描画は行いません。"""
         kwargs.update({
-            'system': system,
-            'canvas': canvas,
+            'system': self.canvas.system,
+            'canvas': self.canvas,
             'layer': self,
             'x': x,
             'y': y,
         })
-        material = material_cls(**kwargs)
-
-        id = self.canvas.create_image(
-            x*settings.CELL_WIDTH,
-            y*settings.CELL_HEIGHT,
-            image=material.image, anchor='nw'
-        )
-        material.id = id
-        self.put_material(material, x, y)
-        return material
+        return material_cls(**kwargs)
 
     def delete_material(self, material):
         """マテリアルを削除する。"""
         raise NotImplementedError
 
-    def get_empty_space(self, material=None):
-        """空いているスペースを全てyieldで返す。
+    def draw_material(self, material):
+        """マテリアルをキャンバスに描画し、重なり順を整える。
+
+        キャンバスが表示範囲外のセルを描画しない設定(culling)の場合、表示範囲外のマテリアルは描画されず、
+        material.idはNoneになります。
+
+        """
+        if not self.canvas.is_in_view(material.x, material.y):
+            material.id = None
+            return
+        material.id = self.canvas.create_material_image(material, tag=self.tag)
+        self.stack_material(material)
+
+    def draw_materials(self, materials):
+        """複数のマテリアルをまとめて描画し、最後に重なり順を整える。"""
+        canvas = self.canvas
+        in_view = []
+        for material in materials:
+            if canvas.is_in_view(material.x, material.y):
+                in_view.append(material)
+            else:
+                material.id = None
+        if not in_view:
+            return
+        for material, id in zip(in_view, canvas.create_material_images(in_view, tag=self.tag)):
+            material.id = id
+        self.stack_materials(in_view)
+
+    def erase_material(self, material):
+        """マテリアルをキャンバス上から消す。レイヤからは削除しません。"""
+        if material.id is not None:
+            self.canvas.delete_material_image(material.id, tag=self.tag)
+            material.id = None
+
+    def refresh_material(self, material):
+        """マテリアルが表示範囲内ならば描画し、範囲外ならばキャンバス上から消す。"""
+        in_view = self.canvas.is_in_view(material.x, material.y)
+        if in_view and material.id is None:
+            self.draw_material(material)
+        elif not in_view and material.id is not None:
+            self.erase_material(material)
+
+    def stack_material(self, material):
+        """描画したマテリアルの重なり順を整える。レイヤごとにオーバーライドしています。"""
+        pass
+
+    def stack_materials(self, materials):
+        """まとめて描画したマテリアルの重なり順を整える。
+
+        デフォルトでは1つずつstack_materialを呼びます。
+        レイヤのタグを使って、まとめて重なり順を変えられる場合はオーバーライドしてください。
+
+        """
+        for material in materials:
+            self.stack_material(material)
+
+    def is_empty_space(self, x, y, material=None):
+        """その座標が、materialにとって空いているかを返す。
 
         マテリアルの種類によって空いているの定義が異なるため、それぞれでオーバーライドしています。
 
         """
         raise NotImplementedError
 
+    def is_free(self, x, y):
+        """その座標を、empty_spacesに含めるべきかを返す。
+
+        empty_spacesは、どのマテリアルにとっても空いている可能性のある座標の集合です。
+        実際に空いているかはis_empty_spaceで確認されます。
+
+        """
+        return self.is_empty_space(x, y)
+
+    def get_empty_space(self, material=None):
+        """空いているスペースを全てyieldで返す。"""
+        for x, y, _ in self.all():
+            if self.is_empty_space(x, y, material):
+                yield x, y
+
+    @property
+    def empty_spaces(self):
+        """空いている可能性のある座標の集合(RandomSet)。
+
+        座標はy * 横のセル数 + xという数値で格納されます。
+        最初に参照された時点でレイヤ全体から作成され、以後はマテリアルの配置や削除に合わせて更新されます。
+
+        """
+        if self._empty_spaces is None:
+            self._empty_spaces = RandomSet(
+                self._xy_to_cell(x, y) for x, y, _ in self.all() if self.is_free(x, y)
+            )
+        return self._empty_spaces
+
+    def update_empty_space(self, x, y):
+        """empty_spacesを、その座標の今の状態に合わせて更新する。"""
+        if self._empty_spaces is not None:
+            cell = self._xy_to_cell(x, y)
+            if self.is_free(x, y):
+                self._empty_spaces.add(cell)
+            else:
+                self._empty_spaces.discard(cell)
+
+    def _xy_to_cell(self, x, y):
+        return y * len(self.layer[0]) + x
+
+    def _cell_to_xy(self, cell):
+        y, x = divmod(cell, len(self.layer[0]))
+        return x, y
+
     def get_random_empty_space(self, material=None):
-        """空いているスペースをランダムで1つ返す。"""
+        """空いているスペースをランダムで1つ返す。
+
+        empty_spacesからランダムに選び、空いていればその座標を返します。
+        random_tries回試しても見つからなければ、レイヤ全体から探します。
+
+        """
+        empty_spaces = self.empty_spaces
+        for _ in range(self.random_tries):
+            if not empty_spaces:
+                break
+            x, y = self._cell_to_xy(empty_spaces.choice())
+            if self.is_empty_space(x, y, material):
+                return x, y
+
         empty_spaces = list(self.get_empty_space(material))
         return random.choice(empty_spaces)
 
+    def sample_empty_spaces(self, k, material=None):
+        """空いているスペースを、重複しないようにランダムでk個返す。
+
+        大量の敵やアイテムを一度に配置したい場合に使ってください。
+        空いているスペースがk個に満たない場合は、ValueErrorを送出します。
+
+        """
+        empty_spaces = self.empty_spaces
+        result = {}
+        # 空いているスペースの大半を使う場合は、ランダムに選ぶよりも全体から選んだ方が速い
+        if k * 2 <= len(empty_spaces):
+            max_failures = k * 2 + self.random_tries
+            failures = 0
+            while len(result) < k and failures < max_failures:
+                x, y = self._cell_to_xy(empty_spaces.choice())
+                if (x, y) not in result and self.is_empty_space(x, y, material):
+                    result[x, y] = None
+                else:
+                    failures += 1
+
+            if len(result) == k:
+                return list(result)
+
+        candidates = [
+            (x, y) for x, y in map(self._cell_to_xy, empty_spaces) if self.is_empty_space(x, y, material)
+        ]
+        return random.sample(candidates, k)
+
     def __getitem__(self, item):
         """self.layerにデリゲート。
 
@@ -113,21 +457,104 @@ class BaseLayer:
 
 
 class BaseTileLayer(BaseLayer):
-    """背景レイヤの基底クラス。"""
+    """背景レイヤの基底クラス。
+
+    各タイルの通行可否を、passabilityという1セル1バイトの配列(bytearray)にも保持しています。
+    is_publicがgeneric.return_true、generic.return_false、generic.tile.only_playerのいずれかであれば、
+    タイルのis_publicを呼び出さずに通行可否を判定できます。
+    numpyがインストールされていれば、get_passability_arrayでnumpyの2次元配列としても扱えます。
+
+    タイルが変更されるたびにversionが1増えます。経路探索(pathfinder)のキャッシュなど、
+    タイルの通行可否から計算したものを使いまわす際に、まだ使えるかの判定に使ってください。
+
+    """
+
+    tag = 'tile'
 
     def __init__(self, x_length, y_length):
         super().__init__()
         self.x_length = x_length
         self.y_length = y_length
         self.first_tile_id = None
+        self.passability = None
+        self.version = 0
+        self.pathfinder = PathFinder(self)
+        self.fov = FieldOfView(self)
 
     def create(self):
         """レイヤーの作成、描画を行う。"""
-        self.layer = [[None for _ in range(self.x_length)] for _ in range(self.y_length)]
+        self.layer = self.create_grid()
+        self.passability = bytearray(self.x_length * self.y_length)
+        self.version += 1
+        self.fov.clear()
+        self.clear_indexes()
+        self._empty_spaces = None
         self.create_layer()
 
-    def get_empty_space(self, material=None):
-        """空いているスペースを全てyieldで返す。
+    def create_grid(self):
+        """タイルを格納する、空の2次元リストを返す。"""
+        return [[None for _ in range(self.x_length)] for _ in range(self.y_length)]
+
+    def put_material(self, material, x, y):
+        """タイルを配置する。元々あったタイルは索引から取り除かれます。"""
+        old_tile = self[y][x]
+        if old_tile is not None and old_tile is not material:
+            self.remove_from_indexes(old_tile)
+        super().put_material(material, x, y)
+        self.passability[y * self.x_length + x] = self.get_passability_code(material)
+        self.version += 1
+        self.fov.on_tile_change(x, y)
+        self.update_empty_space(x, y)
+
+    @staticmethod
+    def get_passability_code(tile):
+        """タイルのis_publicから、const.PUBLICのような通行可否の値を返す。"""
+        func = getattr(tile.is_public, '__func__', tile.is_public)
+        return PASSABILITY_CODES.get(func, const.CUSTOM)
+
+    def is_public(self, x, y, obj=None):
+        """その座標のタイルが、objにとって通行可能かを返す。
+
+        tile_layer[y][x].is_public(obj=obj)と同じ結果になりますが、
+        よく使われる関数の場合はpassabilityだけで判定するため高速です。
+
+        """
+        code = self.passability[y * self.x_length + x]
+        if code == const.PUBLIC:
+            return True
+        elif code == const.PRIVATE:
+            return False
+        elif code == const.ONLY_PLAYER:
+            return obj is not None and obj.kind == const.PLAYER
+        return self[y][x].is_public(obj=obj)
+
+    def get_passability_array(self):
+        """passabilityを、(y_length, x_length)のnumpy配列として返す。
+
+        配列はpassabilityとメモリを共有しているため、タイルの変更も反映されます。
+        書き換えはしないでください。
+
+        """
+        if numpy is None:
+            raise Exception('get_passability_arrayを使うには、numpyをインストールしてください。')
+        array = numpy.frombuffer(self.passability, dtype=numpy.uint8)
+        return array.reshape(self.y_length, self.x_length)
+
+    def filter_passability(self, code):
+        """通行可否がcode(const.PUBLIC等)の座標を、x, yの形式で全て返す。"""
+        if numpy is not None:
+            for y, x in numpy.argwhere(self.get_passability_array() == code).tolist():
+                yield x, y
+        else:
+            code_bytes = bytes([code])
+            cell = self.passability.find(code_bytes)
+            while cell != -1:
+                y, x = divmod(cell, self.x_length)
+                yield x, y
+                cell = self.passability.find(code_bytes, cell + 1)
+
+    def is_empty_space(self, x, y, material=None):
+        """その座標が空いているかを返す。
 
         is_publicがTrueのタイルであれば空いているとみなします。
         ランダムにゴールタイルなどを設定したい場合には便利です。
@@ -138,21 +565,76 @@ class BaseTileLayer(BaseLayer):
         material引数は他レイヤのメソッドの引数と合わせる必要があるために定義していますが、使いません。
 
         """
-        for x, y, tile in self.all():
-            if tile.is_public():
-                yield x, y
+        return self[y][x] is not None and self.is_public(x, y)
+
+    def watches(self, attr_name):
+        """is_publicが変わると空いているスペースも変わるため、is_publicの変更も監視する。"""
+        return attr_name == 'is_public' or super().watches(attr_name)
+
+    def is_watching(self):
+        return True
+
+    def watch_materials(self):
+        """常に変更を知りたいので、配置した際に通知するようにしてある。"""
+        pass
+
+    def on_material_change(self, material, attr_name, old_value, new_value):
+        super().on_material_change(material, attr_name, old_value, new_value)
+        if attr_name == 'is_public' and self.layer is not None and self[material.y][material.x] is material:
+            self.passability[material.y * self.x_length + material.x] = self.get_passability_code(material)
+            self.version += 1
+            self.fov.on_tile_change(material.x, material.y)
+            self.update_empty_space(material.x, material.y)
 
     def create_material(self, material_cls, x=None, y=None, **kwargs):
         material = super().create_material(material_cls, x=x, y=y, **kwargs)
-        self.canvas.lower(material.id)  # 背景は一番下に配置する
 
         # 一番はじめのタイルはIDを保存しておきます。
-        # オブジェクトはどんどん上に描画され、タイルはどんどん下に描画され、アイテムは最初のタイルの上に描画されます。
-        # 結果として、オブジェクト アイテム タイル という順番での重なりで描画されます。
         if self.first_tile_id is None:
             self.first_tile_id = material.id
         return material
 
+    def create_materials_bulk(self, materials):
+        created = super().create_materials_bulk(materials)
+        if self.first_tile_id is None and created:
+            self.first_tile_id = created[0].id
+        return created
+
+    def draw_material(self, material):
+        """タイルを描画する。
+
+        キャンバスがタイルをチャンクにまとめて描画する設定の場合、タイル単体では描画せず、
+        タイルを含むチャンクを描画しなおすよう記録します。
+
+        """
+        if self.canvas.tile_chunk_size:
+            material.id = None
+            self.canvas.mark_tile_chunk(material.x, material.y)
+        else:
+            super().draw_material(material)
+
+    def draw_materials(self, materials):
+        if self.canvas.tile_chunk_size:
+            for material in materials:
+                self.draw_material(material)
+        else:
+            super().draw_materials(materials)
+
+    def erase_material(self, material):
+        """タイルをキャンバス上から消す。チャンクで描画している場合は、チャンクを描画しなおします。"""
+        if self.canvas.tile_chunk_size:
+            self.canvas.mark_tile_chunk(material.x, material.y)
+        else:
+            super().erase_material(material)
+
+    def stack_material(self, material):
+        # オブジェクトはどんどん上に描画され、タイルはどんどん下に描画され、アイテムは一番上にあるタイルの上に描画されます。
+        # 結果として、オブジェクト アイテム タイル という順番での重なりで描画されます。
+        self.canvas.lower(material.id)  # 背景は一番下に配置する
+
+    def stack_materials(self, materials):
+        self.canvas.lower(self.tag)
+
     def delete_material(self, material):
         """タイルを削除する。
 
@@ -163,50 +645,151 @@ class BaseTileLayer(BaseLayer):
         その後にcreate_materialで、新しいタイルを設定してください。
 
         """
-        self.canvas.delete(material.id)
+        self.remove_from_indexes(material)
+        self.erase_material(material)
 
 
 class BaseObjectLayer(BaseLayer):
-    """オブジェクトレイヤの基底クラス。"""
+    """オブジェクトレイヤの基底クラス。
+
+    layer内の2次元リストとは別に、存在しているオブジェクトとその座標を
+    positions辞書({オブジェクト: (x, y)})として保持しています。
+    存在するオブジェクトだけを見たい場合、マップ全体を走査せずに済みます。
+
+    また、配置されたオブジェクトは行動順を管理するscheduler(TurnQueue)にも登録され、
+    削除されると登録が解除されます。
+
+    """
+    tag = 'object'
 
     def __init__(self):
         super().__init__()
         self.tile_layer = None
+        self.positions = {}
+        self.scheduler = TurnQueue()
 
     def create(self):
         """レイヤーの作成、描画を行う。"""
         self.layer = [[None for _ in range(self.tile_layer.x_length)] for _ in range(self.tile_layer.y_length)]
+        self.positions = {}
+        self.scheduler = TurnQueue()
+        self.clear_indexes()
+        self._empty_spaces = None
         self.create_layer()
 
-    def get_empty_space(self, material=None):
-        """空いているスペースを全てyieldで返す。
+    def put_material(self, material, x, y):
+        """オブジェクトを配置し、positionsにも登録する。
+
+        初めて配置されたオブジェクトならば、schedulerにも登録します。すぐに行動できる状態になります。
+
+        """
+        super().put_material(material, x, y)
+        if material not in self.positions:
+            self.scheduler.add(material)
+        self.positions[material] = (x, y)
+        self.update_empty_space(x, y)
+
+    def move_material(self, material, x, y):
+        """オブジェクトをレイヤ内で移動させる。
+
+        移動元をNoneにし、移動先にオブジェクトを配置し、オブジェクトのx, y属性も更新します。
+        キャンバス上の表示は変更しないので、必要ならばsystem.simple_move等を呼んでください。
+
+        """
+        self[material.y][material.x] = None
+        self.update_empty_space(material.x, material.y)
+        self.mark_dirty(material.x, material.y)
+        material.x = x
+        material.y = y
+        self.put_material(material, x, y)
+        self.refresh_material(material)
+
+    def all(self, include_none=True):
+        """レイヤ内のものを全て返す。
+
+        include_noneがFalseの場合は、マップ全体ではなくpositionsから存在しているオブジェクトだけを返します。
+        順番はinclude_none=Trueの場合と同じく、左上から右下へ向かう順番です。
+
+        """
+        if include_none:
+            yield from super().all(include_none=True)
+        else:
+            # 呼び出し側で削除されることもあるので、その時点での一覧をリストとして作っておく
+            positions = sorted(self.positions.items(), key=lambda item: (item[1][1], item[1][0]))
+            for obj, (x, y) in positions:
+                yield x, y, obj
+
+    def query_rect(self, x0, y0, x1, y1):
+        """(x0, y0)から(x1, y1)までの範囲(両端を含む)にあるオブジェクトを、x, y, objの形式で返す。
+
+        範囲のセル数と存在するオブジェクト数のうち、少ない方を走査します。
+        マップの範囲外を指定した場合は、マップ内に収まるよう切り詰められます。
+
+        """
+        x0 = max(x0, 0)
+        y0 = max(y0, 0)
+        x1 = min(x1, self.tile_layer.x_length - 1)
+        y1 = min(y1, self.tile_layer.y_length - 1)
+        if x0 > x1 or y0 > y1:
+            return
+
+        area = (x1 - x0 + 1) * (y1 - y0 + 1)
+        if area <= len(self.positions):
+            for y in range(y0, y1 + 1):
+                row = self[y]
+                for x in range(x0, x1 + 1):
+                    obj = row[x]
+                    if obj is not None:
+                        yield x, y, obj
+        else:
+            for obj, (x, y) in list(self.positions.items()):
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    yield x, y, obj
+
+    def query_radius(self, x, y, radius):
+        """(x, y)からの距離がradius以内にあるオブジェクトを、x, y, objの形式で返す。"""
+        for obj_x, obj_y, obj in self.query_rect(x - radius, y - radius, x + radius, y + radius):
+            if (obj_x - x) ** 2 + (obj_y - y) ** 2 <= radius ** 2:
+                yield obj_x, obj_y, obj
+
+    def is_empty_space(self, x, y, material=None):
+        """その座標が空いているかを返す。
 
         そのオブジェクトを受け入れるタイルであり、
         まだオブジェクトがない座標ならばOK。
 
         """
-        for x, y, tile in self.tile_layer.all():
-            if tile.is_public(obj=material) and self[y][x] is None:
-                yield x, y
+        return self[y][x] is None and self.tile_layer.is_public(x, y, obj=material)
+
+    def is_free(self, x, y):
+        """オブジェクトがない座標を、empty_spacesに含める。"""
+        return self[y][x] is None
 
     def clear(self):
         """layer内を全てNoneにし、表示中のオブジェクトを削除します。"""
         for x, y, obj in self.all(include_none=False):
             self.delete_material(obj)
 
-    def create_material(self, material_cls, x=None, y=None, **kwargs):
-        material = super().create_material(material_cls, x=x, y=y, **kwargs)
+    def stack_material(self, material):
         self.canvas.lift(material.id)  # オブジェクトは一番上に配置する
-        return material
+
+    def stack_materials(self, materials):
+        self.canvas.lift(self.tag)
 
     def delete_material(self, material):
         """マテリアルを削除する"""
         self[material.y][material.x] = None
-        self.canvas.delete(material.id)
+        self.positions.pop(material, None)
+        self.scheduler.discard(material)
+        self.remove_from_indexes(material)
+        self.update_empty_space(material.x, material.y)
+        self.mark_dirty(material.x, material.y)
+        self.erase_material(material)
 
 
 class BaseItemLayer(BaseLayer):
     """アイテムレイヤの基底クラス。"""
+    tag = 'item'
 
     def __init__(self):
         super().__init__()
@@ -220,22 +803,33 @@ class BaseItemLayer(BaseLayer):
 
         """
         self[y][x].append(material)
+        self.add_to_indexes(material)
+        self.watch_material(material)
+        self.mark_dirty(x, y)
 
     def create(self):
         """レイヤーの作成、描画を行う。"""
         self.layer = [[[] for _ in range(self.tile_layer.x_length)] for _ in range(self.tile_layer.y_length)]
+        self.clear_indexes()
         self.create_layer()
 
-    def get_empty_space(self, material=None):
-        """空いているスペースを全てyieldで返す。
+    def materials(self):
+        """レイヤ内に存在するアイテムを、1つずつ返す。"""
+        for _, _, items in self.all(include_none=False):
+            yield from items
+
+    def is_empty_space(self, x, y, material=None):
+        """そのアイテムにとって、配置可能な座標かを返す。
 
-        そのアイテムにとって、配置可能な座標を返します。
         tileのis_public(引数なし)がTrueであれば配置可能と考えます。
 
         """
-        for x, y, tile in self.tile_layer.all():
-            if tile.is_public():
-                yield x, y
+        return self.tile_layer.is_public(x, y)
+
+    @property
+    def empty_spaces(self):
+        """アイテムは1座標に複数置けるため、背景レイヤのempty_spacesをそのまま使う。"""
+        return self.tile_layer.empty_spaces
 
     def clear(self):
         """layer内を全てNoneにし、表示中のオブジェクトを削除します。"""
@@ -243,34 +837,15 @@ class BaseItemLayer(BaseLayer):
             for item in items:
                 self.delete_material(item)
 
-    def create_material(self, material_cls, x=None, y=None, **kwargs):
-        material = super().create_material(material_cls, x=x, y=y, **kwargs)
-        self.canvas.lift(material.id, self.tile_layer.first_tile_id)  # 一番上にある背景の上
-        return material
+    def stack_material(self, material):
+        self.canvas.lift(material.id, self.tile_layer.tag)  # 一番上にある背景の上
+
+    def stack_materials(self, materials):
+        self.canvas.lift(self.tag, self.tile_layer.tag)
 
     def delete_material(self, material):
         """マテリアルを削除する"""
         self[material.y][material.x].remove(material)
-        self.canvas.delete(material.id)
-
-    def get(self, **kwargs):
-        """レイヤ内のアイテムを検索する。"""
-        for _, _, items in self.all():
-            for item in items:
-                for key, value in kwargs.items():
-                    attr = getattr(item, key, None)
-                    if attr != value:
-                        break
-                else:
-                    return item
-
-    def filter(self, **kwargs):
-        """レイヤ内のアイテムを検索する。"""
-        for _, _, items in self.all():
-            for item in items:
-                for key, value in kwargs.items():
-                    attr = getattr(item, key, None)
-                    if attr != value:
-                        break
-                else:
-                    yield item
+        self.remove_from_indexes(material)
+        self.mark_dirty(material.x, material.y)
+        self.erase_material(material)
@@ -0,0 +1,131 @@
+"""serializers.dump_binaryで保存したファイルから、レイヤを作成するモジュール。
+
+BinaryTileLayerは、ファイルをmmapした領域をFlyweightTileLayerのcellsとしてそのまま使います。
+タイルのインスタンスはパレットの種類の数だけ作られ、各セルのタイルは取得した際にビューとして作られます。
+キャンバスに描画するのも、表示範囲内のセルだけです。
+
+オブジェクトとアイテムは、何かがあるセルだけを作成します。
+
+    binary_map = serializers.BinaryMap('save.bin')
+    tile_layer = BinaryTileLayer(binary_map)
+    object_layer = BinaryObjectLayer(binary_map)
+    item_layer = BinaryItemLayer(binary_map)
+
+"""
+from broccoli import serializers
+from .base import BaseObjectLayer, BaseItemLayer
+from .flyweight import FlyweightTileLayer
+
+
+def get_binary_map(binary_map):
+    """BinaryMapか、ファイルのパスからBinaryMapを返す。"""
+    if isinstance(binary_map, serializers.BinaryMap):
+        return binary_map
+    return serializers.BinaryMap(binary_map)
+
+
+def iter_binary_cells(binary_map, layer_name, empty):
+    """パレットでemptyではないセルを、(x, y, デコードしたセルの内容のコピー)として返す。"""
+    copiers = [serializers.get_cell_copier(cell) for cell in binary_map.get_palette(layer_name)]
+    empty_indexes = {index for index, cell in enumerate(binary_map.get_palette(layer_name)) if cell == empty}
+    x_length = binary_map.x_length
+    for cell, index in enumerate(binary_map.get_cells(layer_name)):
+        if index not in empty_indexes:
+            y, x = divmod(cell, x_length)
+            yield x, y, copiers[index]()
+
+
+class BinaryTileLayer(FlyweightTileLayer):
+    """serializers.dump_binaryで保存したファイルから、背景を作成する。
+
+    cellsは、ファイルをmmapした領域です。タイルを変更しても、ファイルには書き込まれません。
+    読み込んだファイルに保存しなおす場合は、先にrelease_fileを呼んでください。
+
+    """
+
+    def __init__(self, binary_map):
+        binary_map = get_binary_map(binary_map)
+        super().__init__(binary_map.x_length, binary_map.y_length)
+        self.binary_map = binary_map
+
+    def create_grid(self):
+        rows = super().create_grid()
+        for material_cls, kwargs in self.binary_map.get_palette('tile_layer'):
+            index = self.add_prototype(material_cls, kwargs)
+            try:
+                self.palette_indexes[(material_cls, tuple(sorted(kwargs.items())))] = index
+            except TypeError:
+                pass
+        self.cells = self.binary_map.get_cells('tile_layer')
+        return rows
+
+    def get_material_classes(self):
+        return {material_cls for material_cls, _ in self.binary_map.get_palette('tile_layer')}
+
+    def release_file(self):
+        """cellsをメモリ上にコピーし、ファイルのmmapを閉じる。"""
+        cells = self.cells
+        if isinstance(cells, memoryview):
+            self.cells = memoryview(bytearray(cells)).cast(cells.format)
+            cells.release()
+        self.binary_map.close()
+
+    def create_layer(self):
+        codes = self.palette_codes
+        self.passability[:] = bytes(map(codes.__getitem__, self.cells))
+        self.version += 1
+        if self.indexes:
+            for material in self.materials():
+                self.add_to_indexes(material)
+
+        materials = list(self.get_materials_in_view())
+        self.draw_materials(materials)
+        if materials:
+            self.first_tile_id = materials[0].id
+
+    def get_materials_in_view(self):
+        """キャンバスの表示範囲内のタイルを返す。cullingしない場合は全てのタイルです。"""
+        view = self.canvas.view
+        if view is None:
+            view = (0, 0, self.x_length - 1, self.y_length - 1)
+        x0, y0, x1, y1 = view
+        get_tile = self.get_tile
+        for y in range(y0, y1 + 1):
+            start = y * self.x_length
+            for cell in range(start + x0, start + x1 + 1):
+                yield get_tile(cell)
+
+
+class BinaryObjectLayer(BaseObjectLayer):
+    """serializers.dump_binaryで保存したファイルから、オブジェクトを作成する。"""
+
+    def __init__(self, binary_map):
+        super().__init__()
+        self.binary_map = get_binary_map(binary_map)
+
+    def create_layer(self):
+        self.create_materials_bulk(
+            (obj_cls, x, y, kwargs)
+            for x, y, (obj_cls, kwargs) in iter_binary_cells(self.binary_map, 'object_layer', None)
+        )
+
+    def get_material_classes(self):
+        return {cell[0] for cell in self.binary_map.get_palette('object_layer') if cell is not None}
+
+
+class BinaryItemLayer(BaseItemLayer):
+    """serializers.dump_binaryで保存したファイルから、アイテムを作成する。"""
+
+    def __init__(self, binary_map):
+        super().__init__()
+        self.binary_map = get_binary_map(binary_map)
+
+    def create_layer(self):
+        self.create_materials_bulk(
+            (item_cls, x, y, kwargs)
+            for x, y, items in iter_binary_cells(self.binary_map, 'item_layer', [])
+            for item_cls, kwargs in items
+        )
+
+    def get_material_classes(self):
+        return {item[0] for cell in self.binary_map.get_palette('item_layer') for item in cell}
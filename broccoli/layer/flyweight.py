@@ -0,0 +1,256 @@
+"""同じタイルを1つのインスタンスで共有する、フライウェイトなタイルレイヤを提供するモジュール。
+
+SimpleTileLayerやRandomTileLayerで作った背景は、ほとんどのセルが同じクラス・同じ引数のタイルです。
+通常のタイルレイヤはセルごとにタイルのインスタンスを作りますが、FlyweightTileLayerは
+
+- 重複しないタイルの見本(プロトタイプ)のリストであるpalette
+- 各セルがpaletteの何番目を使っているかを表す、1セル2バイトの配列cells
+- 各セルのキャンバス上のIDを表す配列ids
+
+だけを保持します。tile_layer[y][x]でタイルを取得すると、プロトタイプにx, y座標を付けた軽いビュー(TileView)が返されます。
+
+ビューの属性を変更すると、そのセルだけ普通のタイルのインスタンスに置き換わります(コピーオンライト)。
+
+    tile = tile_layer[y][x]
+    tile.is_public = return_false  # (x, y)のタイルだけが変わる
+    tile = tile_layer[y][x]  # 置き換わった後のタイルを取得しなおす
+
+置き換わる前に取得していたビューは、元のプロトタイプを指したままです。変更した後は、タイルを取得しなおしてください。
+varsのようなリストや辞書の中身を書き換えると全てのセルに影響するので、先にtile_layer.customize(x, y)を呼んでください。
+
+"""
+import inspect
+import types
+from array import array
+from .base import BaseTileLayer
+from .tile import SimpleTileLayer, RandomTileLayer
+
+# cellsで、そのセルがpaletteではなくcustomizedのタイルを使っていることを表す値
+CUSTOM_TILE = 0xFFFF
+
+
+class TileView:
+    """プロトタイプのタイルに、セルの座標を付けたビュー。
+
+    属性の参照はプロトタイプにデリゲートされ、プロトタイプのメソッドはビューのメソッドとして呼ばれます。
+    __class__はプロトタイプのクラスを返すので、isinstanceやJSONへの保存は普通のタイルと同じように扱えます。
+
+    """
+    __slots__ = ('_layer', '_cell', '_index')
+
+    def __init__(self, layer, cell, index):
+        object.__setattr__(self, '_layer', layer)
+        object.__setattr__(self, '_cell', cell)
+        object.__setattr__(self, '_index', index)
+
+    @property
+    def __class__(self):
+        return type(self._layer.palette[self._index])
+
+    @property
+    def prototype(self):
+        """このビューが指している、プロトタイプのタイル。"""
+        return self._layer.palette[self._index]
+
+    @property
+    def x(self):
+        return self._cell % self._layer.x_length
+
+    @property
+    def y(self):
+        return self._cell // self._layer.x_length
+
+    @property
+    def id(self):
+        return self._layer.ids[self._cell] or None
+
+    @id.setter
+    def id(self, value):
+        self._layer.ids[self._cell] = value or 0
+
+    def __getattr__(self, name):
+        if name in TileView.__slots__:
+            raise AttributeError(name)
+        prototype = self._layer.palette[self._index]
+        value = getattr(prototype, name)
+        # プロトタイプのメソッドは、selfがビューになるようにする
+        if inspect.ismethod(value) and value.__self__ is prototype:
+            value = types.MethodType(value.__func__, self)
+        return value
+
+    def __setattr__(self, name, value):
+        if name == 'id':
+            object.__setattr__(self, name, value)
+        else:
+            material = self._layer.customize(self.x, self.y)
+            setattr(material, name, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, TileView):
+            return NotImplemented
+        return self._layer is other._layer and self._cell == other._cell and self._index == other._index
+
+    def __hash__(self):
+        return hash((self._cell, self._index))
+
+    def __str__(self):
+        return type(self.prototype).__str__(self)
+
+
+class FlyweightRow:
+    """FlyweightTileLayerの1行分。tile_layer[y][x]のように、リストと同じく扱えます。"""
+    __slots__ = ('layer', 'y')
+
+    def __init__(self, layer, y):
+        self.layer = layer
+        self.y = y
+
+    def __len__(self):
+        return self.layer.x_length
+
+    def _get_cell(self, x):
+        x_length = self.layer.x_length
+        if x < 0:
+            x += x_length
+        if not 0 <= x < x_length:
+            raise IndexError('list index out of range')
+        return self.y * x_length + x
+
+    def __getitem__(self, x):
+        return self.layer.get_tile(self._get_cell(x))
+
+    def __setitem__(self, x, material):
+        self.layer.set_tile(self._get_cell(x), material)
+
+    def __iter__(self):
+        get_tile = self.layer.get_tile
+        start = self.y * self.layer.x_length
+        for cell in range(start, start + self.layer.x_length):
+            yield get_tile(cell)
+
+
+class FlyweightTileLayer(BaseTileLayer):
+    """同じタイルを、1つのプロトタイプで共有するタイルレイヤ。
+
+    create_materialに渡したクラスと引数の組み合わせごとに、プロトタイプが1つ作られます。
+    引数にリストや辞書のようなハッシュ化できない値がある場合や、インスタンスを渡した場合は、
+    そのセルだけ普通のタイルのインスタンスを使います。
+
+    プロトタイプは全てのセルで共有されるので、プロトタイプ自体の属性は変更しないでください。
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.palette = []
+        self.palette_kwargs = []
+        self.palette_indexes = {}
+        self.palette_codes = []
+        self.cells = None
+        self.ids = None
+        self.customized = {}
+
+    def create_grid(self):
+        size = self.x_length * self.y_length
+        self.palette = []
+        self.palette_kwargs = []
+        self.palette_indexes = {}
+        self.palette_codes = []
+        self.cells = array('H', [CUSTOM_TILE]) * size
+        self.ids = array('I', [0]) * size
+        self.customized = {}
+        return [FlyweightRow(self, y) for y in range(self.y_length)]
+
+    def get_tile(self, cell):
+        """セル番号のタイルを返す。"""
+        index = self.cells[cell]
+        if index == CUSTOM_TILE:
+            return self.customized.get(cell)
+        return TileView(self, cell, index)
+
+    def set_tile(self, cell, material):
+        """セル番号に、タイルを格納する。"""
+        if isinstance(material, TileView):
+            if material._layer is not self:
+                raise Exception('他のレイヤのタイルは配置できません。')
+            self.customized.pop(cell, None)
+            self.cells[cell] = material._index
+        else:
+            self.customized[cell] = material
+            self.cells[cell] = CUSTOM_TILE
+            self.ids[cell] = 0
+
+    def get_palette_index(self, material_cls, kwargs):
+        """クラスと引数の組み合わせに対応するプロトタイプの番号を返す。共有できない場合はNoneを返します。"""
+        if not isinstance(material_cls, type):
+            return None
+        try:
+            key = (material_cls, tuple(sorted(kwargs.items())))
+            index = self.palette_indexes.get(key)
+        except TypeError:
+            return None
+
+        if index is None:
+            index = self.add_prototype(material_cls, kwargs)
+            if index is not None:
+                self.palette_indexes[key] = index
+        return index
+
+    def add_prototype(self, material_cls, kwargs):
+        """プロトタイプをpaletteに追加し、その番号を返す。paletteが一杯ならばNoneを返します。"""
+        if len(self.palette) >= CUSTOM_TILE:
+            return None
+        # プロトタイプはどのセルにも属さないので、レイヤへ変更を通知しないよう後からlayerを設定する
+        prototype = material_cls(canvas=self.canvas, system=self.canvas.system, **kwargs)
+        prototype.layer = self
+        self.palette.append(prototype)
+        self.palette_kwargs.append((material_cls, kwargs))
+        self.palette_codes.append(super().get_passability_code(prototype))
+        return len(self.palette) - 1
+
+    def get_passability_code(self, tile):
+        """タイルの通行可否の値を返す。ビューならば、プロトタイプごとに求めておいた値を使います。"""
+        if isinstance(tile, TileView) and tile._layer is self:
+            return self.palette_codes[tile._index]
+        return super().get_passability_code(tile)
+
+    def build_material(self, material_cls, x, y, kwargs):
+        """タイルを生成する。共有できるタイルならば、プロトタイプを指すTileViewを返します。"""
+        index = self.get_palette_index(material_cls, kwargs)
+        if index is None:
+            return super().build_material(material_cls, x, y, kwargs)
+        return TileView(self, y * self.x_length + x, index)
+
+    def customize(self, x, y):
+        """(x, y)のタイルを、そのセル専用のタイルのインスタンスに置き換えて返す。
+
+        既に置き換わっていれば、そのタイルを返します。
+        キャンバス上のIDや索引は、新しいタイルに引き継がれます。
+
+        """
+        cell = y * self.x_length + x
+        index = self.cells[cell]
+        if index == CUSTOM_TILE:
+            return self.customized[cell]
+
+        view = TileView(self, cell, index)
+        material_cls, kwargs = self.palette_kwargs[index]
+        # varsなどを、プロトタイプと共有しないようにする
+        kwargs = {key: value.copy() if isinstance(value, (list, dict)) else value for key, value in kwargs.items()}
+        material = material_cls(
+            x=x, y=y, canvas=self.canvas, system=self.canvas.system, layer=self, **kwargs
+        )
+        material.id = view.id
+        self.remove_from_indexes(view)
+        self.set_tile(cell, material)
+        self.add_to_indexes(material)
+        self.watch_material(material)
+        return material
+
+
+class FlyweightSimpleTileLayer(FlyweightTileLayer, SimpleTileLayer):
+    """SimpleTileLayerの、フライウェイト版。"""
+
+
+class FlyweightRandomTileLayer(FlyweightTileLayer, RandomTileLayer):
+    """RandomTileLayerの、フライウェイト版。"""
@@ -0,0 +1,126 @@
+"""タイルレイヤ上の視界(どのセルが見えるか)を求めるモジュール。
+
+FieldOfViewは、タイルレイヤ1つに対して1つ作られ、tile_layer.fovとして使えます。
+視界は再帰的シャドウキャスティングで求め、通行できないタイル(passabilityがconst.PRIVATE)が視線を遮ります。
+
+求めた視界は、そのターンの間だけ(原点のx, 原点のy, 半径)ごとにキャッシュされます。
+システムがターンを進める際にnew_turnを呼ぶと、前のターンのキャッシュは全て破棄されます。
+ターンの途中でタイルが変更された場合は、そのタイルが視界の範囲に入るキャッシュだけが破棄されます。
+
+"""
+from broccoli import const
+
+# 8つの八分円を、基本の八分円に変換するための係数。(xx, xy, yx, yy)
+OCTANTS = [
+    (1, 0, 0, 1),
+    (0, 1, 1, 0),
+    (0, -1, 1, 0),
+    (-1, 0, 0, 1),
+    (-1, 0, 0, -1),
+    (0, -1, -1, 0),
+    (0, 1, -1, 0),
+    (1, 0, 0, -1),
+]
+
+
+class FieldOfView:
+    """タイルレイヤの視界を求めるクラス。
+
+    視界は、見えるセルの番号(y * x_length + x)のfrozensetです。
+    このシャドウキャスティングは対称ではないので、AからBが見えても、BからAが見えるとは限りません。
+    「モンスターからプレイヤーが見えるか」は、モンスターの位置から求めてください。
+
+    """
+    # 1ターンの間に保持する視界の数の上限。new_turnを呼ばないシステムで、キャッシュが増え続けないようにする
+    cache_size = 4096
+
+    def __init__(self, tile_layer):
+        self.tile_layer = tile_layer
+        self.turn = None
+        self.cache = {}
+
+    def clear(self):
+        """キャッシュを全て破棄する。"""
+        self.cache = {}
+
+    def new_turn(self, turn):
+        """ターンが進んだ際に呼ばれ、前のターンのキャッシュを破棄する。"""
+        if turn != self.turn:
+            self.turn = turn
+            self.cache = {}
+
+    def on_tile_change(self, x, y):
+        """(x, y)のタイルが変わった際に呼ばれ、その座標が範囲に入るキャッシュを破棄する。"""
+        if not self.cache:
+            return
+        for key in [key for key in self.cache if abs(key[0] - x) <= key[2] and abs(key[1] - y) <= key[2]]:
+            del self.cache[key]
+
+    def is_opaque(self, x, y):
+        """(x, y)のタイルが視線を遮るかを返す。"""
+        tile_layer = self.tile_layer
+        return tile_layer.passability[y * tile_layer.x_length + x] == const.PRIVATE
+
+    def get_visible_cells(self, x, y, radius):
+        """(x, y)から半径radius以内で見えるセルの番号を、frozensetとして返す。"""
+        key = (x, y, radius)
+        visible = self.cache.get(key)
+        if visible is None:
+            visible = self._compute(x, y, radius)
+            if len(self.cache) >= self.cache_size:
+                self.cache = {}
+            self.cache[key] = visible
+        return visible
+
+    def is_visible(self, from_x, from_y, radius, x, y):
+        """(from_x, from_y)から半径radius以内で、(x, y)が見えるかを返す。"""
+        return y * self.tile_layer.x_length + x in self.get_visible_cells(from_x, from_y, radius)
+
+    def _compute(self, x, y, radius):
+        visible = {y * self.tile_layer.x_length + x}
+        for xx, xy, yx, yy in OCTANTS:
+            self._cast_light(visible, x, y, 1, 1.0, 0.0, radius, xx, xy, yx, yy)
+        return frozenset(visible)
+
+    def _cast_light(self, visible, origin_x, origin_y, row, start, end, radius, xx, xy, yx, yy):
+        """1つの八分円について、rowの列から先の、傾きstartからendまでの範囲に光を当てる。"""
+        if start < end:
+            return
+        tile_layer = self.tile_layer
+        x_length = tile_layer.x_length
+        y_length = tile_layer.y_length
+        radius_squared = radius * radius
+        new_start = start
+        for distance in range(row, radius + 1):
+            dx = -distance - 1
+            dy = -distance
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                map_x = origin_x + dx * xx + dy * xy
+                map_y = origin_y + dx * yx + dy * yy
+                left_slope = (dx - 0.5) / (dy + 0.5)
+                right_slope = (dx + 0.5) / (dy - 0.5)
+                if start < right_slope:
+                    continue
+                elif end > left_slope:
+                    break
+
+                # マップの範囲外は、視線を遮る壁として扱う
+                in_map = 0 <= map_x < x_length and 0 <= map_y < y_length
+                if in_map and dx * dx + dy * dy <= radius_squared:
+                    visible.add(map_y * x_length + map_x)
+                opaque = not in_map or self.is_opaque(map_x, map_y)
+
+                if blocked:
+                    if opaque:
+                        new_start = right_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and distance < radius:
+                    blocked = True
+                    self._cast_light(visible, origin_x, origin_y, distance + 1, start, left_slope, radius, xx, xy, yx, yy)
+                    new_start = right_slope
+            if blocked:
+                break
@@ -1,8 +1,8 @@
 """アイテムレイヤの具象クラスを提供する。"""
-import json
 import random
 from broccoli import serializers
 from .base import BaseItemLayer
+from .jsonlib import JsonLayerMixin
 
 
 class EmptyItemLayer(BaseItemLayer):
@@ -29,6 +29,9 @@ class RandomItemLayer(BaseItemLayer):
             # ランダム配置の場合、向きや差分もランダムです。
             self.create_material(material_cls=item, direction=-1, diff=-1)
 
+    def get_material_classes(self):
+        return self.items
+
 
 class PythonItemLayer(BaseItemLayer):
     """Pythonコードからアイテムレイヤを作成する。
@@ -54,19 +57,28 @@ class PythonItemLayer(BaseItemLayer):
                     cls, kwargs = col
                     self.create_material(material_cls=cls, x=x, y=y, **kwargs)
 
+    def get_material_classes(self):
+        return {col[0] for row in self.data for cols in row for col in cols}
+
 
-class JsonItemLayer(BaseItemLayer):
-    """オブジェクトをJSONから読み込んで作成する。"""
+class JsonItemLayer(JsonLayerMixin, BaseItemLayer):
+    """オブジェクトをJSONから読み込んで作成する。serializers.dump_streamで保存したファイルも読み込めます。
 
-    def __init__(self, file_path):
+    ファイルは、インスタンス化の際ではなく、作成する際に読み込みます(JsonLayerMixin)。
+
+    """
+
+    def __init__(self, file_path, layer_name=None):
         super().__init__()
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file, cls=serializers.JsonDecoder)
-        self.data = data['layer']
+        self.file_path = file_path
+        self.layer_name = layer_name
+
+    def get_material_classes(self):
+        return {item[0] for row in self.get_loaded_rows() for col in row for item in col}
 
     def create_layer(self):
-        for y, row in enumerate(self.data):
+        for y, row in enumerate(self.get_rows()):
             for x, col in enumerate(row):
                 for item in col:
                     item_cls, kwargs = item
-                    self.create_material(material_cls=item_cls, x=x, y=y, **kwargs)
+                    self.create_material(material_cls=item_cls, x=x, y=y, **serializers.copy_kwargs(kwargs))
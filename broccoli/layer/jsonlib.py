@@ -0,0 +1,59 @@
+"""JSONファイルからレイヤを作成する、JsonTileLayerなどの共通処理を提供するモジュール。"""
+from broccoli import serializers
+
+
+class JsonLayerMixin:
+    """ファイルの読み込みを、実際に使う時まで遅らせるための共通処理。
+
+    tile_layer = JsonTileLayer('map.json')のようにクラス属性でレイヤを書いても、その時点ではファイルを読み込みません。
+    ゲームキャンバスがレイヤを使う際や、prepareで準備する際に初めて読み込みます。
+    読み込んだデータはserializers.load_layer_headerがキャッシュするので、同じファイルを使うレイヤ同士で共有されます。
+    ファイルが更新されていれば、次にレイヤを作成する際に読み込みなおします。
+    共有されたデータを書き換えないよう、マテリアルはserializers.copy_kwargsでコピーした引数で作成します。
+
+    layer_nameを指定すると、マネージャーを保存したファイルから、そのレイヤーを読み込みます。
+    SimpleGameManager.load_fileは、dump_streamやジャーナルで保存したファイルをこの方法で1行ずつ読み込みます。
+
+    """
+    file_path = None
+    layer_name = None  # マネージャーを保存したファイルならば、'tile_layer'などのレイヤー名
+    header = None
+    prepared_rows = None
+    prepared_header = None  # prepared_rowsを読み込んだ際のヘッダ
+
+    def load(self):
+        """ファイルのヘッダ(1行ずつ読み込むファイルでなければ、マテリアルを含む全体)を読み込んで返す。
+
+        キャッシュされたデータを使うのは、ファイルが更新されていない場合だけです。
+
+        """
+        self.header = serializers.load_layer_header(self.file_path, self.layer_name)
+        return self.header
+
+    @property
+    def data(self):
+        """ファイル内のマテリアルの2次元リスト。1行ずつ読み込むファイルならばNoneです。"""
+        return self.load().get('layer')
+
+    def prepare(self):
+        """ファイルを読み込んでおく。1行ずつ読み込むファイルならば、全ての行を読み込んでおきます。"""
+        header = self.load()
+        if header.get('layer') is None and (self.prepared_rows is None or self.prepared_header is not header):
+            self.prepared_rows = list(serializers.iter_layer_rows(self.file_path, self.layer_name))
+            self.prepared_header = header
+
+    def get_loaded_rows(self):
+        """メモリ上にある行を返す。1行ずつ読み込むファイルで、prepareしていなければ空のタプルです。"""
+        rows = self.data
+        if rows is None and self.prepared_header is self.header:
+            rows = self.prepared_rows
+        return rows or ()
+
+    def get_rows(self):
+        """マテリアルの行を返す。prepareで読み込んだ行は、1度だけ使います。"""
+        rows = self.data
+        if rows is None and self.prepared_header is self.header:
+            rows = self.prepared_rows
+        self.prepared_rows = None
+        self.prepared_header = None
+        return rows if rows is not None else serializers.iter_layer_rows(self.file_path, self.layer_name)
@@ -1,8 +1,8 @@
 """オブゾェクトレイヤの具象クラスを提供する。"""
-import json
 import random
 from broccoli import serializers
 from broccoli.layer import BaseObjectLayer
+from .jsonlib import JsonLayerMixin
 
 
 class PythonObjectLayer(BaseObjectLayer):
@@ -31,6 +31,9 @@ class PythonObjectLayer(BaseObjectLayer):
                 else:
                     self.create_material(material_cls=cls, x=x, y=y, **kwargs)
 
+    def get_material_classes(self):
+        return {col[0] for row in self.data for col in row if col is not None}
+
 
 class EmptyObjectLayer(BaseObjectLayer):
     """何もオブジェクトを作らない。
@@ -61,19 +64,28 @@ class RandomObjectLayer(BaseObjectLayer):
             # ランダム生成の場合は、向きや差分もランダム。
             self.create_material(material_cls=enemy, direction=-1, diff=-1)
 
+    def get_material_classes(self):
+        return self.enemies
+
 
-class JsonObjectLayer(BaseObjectLayer):
-    """オブジェクトをJSONから読み込んで作成する。"""
+class JsonObjectLayer(JsonLayerMixin, BaseObjectLayer):
+    """オブジェクトをJSONから読み込んで作成する。serializers.dump_streamで保存したファイルも読み込めます。
 
-    def __init__(self, file_path):
+    ファイルは、インスタンス化の際ではなく、作成する際に読み込みます(JsonLayerMixin)。
+
+    """
+
+    def __init__(self, file_path, layer_name=None):
         super().__init__()
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file, cls=serializers.JsonDecoder)
-        self.data = data['layer']
+        self.file_path = file_path
+        self.layer_name = layer_name
+
+    def get_material_classes(self):
+        return {col[0] for row in self.get_loaded_rows() for col in row if col is not None}
 
     def create_layer(self):
-        for y, row in enumerate(self.data):
+        for y, row in enumerate(self.get_rows()):
             for x, col in enumerate(row):
                 if col is not None:
                     obj_cls, kwargs = col
-                    self.create_material(material_cls=obj_cls, x=x, y=y, **kwargs)
+                    self.create_material(material_cls=obj_cls, x=x, y=y, **serializers.copy_kwargs(kwargs))
@@ -0,0 +1,286 @@
+"""タイルレイヤ上の経路探索を提供するモジュール。
+
+PathFinderは、タイルレイヤ1つに対して1つ作られ、tile_layer.pathfinderとして使えます。
+
+- find_pathは、A*でスタートからゴールまでの経路を求めます。
+- get_distance_mapは、ある座標から各セルまでの歩数を幅優先探索(全ての移動コストが1のダイクストラ法)で求めます。
+  結果はキャッシュされるので、同じプレイヤーを追いかける多くのモンスターが、1つの距離マップを共有できます。
+- next_stepは、距離マップを使い、ある座標へ近づくための次の1歩を返します。
+
+経路探索はタイルの通行可否だけを見て、オブジェクトは障害物として扱いません(オブジェクトは動くため)。
+タイルが変更されると(tile_layer.versionが変わると)、キャッシュは破棄されます。
+
+"""
+import heapq
+from collections import deque
+from broccoli import const
+
+# 4方向の移動。(向き, xの増分, yの増分)
+DIRECTIONS = [
+    (const.DOWN, 0, 1),
+    (const.LEFT, -1, 0),
+    (const.RIGHT, 1, 0),
+    (const.UP, 0, -1),
+]
+
+# 距離マップで、たどり着けないセルの値
+UNREACHABLE = -1
+
+
+class PathFinder:
+    """タイルレイヤの経路探索を行うクラス。
+
+    通行可否はtile_layer.is_public(x, y, obj=obj)で判定します。
+    距離マップのキャッシュは、対象の座標と、移動するオブジェクトのkind属性ごとに作られます。
+    is_publicが独自の関数で、kind以外の属性で通行可否を変えている場合は、キャッシュを使わないでください(use_cache=False)。
+
+    """
+    cache_size = 16  # 保持する距離マップの数
+
+    def __init__(self, tile_layer):
+        self.tile_layer = tile_layer
+        self.cache = {}
+        self.cache_version = None
+
+    def get_neighbors(self, x, y):
+        """(x, y)の上下左右のうち、マップの範囲内の座標を(向き, x, y)として返す。"""
+        x_length = self.tile_layer.x_length
+        y_length = self.tile_layer.y_length
+        for direction, dx, dy in DIRECTIONS:
+            next_x = x + dx
+            next_y = y + dy
+            if 0 <= next_x < x_length and 0 <= next_y < y_length:
+                yield direction, next_x, next_y
+
+    def find_path(self, start_x, start_y, goal_x, goal_y, obj=None):
+        """A*で、スタートからゴールまでの経路を求める。
+
+        経路は、スタートの次のセルからゴールまでの(x, y)のリストです。
+        たどり着けない場合はNoneを返します。
+
+        """
+        tile_layer = self.tile_layer
+        x_length = tile_layer.x_length
+        start = start_y * x_length + start_x
+        goal = goal_y * x_length + goal_x
+        if start == goal:
+            return []
+
+        came_from = {start: None}
+        costs = {start: 0}
+        heap = [(abs(goal_x - start_x) + abs(goal_y - start_y), 0, start)]
+        while heap:
+            _, cost, cell = heapq.heappop(heap)
+            if cell == goal:
+                break
+            if cost > costs[cell]:
+                continue
+            y, x = divmod(cell, x_length)
+            for _, next_x, next_y in self.get_neighbors(x, y):
+                next_cell = next_y * x_length + next_x
+                next_cost = cost + 1
+                if next_cost < costs.get(next_cell, next_cost + 1) and tile_layer.is_public(next_x, next_y, obj=obj):
+                    costs[next_cell] = next_cost
+                    came_from[next_cell] = cell
+                    estimate = next_cost + abs(goal_x - next_x) + abs(goal_y - next_y)
+                    heapq.heappush(heap, (estimate, next_cost, next_cell))
+        else:
+            return None
+
+        path = []
+        cell = goal
+        while cell != start:
+            y, x = divmod(cell, x_length)
+            path.append((x, y))
+            cell = came_from[cell]
+        path.reverse()
+        return path
+
+    def get_distance_map(self, x, y, obj=None, max_distance=None, use_cache=True):
+        """(x, y)から各セルまでの歩数を、1次元のリストとして返す。
+
+        セル(cell_x, cell_y)の歩数は、distance_map[cell_y * x_length + cell_x]です。
+        たどり着けないセルはUNREACHABLE(-1)になります。
+        max_distanceを指定すると、それより遠いセルは探索せずUNREACHABLEになります。広いマップで、近くの相手を追う場合に使ってください。
+        返したリストはキャッシュされ共有されるので、書き換えないでください。
+
+        """
+        if not use_cache:
+            return self._create_distance_map(x, y, obj, max_distance)
+
+        # タイルが変更されていたら、キャッシュは使えない
+        if self.cache_version != self.tile_layer.version:
+            self.cache = {}
+            self.cache_version = self.tile_layer.version
+
+        key = (x, y, getattr(obj, 'kind', None), max_distance)
+        distance_map = self.cache.pop(key, None)
+        if distance_map is None:
+            distance_map = self._create_distance_map(x, y, obj, max_distance)
+            if len(self.cache) >= self.cache_size:
+                # 一番昔に使われたものを捨てる
+                del self.cache[next(iter(self.cache))]
+        # 最近使ったものが末尾に来るよう、入れなおす
+        self.cache[key] = distance_map
+        return distance_map
+
+    def _create_distance_map(self, x, y, obj=None, max_distance=None):
+        tile_layer = self.tile_layer
+        x_length = tile_layer.x_length
+        distance_map = [UNREACHABLE] * (x_length * tile_layer.y_length)
+        distance_map[y * x_length + x] = 0
+        queue = deque([(x, y)])
+        while queue:
+            x, y = queue.popleft()
+            next_distance = distance_map[y * x_length + x] + 1
+            if max_distance is not None and next_distance > max_distance:
+                break
+            for _, next_x, next_y in self.get_neighbors(x, y):
+                next_cell = next_y * x_length + next_x
+                if distance_map[next_cell] == UNREACHABLE and tile_layer.is_public(next_x, next_y, obj=obj):
+                    distance_map[next_cell] = next_distance
+                    queue.append((next_x, next_y))
+        return distance_map
+
+    def next_step(self, obj, x, y, max_distance=None):
+        """objが(x, y)に近づくための次の1歩を、(向き, x, y)として返す。
+
+        今より近づけるセルのうち、オブジェクトがいないものの中で最も近いセルを選びます。
+        たどり着けない場合や、近づけるセルが全て塞がっている場合はNoneを返します。
+
+        """
+        distance_map = self.get_distance_map(x, y, obj=obj, max_distance=max_distance)
+        x_length = self.tile_layer.x_length
+        current = distance_map[obj.y * x_length + obj.x]
+        if current == UNREACHABLE:
+            return None
+
+        object_layer = obj.canvas.object_layer
+        best = None
+        best_distance = current
+        for direction, next_x, next_y in self.get_neighbors(obj.x, obj.y):
+            distance = distance_map[next_y * x_length + next_x]
+            if distance != UNREACHABLE and distance < best_distance and object_layer[next_y][next_x] is None:
+                best = (direction, next_x, next_y)
+                best_distance = distance
+        return best
+
+
+class FlowField:
+    """複数の起点からの歩数を、1度の幅優先探索でまとめて求めたもの。
+
+    プレイヤー達を起点にして作っておけば、プレイヤーを追いかける全てのモンスターが
+    次の1歩(next_step)と、視界にプレイヤーがいるか(get_target)を、その場で調べられるようになります。
+
+    探索する範囲は、各起点を中心とした横see_x、縦see_yセル分の範囲に限られます。
+    モンスターの視界(see_x, see_y)の最大値を渡せば、プレイヤーを見つけられる全てのセルが範囲に入ります。
+
+    歩数は作成した時点の起点の座標から求めたものです。起点が移動しても作りなおしはしないので、
+    ターンごとなど、適当なタイミングで作りなおしてください。
+
+    """
+
+    def __init__(self, tile_layer, sources, see_x, see_y, obj=None):
+        self.tile_layer = tile_layer
+        self.sources = list(sources)
+        self.source_positions = [(source.x, source.y) for source in self.sources]
+        self.see_x = see_x
+        self.see_y = see_y
+        self.version = tile_layer.version
+        self.distances = self._create_distances(obj)
+
+    def is_valid(self):
+        """作成した後にタイルが変更されていなければTrueを返す。"""
+        return self.version == self.tile_layer.version
+
+    def get_range_mask(self):
+        """探索する範囲を、1セル1バイトの配列(範囲内ならば1)として返す。"""
+        x_length = self.tile_layer.x_length
+        y_length = self.tile_layer.y_length
+        mask = bytearray(x_length * y_length)
+        for source_x, source_y in self.source_positions:
+            x0 = max(0, source_x - self.see_x)
+            x1 = min(x_length - 1, source_x + self.see_x)
+            row = b'\x01' * (x1 - x0 + 1)
+            for y in range(max(0, source_y - self.see_y), min(y_length - 1, source_y + self.see_y) + 1):
+                mask[y * x_length + x0:y * x_length + x1 + 1] = row
+        return mask
+
+    def _create_distances(self, obj):
+        tile_layer = self.tile_layer
+        x_length = tile_layer.x_length
+        y_length = tile_layer.y_length
+        mask = self.get_range_mask()
+        distances = {}
+        queue = deque()
+        for x, y in self.source_positions:
+            distances[y * x_length + x] = 0
+            queue.append((x, y))
+
+        while queue:
+            x, y = queue.popleft()
+            next_distance = distances[y * x_length + x] + 1
+            for _, dx, dy in DIRECTIONS:
+                next_x = x + dx
+                next_y = y + dy
+                if not (0 <= next_x < x_length and 0 <= next_y < y_length):
+                    continue
+                next_cell = next_y * x_length + next_x
+                if mask[next_cell] and next_cell not in distances and tile_layer.is_public(next_x, next_y, obj=obj):
+                    distances[next_cell] = next_distance
+                    queue.append((next_x, next_y))
+        return distances
+
+    def get_distance(self, x, y):
+        """(x, y)から一番近い起点までの歩数を返す。探索範囲外や、たどり着けない場合はUNREACHABLEです。"""
+        return self.distances.get(y * self.tile_layer.x_length + x, UNREACHABLE)
+
+    def is_reachable(self, x, y):
+        """(x, y)が探索範囲内で、起点までたどり着けるかを返す。"""
+        return self.get_distance(x, y) != UNREACHABLE
+
+    def get_target(self, obj):
+        """objの視界(see_x, see_y)にいる起点のうち、一番近いものを返す。いなければNoneを返します。
+
+        起点の今の座標で判定します。レイヤから削除された起点は無視します。
+
+        """
+        target = None
+        target_distance = None
+        positions = obj.canvas.object_layer.positions
+        for source in self.sources:
+            if source is obj or source not in positions:
+                continue
+            x, y = source.x, source.y
+            if abs(x - obj.x) > obj.see_x or abs(y - obj.y) > obj.see_y:
+                continue
+            distance = abs(x - obj.x) + abs(y - obj.y)
+            if target is None or distance < target_distance:
+                target = source
+                target_distance = distance
+        return target
+
+    def next_step(self, obj):
+        """objが一番近い起点へ近づくための次の1歩を、(向き, x, y)として返す。
+
+        今より近づけるセルのうち、オブジェクトがいないものの中で最も近いセルを選びます。
+        探索範囲外にいる場合や、近づけるセルが全て塞がっている場合はNoneを返します。
+
+        """
+        current = self.get_distance(obj.x, obj.y)
+        if current == UNREACHABLE:
+            return None
+
+        object_layer = obj.canvas.object_layer
+        best = None
+        best_distance = current
+        for direction, dx, dy in DIRECTIONS:
+            next_x = obj.x + dx
+            next_y = obj.y + dy
+            if not (0 <= next_x < self.tile_layer.x_length and 0 <= next_y < self.tile_layer.y_length):
+                continue
+            distance = self.get_distance(next_x, next_y)
+            if distance != UNREACHABLE and distance < best_distance and object_layer[next_y][next_x] is None:
+                best = (direction, next_x, next_y)
+                best_distance = distance
+        return best
@@ -1,7 +1,7 @@
 """タイルレイヤの具象クラスを提供する。"""
-import json
 from broccoli import serializers
 from broccoli.layer import BaseTileLayer
+from .jsonlib import JsonLayerMixin
 from .randomlib import RandomBackgroundCUI
 
 
@@ -22,10 +22,12 @@ class PythonTileLayer(BaseTileLayer):
         self.data = data
 
     def create_layer(self):
-        for y, row in enumerate(self.data):
-            for x, col in enumerate(row):
-                cls, kwargs = col
-                self.create_material(material_cls=cls, x=x, y=y, **kwargs)
+        self.create_materials_bulk(
+            (cls, x, y, dict(kwargs)) for y, row in enumerate(self.data) for x, (cls, kwargs) in enumerate(row)
+        )
+
+    def get_material_classes(self):
+        return {cls for row in self.data for cls, _ in row}
 
 
 class SimpleTileLayer(BaseTileLayer):
@@ -41,13 +43,20 @@ class SimpleTileLayer(BaseTileLayer):
         self.outer_tile = outer_tile
 
     def create_layer(self):
-        for y, row in enumerate(self):
-            for x, col in enumerate(row):
+        self.create_materials_bulk(self.get_materials())
+
+    def get_material_classes(self):
+        return self.inner_tile, self.outer_tile
+
+    def get_materials(self):
+        """(クラス, x, y, kwargs)の形式で、配置するタイルを返す。"""
+        for y in range(self.y_length):
+            for x in range(self.x_length):
                 # 端っこなら、そこはPrivateTile(壁など)で詰める
                 if y == 0 or x == 0 or y == self.y_length - 1 or x == self.x_length - 1:
-                    self.create_material(material_cls=self.outer_tile, x=x, y=y)
+                    yield self.outer_tile, x, y, {}
                 else:
-                    self.create_material(material_cls=self.inner_tile, x=x, y=y)
+                    yield self.inner_tile, x, y, {}
 
 
 class RandomTileLayer(BaseTileLayer):
@@ -60,32 +69,72 @@ class RandomTileLayer(BaseTileLayer):
         self.outer_tile = outer_tile
         self.split_x = split_x
         self.split_y = split_y
+        self.prepared_map = None
 
-    def create_layer(self):
+    def prepare(self):
+        """マップを生成しておく。"""
+        self.prepared_map = self.create_map()
+
+    def create_map(self):
+        """マップを生成し、壁を'#'、床を'.'とした文字列のリストとして返す。"""
         creator = self.create_cls(self.x_length, self.y_length, self.split_x, self.split_y)
         creator.create()
-        for y, row in enumerate(str(creator).split()):
-            for x, col in enumerate(row):
-                if col == '#':
-                    self.create_material(material_cls=self.outer_tile, x=x, y=y)
-                else:
-                    self.create_material(material_cls=self.inner_tile, x=x, y=y)
+        return str(creator).split()
 
+    def create_layer(self):
+        # prepareで生成しておいたマップは、1度だけ使う
+        rows = self.prepared_map or self.create_map()
+        self.prepared_map = None
+        self.create_materials_bulk(
+            (self.outer_tile if col == '#' else self.inner_tile, x, y, {})
+            for y, row in enumerate(rows) for x, col in enumerate(row)
+        )
 
-class JsonTileLayer(BaseTileLayer):
-    """背景をJSONから読み込んで作成する。"""
+    def get_material_classes(self):
+        return self.inner_tile, self.outer_tile
 
-    def __init__(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file, cls=serializers.JsonDecoder)
-        super().__init__(data['x_length'], data['y_length'])
-        self.data = data['layer']
+
+class JsonTileLayer(JsonLayerMixin, BaseTileLayer):
+    """背景をJSONから読み込んで作成する。
+
+    ファイルは、インスタンス化の際ではなく、x_lengthなどを初めて参照した際に読み込みます(JsonLayerMixin)。
+    serializers.dump_streamで保存したファイルも読み込めます。
+    その場合はヘッダだけを読み込み、タイルはcreate_layerで1行ずつ読み込みながら作成します。
+
+    """
+
+    def __init__(self, file_path, layer_name=None):
+        super().__init__(x_length=None, y_length=None)
+        self.file_path = file_path
+        self.layer_name = layer_name
+        # 大きさはファイルを読み込むまで分からないので、初めて参照された際に__getattr__で読み込む
+        del self.x_length
+        del self.y_length
+
+    def __getattr__(self, name):
+        if name in ('x_length', 'y_length') and 'file_path' in self.__dict__:
+            header = self.load()
+            self.x_length = header['x_length']
+            self.y_length = header['y_length']
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def create_grid(self):
+        # ファイルが更新されていれば、大きさも読み込みなおす
+        header = self.load()
+        self.x_length = header['x_length']
+        self.y_length = header['y_length']
+        return super().create_grid()
 
     def create_layer(self):
-        for y, row in enumerate(self.data):
-            for x, col in enumerate(row):
-                tile_cls, kwargs = col
-                self.create_material(material_cls=tile_cls, x=x, y=y, **kwargs)
+        copy_kwargs = serializers.copy_kwargs
+        self.create_materials_bulk(
+            (tile_cls, x, y, copy_kwargs(kwargs))
+            for y, row in enumerate(self.get_rows()) for x, (tile_cls, kwargs) in enumerate(row)
+        )
+
+    def get_material_classes(self):
+        return {tile_cls for row in self.get_loaded_rows() for tile_cls, _ in row}
 
 
 class ExpandTileLayer(BaseTileLayer):
@@ -99,6 +148,6 @@ class ExpandTileLayer(BaseTileLayer):
         )
 
     def create_layer(self):
-        for y, row in enumerate(self):
-            for x, col in enumerate(row):
-                self.create_material(material_cls=self.tile, x=x, y=y, direction=y, diff=x)
\ No newline at end of file
+        self.create_materials_bulk(
+            (self.tile, x, y, {'direction': y, 'diff': x}) for y in range(self.y_length) for x in range(self.x_length)
+        )
@@ -4,10 +4,13 @@
 
 """
 import json
+import os
+import threading
 import tkinter as tk
 from tkinter import filedialog
 from broccoli import serializers, layer
-from broccoli.containers import IndexDict
+from broccoli.autosave import AutoSaver
+from broccoli.containers import IndexDict, LRUCache
 from broccoli.conf import settings
 
 
@@ -27,6 +30,31 @@ class SimpleGameManager(BaseManager):
     canvas_list = {}
     vars = {}
 
+    # セーブデータの形式。'json'ならば1つのJSON、'stream'ならば1行ずつのJSON(serializers.dump_stream)、
+    # 'compact'ならばレイヤーをパレットとランレングス圧縮で表したJSON(serializers.CompactJsonEncoder)、
+    # 'binary'ならばmmapで読み込めるバイナリ(serializers.dump_binary)、
+    # 'journal'ならば前回のセーブからの差分を追記していくジャーナル(serializers.start_journal)で保存します。
+    # ロードの際は、形式を自動で判別します。
+    save_format = 'json'
+
+    # save_formatが'journal'の場合に、差分を何回追記したら全体を書きなおすか
+    journal_compaction_interval = 20
+
+    # オートセーブの設定。autosave_pathを指定すると、autosave_turnsターンごと、
+    # またはautosave_seconds秒ごとに、バックグラウンドで保存します(autosave.AutoSaver)
+    autosave_path = None
+    autosave_turns = 10
+    autosave_seconds = None
+
+    # Trueならば、今のマップを遊んでいる間に、次のマップのレイヤーの準備と画像の読み込みを別スレッドで行う
+    prefetch_next_canvas = True
+
+    # 訪れたマップの状態を保持する、マップの数と合計バイト数の上限。どちらかを指定すると、
+    # 前に訪れたマップへjumpした際に、マップを作りなおさず離れた時の状態に戻します。
+    # 保持するのはレイヤーの状態だけで、varsはゲーム全体のものなので戻しません。
+    map_cache_size = None
+    map_cache_bytes = None
+
     # ゲームオーバーメッセージや、マップ名の表示に関する設定
     text_size = 18
     text_font = settings.DEFAULT_TEXT_FONT
@@ -41,6 +69,13 @@ class SimpleGameManager(BaseManager):
         self.current_canvas = None
         self.current_canvas_index = 0
         self.current_canvas_name = ''
+        self.journal_path = None
+        self.journal_canvas = None
+        self.journal_vars = None
+        self.journal_entries = 0
+        self.autosaver = None
+        self.prefetch_thread = None
+        self.map_cache = LRUCache(max_entries=cls.map_cache_size, max_bytes=cls.map_cache_bytes)
 
     def setup_game(self):
         """ゲームのセットアップ"""
@@ -48,6 +83,10 @@ class SimpleGameManager(BaseManager):
         self.root.title(settings.GAME_TITLE)
         self.root.minsize(settings.GAME_WIDTH, settings.GAME_HEIGHT)
         self.root.maxsize(settings.GAME_WIDTH, settings.GAME_HEIGHT)
+        if self.autosave_path:
+            self.autosaver = AutoSaver(self, self.autosave_path, turns=self.autosave_turns, seconds=self.autosave_seconds)
+            self.autosaver.start()
+            self.autosaver.schedule()
 
     def jump(self, index=None):
         """次のマップを表示する"""
@@ -66,54 +105,200 @@ class SimpleGameManager(BaseManager):
                 canvas_name = index
                 canvas_index = self.canvas_list.get_index_from_key(canvas_name)
 
-        # 初回じゃない限りは、今遊んでいたマップを破棄
+        # 初回じゃない限りは、今遊んでいたマップを保存してから破棄
         if self.current_canvas is not None:
+            self.store_map()
             self.current_canvas.destroy()
 
+        # 次のマップを準備中ならば、終わるのを待つ。準備したレイヤーを、別スレッドと同時に触らないため
+        self.wait_prefetch()
+
         self.current_canvas_index = canvas_index
         self.current_canvas_name = canvas_name
         canvas = self.canvas_list[canvas_name]
-        self.current_canvas = canvas(master=self.root, manager=self, name=canvas_name)
+        self.current_canvas = canvas(master=self.root, manager=self, name=canvas_name, **self.restore_map(canvas_name))
         self.current_canvas.pack()
         self.current_canvas.start()
+        if self.prefetch_next_canvas:
+            self.prefetch(canvas_index + 1)
+
+    def store_map(self):
+        """今のマップのレイヤーの状態を、map_cacheに保存する。map_cacheを使わない設定ならば何もしません。
+
+        レイヤーはCompactJsonEncoderでエンコードした文字列として保存し、その長さをサイズとして扱います。
+        プレイヤーはマップに入るたびにシステムが作りなおすので、保存する前にレイヤーから取り除きます。
+
+        """
+        if self.map_cache_size is None and self.map_cache_bytes is None:
+            return
+        canvas = self.current_canvas
+        player = getattr(canvas.system, 'player', None)
+        if player is not None and player in canvas.object_layer.positions:
+            canvas.object_layer.delete_material(player)
+        text = json.dumps(
+            {layer_name: getattr(canvas, layer_name) for layer_name in serializers.LAYER_NAMES},
+            cls=serializers.CompactJsonEncoder,
+        )
+        self.map_cache.put(self.current_canvas_name, text, size=len(text))
+
+    def restore_map(self, canvas_name):
+        """map_cacheに保存したマップのレイヤーを、キャンバスに渡す引数の辞書として返す。なければ空の辞書です。"""
+        text = self.map_cache.get(canvas_name)
+        if text is None:
+            return {}
+        return self.create_layers(json.loads(text, cls=serializers.JsonDecoder))
+
+    @staticmethod
+    def create_layers(data):
+        """JsonDecoderでデコードしたデータから、各レイヤーを作成する。"""
+        return {
+            'tile_layer': layer.PythonTileLayer(data['tile_layer']['layer']),
+            'object_layer': layer.PythonObjectLayer(data['object_layer']['layer']),
+            'item_layer': layer.PythonItemLayer(data['item_layer']['layer']),
+        }
+
+    @staticmethod
+    def create_stream_layers(file_path):
+        """dump_streamで保存したマネージャーのファイルから、マテリアルを1行ずつ読み込む各レイヤーを作成する。"""
+        return {
+            'tile_layer': layer.JsonTileLayer(file_path, 'tile_layer'),
+            'object_layer': layer.JsonObjectLayer(file_path, 'object_layer'),
+            'item_layer': layer.JsonItemLayer(file_path, 'item_layer'),
+        }
+
+    def prefetch(self, index):
+        """index番目のマップのレイヤーの準備と画像の読み込みを、別スレッドで始める。"""
+        if not 0 <= index < len(self.canvas_list):
+            return
+        self.wait_prefetch()
+        canvas = self.canvas_list[index]
+        self.prefetch_thread = threading.Thread(target=canvas.prefetch, name='broccoli-prefetch', daemon=True)
+        self.prefetch_thread.start()
+
+    def wait_prefetch(self):
+        """マップの準備中ならば、終わるのを待つ。"""
+        if self.prefetch_thread is not None:
+            self.prefetch_thread.join()
+            self.prefetch_thread = None
 
     def start(self):
         """ゲームの開始。インスタンス化後、このメソッドを呼んでください。"""
         self.setup_game()
         self.jump(index=0)
         self.root.mainloop()
+        if self.autosaver is not None:
+            self.autosaver.stop()
 
     def save(self, _event=None):
         """ゲームのセーブ処理。"""
         file_path = filedialog.asksaveasfilename(title='保存するファイル名')
         if file_path:
+            self.save_file(file_path)
+
+    def save_file(self, file_path):
+        """save_formatの形式で、file_pathに保存する。"""
+        if self.save_format == serializers.BINARY:
+            # ロードしたバイナリのファイルは、BinaryTileLayerがmmapしたまま使っている。
+            # 同じファイルを切り詰めて書き込むと読めなくなるので、一時ファイルに書いてから入れ替える。
+            # Windowsではmmapしたままのファイルは置き換えられないので、メモリ上にコピーしてから閉じておく
+            tile_layer = self.current_canvas.tile_layer
+            if (isinstance(tile_layer, layer.BinaryTileLayer) and os.path.exists(file_path)
+                    and os.path.samefile(file_path, tile_layer.binary_map.file_path)):
+                tile_layer.release_file()
+            temp_path = file_path + '.tmp'
+            with open(temp_path, 'wb') as file:
+                serializers.dump_binary(self, file)
+            os.replace(temp_path, file_path)
+        elif self.save_format == serializers.JOURNAL:
+            self.save_journal(file_path)
+        else:
+            with open(file_path, 'w', encoding='utf-8') as file:
+                if self.save_format == serializers.STREAM:
+                    serializers.dump_stream(self, file)
+                elif self.save_format == serializers.COMPACT:
+                    json.dump(self, file, cls=serializers.CompactJsonEncoder)
+                else:
+                    json.dump(self, file, cls=serializers.JsonEncoder, indent=4)
+
+    def save_journal(self, file_path):
+        """ジャーナル形式で保存する。
+
+        前回と同じファイルに同じマップを保存する場合は、変更されたセルとvarsだけを追記します。
+        初めて保存する場合やマップが変わった場合、追記がjournal_compaction_interval回に達した場合は、全体を書きなおします。
+
+        """
+        canvas = self.current_canvas
+        if (file_path == self.journal_path and canvas is self.journal_canvas
+                and self.journal_entries < self.journal_compaction_interval):
+            with open(file_path, 'a', encoding='utf-8') as file:
+                self.journal_vars = serializers.dump_delta(self, file, self.journal_vars)
+            self.journal_entries += 1
+        else:
             with open(file_path, 'w', encoding='utf-8') as file:
-                json.dump(self, file, cls=serializers.JsonEncoder, indent=4)
+                self.journal_vars = serializers.start_journal(self, file)
+            self.journal_path = file_path
+            self.journal_canvas = canvas
+            self.journal_entries = 0
 
     def load(self, _event=None):
         """ゲームのロード処理。"""
         file_path = filedialog.askopenfilename(title='ロードするファイル名')
         if file_path:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file, cls=serializers.JsonDecoder)
+            self.load_file(file_path)
 
-            self.vars = data['vars']
-            self.current_canvas_name = canvas_name = data['name']
-            self.current_canvas_index = self.canvas_list.get_index_from_key(canvas_name)
-
-            canvas = self.canvas_list[canvas_name]
-            context = {
-                'manager': self,
-                'name': canvas_name,
-                'tile_layer': layer.PythonTileLayer(data['tile_layer']['layer']),
-                'object_layer': layer.PythonObjectLayer(data['object_layer']['layer']),
-                'item_layer': layer.PythonItemLayer(data['item_layer']['layer']),
+    def load_file(self, file_path):
+        """file_pathのセーブデータをロードする。形式は自動で判別します。
+
+        バイナリ形式と1行ずつ保存した形式は、マップ全体のデータをメモリ上に作らずに読み込みます。
+        1つのJSONとして保存した形式は、ファイル全体を読み込みます。
+
+        """
+        # バイナリ形式ならば、マップ名などだけを読み込み、セルはmmapしたファイルから必要な分だけ読み込む
+        if serializers.is_binary_file(file_path):
+            binary_map = serializers.BinaryMap(file_path)
+            canvas_name = binary_map.name
+            self.vars = binary_map.vars
+            layers = {
+                'tile_layer': layer.BinaryTileLayer(binary_map),
+                'object_layer': layer.BinaryObjectLayer(binary_map),
+                'item_layer': layer.BinaryItemLayer(binary_map),
             }
+        # 1行ずつ保存した形式(ジャーナルも含む)ならば、ヘッダと差分だけを読み込み、
+        # マテリアルはキャンバスが各レイヤーを作成する際に1行ずつ読み込む
+        elif serializers.is_stream_file(file_path):
+            with open(file_path, 'rb') as file:
+                header = serializers.read_stream_header(file)
+            canvas_name = header['name']
+            self.vars = header['vars']
+            layers = self.create_stream_layers(file_path)
 
-            # 初回じゃない限りは、今遊んでいたマップを破棄
-            if self.current_canvas is not None:
-                self.current_canvas.destroy()
+        # 1つのJSONとして保存した形式は、全体を読み込むしかない
+        else:
+            data = serializers.load_file(file_path)
+            canvas_name = data['name']
+            self.vars = data['vars']
+            layers = self.create_layers(data)
 
-            self.current_canvas = canvas(**context)
-            self.current_canvas.pack()
-            self.current_canvas.start()
+        # 保存していたマップの状態は、ロードしたゲームのものではない
+        self.map_cache.clear()
+
+        self.current_canvas_name = canvas_name
+        self.current_canvas_index = self.canvas_list.get_index_from_key(canvas_name)
+
+        canvas = self.canvas_list[canvas_name]
+        context = {
+            'manager': self,
+            'name': canvas_name,
+            **layers,
+        }
+
+        # 初回じゃない限りは、今遊んでいたマップを破棄
+        if self.current_canvas is not None:
+            self.current_canvas.destroy()
+        self.wait_prefetch()
+
+        self.current_canvas = canvas(**context)
+        self.current_canvas.pack()
+        self.current_canvas.start()
+        if self.prefetch_next_canvas:
+            self.prefetch(self.current_canvas_index + 1)
@@ -17,13 +17,96 @@ import types
 from broccoli import const
 
 
-class BaseMaterial:
-    """マップ上に表示される背景、物体、キャラクター、アイテムの基底クラス。"""
+def is_class_default(cls, attr_name, value):
+    """valueが、クラス属性と同じイミュータブルな値かを返す。リストや辞書は共有できないのでFalseです。"""
+    default = cls.get_default(attr_name)
+    if value is default:
+        return not isinstance(value, (list, dict))
+    return type(value) is type(default) and isinstance(value, (int, float, str, tuple)) and value == default
+
+
+def get_slot_names(cls):
+    """クラス自身が__slots__で定義した属性名を返す。"""
+    slots = cls.__dict__.get('__slots__', ())
+    if isinstance(slots, str):
+        slots = (slots,)
+    return [name for name in slots if name not in ('__dict__', '__weakref__')]
+
+
+class MaterialMeta(type):
+    """マテリアルクラスのメタクラス。
+
+    __slots__にある属性と同じ名前のクラス属性は、スロットと共存できません。
+    そのため、クラス定義に書かれたそれらの値はクラス属性にはせず、既定値として_class_defaultsに移します。
+
+    class Wall(BaseTile):
+        is_public = return_false
+
+    のように書いた場合も、is_publicはBaseTileのスロットに格納されたまま、既定値だけがreturn_falseになります。
+    クラスからスロットの属性を参照するとスロットのディスクリプタが返るので、既定値はget_defaultで取得してください。
+
+    """
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        slot_names = set()
+        for base in bases:
+            for klass in base.__mro__:
+                slot_names.update(get_slot_names(klass))
+        own_slots = namespace.get('__slots__', ())
+        slot_names.update((own_slots,) if isinstance(own_slots, str) else own_slots)
+
+        namespace['_own_defaults'] = {
+            attr_name: namespace.pop(attr_name) for attr_name in list(namespace) if attr_name in slot_names
+        }
+        namespace['_slot_names'] = frozenset(slot_names)
+        cls = super().__new__(mcs, name, bases, namespace, **kwargs)
+        cls.update_defaults()
+        return cls
+
+    def __setattr__(cls, name, value):
+        """スロットの属性をクラスに代入した場合は、既定値の変更として扱う。"""
+        if name in cls._slot_names:
+            cls._own_defaults[name] = value
+            cls.update_defaults()
+        else:
+            super().__setattr__(name, value)
+
+    def update_defaults(cls):
+        """継承元も含めた既定値を、_class_defaultsにまとめる。サブクラスの既定値も更新します。"""
+        defaults = {}
+        for klass in reversed(cls.__mro__):
+            defaults.update(klass.__dict__.get('_own_defaults', {}))
+        type.__setattr__(cls, '_class_defaults', defaults)
+        for subclass in cls.__subclasses__():
+            subclass.update_defaults()
+
+
+class BaseMaterial(metaclass=MaterialMeta):
+    """マップ上に表示される背景、物体、キャラクター、アイテムの基底クラス。
+
+    座標やキャンバス、name、vars、具象クラスのattrsに書いた属性は、__slots__に格納されます。
+    サブクラスでそれらの値を変えたい場合は、これまで通りクラス属性として書いてください。
+    サブクラスで新しく追加した属性は、インスタンスの__dict__に格納されます。
+    大量に作るマテリアルの場合は、サブクラスでも__slots__を定義すると__dict__を持たなくなります。
+
+    クラス属性compactをTrueにすると、クラス属性と同じ関数の属性はインスタンスごとにメソッドを作らず、
+    参照された際にクラスの既定値からメソッドを作ります。
+    スロットにない属性も、クラス属性と同じ値ならばインスタンスに持たせません。
+    大きなマップのタイルのように、同じマテリアルを大量に作る場合のメモリと生成時間を減らせます。
+    ただし、後からクラス属性を変更すると、compactなインスタンスの関数の属性にもその変更が反映されます。
+
+    属性の変更は、そのままではレイヤに通知されません。
+    索引を作ったり変更を記録したりするレイヤに配置された際に、watch_changesでクラスごとに通知を始めます。
+
+    """
+    __slots__ = ('x', 'y', 'canvas', 'system', 'layer', 'id', 'direction', 'diff', 'name', 'vars', '__weakref__')
+
     name = None
     vars = {}  # フラグ等の値を格納する辞書として使えます。jsonでの読み込み・保存に対応している辞書です。
 
     attrs = []  # このマテリアルが持つ、固有の属性を書きます。
     func_attrs = []  # マテリアルの固有属性のうち、関数となるものを書きます。
+    compact = False
 
     def __init__(self, x=None, y=None, canvas=None, system=None, layer=None, direction=0, diff=0, name=None, vars=None, **kwargs):
         """初期化処理
@@ -46,38 +129,44 @@ class BaseMaterial:
 
         """
         cls = type(self)
-
-        self.x = x
-        self.y = y
-        self.canvas = canvas
-        self.system = system
-        self.layer = layer
-        self.id = None
-
-        if name is None:
-            self.name = cls.name
-        else:
-            self.name = name
-
-        if vars is None:
-            self.vars = cls.vars
-        else:
-            self.vars = vars
+        compact = cls.compact
+        defaults = cls._class_defaults
+        func_attrs = cls.func_attrs
+
+        # まだレイヤに配置されていないので、初期化中の代入はレイヤに通知しない
+        set_attr = object.__setattr__
+        set_attr(self, 'layer', layer)
+        set_attr(self, 'x', x)
+        set_attr(self, 'y', y)
+        set_attr(self, 'canvas', canvas)
+        set_attr(self, 'system', system)
+        set_attr(self, 'id', None)
+        set_attr(self, 'name', defaults['name'] if name is None else name)
+        set_attr(self, 'vars', defaults['vars'] if vars is None else vars)
 
         # 向きに関する属性
-        self.direction = direction  # 現在の向き。移動のほか、攻撃などにも影響する
-        self.diff = diff  # 同じ向きを連続で向いた数。差分表示等に使う
+        set_attr(self, 'direction', direction)  # 現在の向き。移動のほか、攻撃などにも影響する
+        set_attr(self, 'diff', diff)  # 同じ向きを連続で向いた数。差分表示等に使う
 
         # マテリアルインスタンスの属性を設定
         for attr_name in cls.attrs:
             # kwargsにあればそれを、そうでなければクラス属性を設定
             if attr_name in kwargs:
                 value = kwargs[attr_name]
+            elif attr_name in defaults:
+                value = defaults[attr_name]
             else:
                 value = getattr(cls, attr_name)
 
+            # compactならば、クラス属性と同じ関数や、スロットにない属性は持たせない
+            if compact and is_class_default(cls, attr_name, value):
+                if attr_name in func_attrs or attr_name not in defaults:
+                    continue
+                set_attr(self, attr_name, value)
+                continue
+
             # 関数ならば、メソッドとして登録。
-            if attr_name in self.func_attrs:
+            if attr_name in func_attrs:
                 value = self.create_method(value)
 
             # クラス属性でリストや辞書等を使った場合は、他と共有されるのでcopy
@@ -85,7 +174,49 @@ class BaseMaterial:
             if isinstance(value, (list, dict)):
                 value = value.copy()
 
-            setattr(self, attr_name, value)
+            set_attr(self, attr_name, value)
+
+    def __getattr__(self, name):
+        """インスタンスに持たせなかったスロットの属性は、クラスの既定値を返す。関数ならばメソッドにします。"""
+        defaults = type(self)._class_defaults
+        if name in defaults:
+            value = defaults[name]
+            if name in self.func_attrs:
+                return types.MethodType(value, self)
+            return value
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+    @classmethod
+    def get_default(cls, attr_name):
+        """属性の、クラスでの既定値を返す。"""
+        defaults = cls._class_defaults
+        if attr_name in defaults:
+            return defaults[attr_name]
+        return getattr(cls, attr_name)
+
+    @classmethod
+    def watch_changes(cls):
+        """このクラスのインスタンスの属性が変更された際に、所属するレイヤのon_material_changeを呼ぶようにする。
+
+        索引を作ったり変更を記録したりするレイヤが、マテリアルを配置した際に呼びます。
+        呼ばれるまでは、属性の代入に余計な処理は入りません。
+
+        """
+        original_setattr = cls.__setattr__
+        if getattr(original_setattr, 'notifies_layer', False):
+            return
+
+        def __setattr__(self, name, value):
+            layer = getattr(self, 'layer', None)
+            if layer is not None and layer.watches(name):
+                old_value = getattr(self, name, None)
+                original_setattr(self, name, value)
+                layer.on_material_change(self, name, old_value, value)
+            else:
+                original_setattr(self, name, value)
+
+        __setattr__.notifies_layer = True
+        cls.__setattr__ = __setattr__
 
     def __str__(self):
         return '{}({}, {}) - {}'.format(self.name, self.x, self.y, self.id)
@@ -107,7 +238,9 @@ class BaseMaterial:
             self.diff += 1
 
         # 向きを変えたら、画像もすぐに反映させる。imageはディスクリプタです。
-        self.canvas.itemconfig(self.id, image=self.image)
+        # 表示範囲外で描画されていない(idがNone)場合は、次に描画される際に反映されます。
+        if self.id is not None:
+            self.canvas.update_material_image(self)
 
     def get_4_positions(self):
         """4方向の座標を取得するショートカットメソッドです。
@@ -161,11 +294,11 @@ class BaseMaterial:
 
         """
         result = {
-            'name': cls.name,
-            'vars': cls.vars,
+            'name': cls.get_default('name'),
+            'vars': cls.get_default('vars'),
         }
         for attr_name in cls.attrs:
-            value = getattr(cls, attr_name)
+            value = cls.get_default(attr_name)
             result[attr_name] = value
         return result
 
@@ -198,7 +331,7 @@ class BaseMaterial:
         内部にマテリアルを格納していた場合は(cls, kwargs)形式に変換されていきます。
 
         """
-        cls = type(self)
+        cls = self.__class__
         kwargs = self.get_instance_attrs()
         for name, value in kwargs.items():
             # リストだった場合、内部にマテリアルがあれば(cls, kwargs)形式に
@@ -223,6 +356,18 @@ class BaseMaterial:
             func = types.MethodType(func, self)
         return func
 
+    def mark_dirty(self):
+        """itemsやvarsのような、リストや辞書の属性の中身を書き換えた際に呼んでください。
+
+        属性への代入と違い、中身の書き換えはレイヤに通知されません。
+        このメソッドを呼ぶと、所属するレイヤにこのマテリアルのセルを変更されたセルとして記録させます。
+        差分セーブ(dump_delta)やオートセーブに、書き換えた内容を含めるためです。
+
+        """
+        layer = self.layer
+        if layer is not None and self.x is not None:
+            layer.mark_dirty(self.x, self.y)
+
     def delete(self):
         """マテリアルを削除する。
 
@@ -9,13 +9,16 @@ from broccoli.material.base import BaseMaterial
 
 class BaseItem(BaseMaterial):
     """全てのアイテムの基底クラス。"""
+    __slots__ = ('owner',)
 
     def __init__(self, owner=None, **kwargs):
         super().__init__(**kwargs)
-        self.owner = owner
+        object.__setattr__(self, 'owner', owner)
 
 
 class RogueLikeItem(BaseItem):
+    __slots__ = ('power', 'use')
+
     power = 0
     use = do_nothing
 
@@ -10,16 +10,22 @@ from broccoli.material.base import BaseMaterial
 
 
 class BaseObject(BaseMaterial):
-    pass
+    __slots__ = ()
 
 
 class RogueLikeObject(BaseObject):
+    __slots__ = (
+        'see_x', 'see_y', 'kind', 'hp', 'max_hp', 'power', 'speed', 'items',
+        'action', 'move', 'attack', 'random_walk', 'is_enemy', 'on_damage', 'die', 'towards', 'get_enemies', 'talk', 'message',
+    )
+
     see_x = 2
     see_y = 2
     kind = const.NEUTRAL
     hp = -1
     max_hp = -1
     power = -1
+    speed = 1  # 1ターンに何回行動するか。0.5ならば2ターンに1回
     items = []
     action = roguelike.object.action
     move = roguelike.object.move
@@ -34,12 +40,12 @@ class RogueLikeObject(BaseObject):
     message = ''
 
     attrs = [
-        'see_x', 'see_y', 'kind', 'hp', 'max_hp', 'power', 'items',
+        'see_x', 'see_y', 'kind', 'hp', 'max_hp', 'power', 'speed', 'items',
         'action', 'move', 'attack', 'random_walk', 'is_enemy', 'on_damage', 'die', 'towards', 'get_enemies', 'talk', 'message',
     ]
     func_attrs = ['action', 'move', 'attack', 'random_walk', 'is_enemy', 'on_damage', 'die', 'towards', 'get_enemies', 'talk']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # items内のアイテムを、実際にインスタンス化する。
-        self.items = [cls(owner=self, system=self.system, **item_kwargs) for cls, item_kwargs in self.items]
+        # items内のアイテムを、実際にインスタンス化する。まだ配置前なので、レイヤには通知しない
+        object.__setattr__(self, 'items', [cls(owner=self, system=self.system, **item_kwargs) for cls, item_kwargs in self.items])
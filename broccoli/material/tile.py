@@ -9,6 +9,8 @@ from broccoli.funcstions.generic import return_true, do_nothing
 
 
 class BaseTile(BaseMaterial):
+    __slots__ = ('is_public', 'on_self')
+
     # おそらく全てのゲームにおいて、この2つの属性は定義しておいても問題ないでしょう。
     is_public = return_true
     on_self = do_nothing
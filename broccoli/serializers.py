@@ -1,6 +1,12 @@
 """broccoliフレームワーク内データの、シリアライズ・デシリアライズに関するモジュール。"""
 import json
+import mmap
+import os
+import struct
+import sys
+from array import array
 from broccoli import register
+from broccoli.containers import LRUCache
 from broccoli.layer import BaseLayer, BaseItemLayer, BaseObjectLayer, BaseTileLayer
 from broccoli.material import BaseTile, BaseObject, BaseItem, BaseMaterial
 
@@ -10,6 +16,7 @@ TILE = 'Tile'
 OBJECT = 'Object'
 ITEM = 'Item'
 MATERIALS = (TILE, OBJECT, ITEM)
+COMPACT = 'compact'
 
 
 class JsonEncoder(json.JSONEncoder):
@@ -52,7 +59,10 @@ class JsonEncoder(json.JSONEncoder):
 
     実際にどういうJSONになるかは、samples/roguelike内のjsonファイルを見てください。
 
+    クラス属性compact_layersをTrueにすると(CompactJsonEncoder)、レイヤーはlayer_to_compact_jsonの形式になります。
+
     """
+    compact_layers = False
 
     def manager_to_json(self, o):
         """マネージャーをJSONエンコードする。"""
@@ -69,33 +79,106 @@ class JsonEncoder(json.JSONEncoder):
 
     def layer_to_json(self, o):
         """レイヤーをJSONエンコードする。"""
-        result = {'kind': LAYER}
-        if isinstance(o, BaseItemLayer):
-            result['layer'] = [[[] for _ in range(o.tile_layer.x_length)] for _ in range(o.tile_layer.y_length)]
-            for x, y, items in o.all():
-                if items:
-                    result['layer'][y][x] = [self.material_to_json(item, kind=ITEM) for item in items]
-                else:
-                    result['layer'][y][x] = []
+        if self.compact_layers:
+            return self.layer_to_compact_json(o)
+        result = self.layer_header_to_json(o)
+        result['layer'] = list(self.layer_rows_to_json(o))
+        return result
 
-        elif isinstance(o, BaseTileLayer):
+    def layer_header_to_json(self, o):
+        """レイヤーの、マテリアル以外の部分をJSONエンコードする。"""
+        result = {'kind': LAYER}
+        if isinstance(o, BaseTileLayer):
             result.update({
                 'x_length': o.x_length,
                 'y_length': o.y_length,
-                'layer': [[None for _ in range(o.x_length)] for _ in range(o.y_length)],
             })
-            for x, y, tile in o.all():
-                result['layer'][y][x] = self.material_to_json(tile, kind=TILE)
+        return result
 
+    def layer_rows_to_json(self, o):
+        """レイヤー内のマテリアルを、1行ずつJSONエンコードして返す。"""
+        if isinstance(o, BaseItemLayer):
+            for row in o:
+                yield [[self.material_to_json(item, kind=ITEM) for item in items] for items in row]
+
+        elif isinstance(o, BaseTileLayer):
+            for row in o:
+                yield [self.material_to_json(tile, kind=TILE) for tile in row]
+
+        elif isinstance(o, BaseObjectLayer):
+            for row in o:
+                yield [None if obj is None else self.material_to_json(obj, kind=OBJECT) for obj in row]
+
+    def layer_cell_to_json(self, o, x, y):
+        """レイヤーの(x, y)のセルを、layer_rows_to_jsonの各セルと同じ形式でJSONエンコードする。"""
+        col = o[y][x]
+        if isinstance(o, BaseItemLayer):
+            return [self.material_to_json(item, kind=ITEM) for item in col]
+        elif isinstance(o, BaseTileLayer):
+            return self.material_to_json(col, kind=TILE)
         elif isinstance(o, BaseObjectLayer):
-            result['layer'] = [[None for _ in range(o.tile_layer.x_length)] for _ in range(o.tile_layer.y_length)]
-            for x, y, obj in o.all():
-                if obj is None:
-                    result['layer'][y][x] = None
-                else:
-                    result['layer'][y][x] = self.material_to_json(obj, kind=OBJECT)
+            return None if col is None else self.material_to_json(col, kind=OBJECT)
+
+    def layer_to_compact_json(self, o):
+        """レイヤーを、パレットとランレングス圧縮したセルの並びとしてJSONエンコードする。
+
+        {
+            "kind": "Layer",
+            "format": "compact",
+            "x_length": 11,
+            "y_length": 11,
+            "palette": [セル, セル...],
+            "runs": [パレットの番号, 続く数, パレットの番号, 続く数...]
+        }
+
+        という表現になります。paletteには重複しないセルの内容(タイル、オブジェクトかnull、アイテムのリスト)が入り、
+        runsは、左上から右へ、行の終わりで次の行へと進んだ順に並べたセルを、パレットの番号で表したものです。
+        同じタイルが続くマップならば、通常の形式より大幅に小さくなります。
+
+        """
+        result = self.layer_header_to_json(o)
+        tile_layer = o if isinstance(o, BaseTileLayer) else o.tile_layer
+        result.update({
+            'format': COMPACT,
+            'x_length': tile_layer.x_length,
+            'y_length': tile_layer.y_length,
+        })
+
+        palette = []
+        runs = []
+        last_index = None
+        count = 0
+        for index in self.layer_to_palette_indexes(o, palette):
+            if index == last_index:
+                count += 1
+            else:
+                if count:
+                    runs.extend((last_index, count))
+                last_index = index
+                count = 1
+        if count:
+            runs.extend((last_index, count))
+
+        result['palette'] = palette
+        result['runs'] = runs
         return result
 
+    def layer_to_palette_indexes(self, o, palette):
+        """レイヤー内のセルを左上から順にJSONエンコードし、paletteでの番号として返す。
+
+        paletteにないセルは、paletteに追加されます。
+
+        """
+        palette_indexes = {}
+        for row in self.layer_rows_to_json(o):
+            for cell in row:
+                key = json.dumps(cell, sort_keys=True)
+                index = palette_indexes.get(key)
+                if index is None:
+                    index = palette_indexes[key] = len(palette)
+                    palette.append(cell)
+                yield index
+
     def material_dump_to_json(self, o):
         """マテリアルダンプをJSONエンコードする。
 
@@ -118,17 +201,19 @@ class JsonEncoder(json.JSONEncoder):
         return result
 
     def kwargs_to_json(self, o):
-        """マテリアルのインスタンス属性をJSONエンコードする。"""
+        """マテリアルのインスタンス属性をJSONエンコードする。
+
+        リストや辞書の属性は、エンコードした新しいリストや辞書にします。マテリアルの属性自体は変更しません。
+
+        """
         result = o.get_instance_attrs()
         for key, value in result.items():
             if key in o.func_attrs:
                 result[key] = value.name  # 関数のname属性に、registerに登録する名前が入っている
             elif isinstance(value, (list, tuple)):
-                for i, data in enumerate(value):
-                    value[i] = self.default(data)
+                result[key] = [self.default(data) for data in value]
             elif isinstance(value, dict):
-                for attr_name, attr_value in value.items():
-                    value[attr_name] = self.default(attr_value)
+                result[key] = self.default(value)
 
         return result
 
@@ -161,21 +246,28 @@ class JsonEncoder(json.JSONEncoder):
             return self.material_dump_to_json(o)
 
         # リストやタプルならば、中身がマテリアル等の場合もあるので
-        # 再帰的にJSONエンコードする。
+        # 再帰的にJSONエンコードする。元のリストは書き換えず、新しいリストを返す。
         elif isinstance(o, list):
-            for i, data in enumerate(o):
-                o[i] = self.default(data)
-            return o
+            return [self.default(data) for data in o]
 
         # 辞書の場合も、中身がマテリアルの場合があるので再帰的にエンコード。
         elif isinstance(o, dict):
-            for attr_name, attr_value in o.items():
-                o[attr_name] = self.default(attr_value)
+            return {attr_name: self.default(attr_value) for attr_name, attr_value in o.items()}
 
         # 通常の数値や文字列は、そのまま値を返す。
         return o
 
 
+class CompactJsonEncoder(JsonEncoder):
+    """レイヤーを、パレットとランレングス圧縮の形式(layer_to_compact_json)でエンコードするJSONエンコーダー。
+
+    json.dump(tile_layer, file, cls=serializers.CompactJsonEncoder)
+    のように使ってください。JsonDecoderで、通常の形式と同じように読み込めます。
+
+    """
+    compact_layers = True
+
+
 class JsonDecoder(json.JSONDecoder):
     """broccoliフレームワーク専用JSONデコーダー。
 
@@ -219,6 +311,7 @@ class JsonDecoder(json.JSONDecoder):
         [(cls, kwargs), (cls, kwargs)...],
     ]
     という2次元のリストに変換します。(cls, kwargs)部分は上で紹介したマテリアルのデコード表現です。
+    CompactJsonEncoderで保存したレイヤーも、同じ2次元のリストに変換します。
 
     """
 
@@ -253,6 +346,31 @@ class JsonDecoder(json.JSONDecoder):
     def item_from_json(self, o):
         return self._load_material(o, register.items)
 
+    def layer_from_compact_json(self, o):
+        """CompactJsonEncoderでエンコードしたレイヤーを、通常の形式にデコードする。
+
+        パレットの各セルは1度だけデコードし、各セルにはそのコピーを入れます。
+
+        """
+        copiers = [get_cell_copier(self._decode(cell)) for cell in o.pop('palette')]
+        runs = o.pop('runs')
+        x_length = o['x_length']
+        rows = []
+        row = []
+        for i in range(0, len(runs), 2):
+            copier = copiers[runs[i]]
+            count = runs[i + 1]
+            while count:
+                n = min(count, x_length - len(row))
+                row.extend([copier() for _ in range(n)])
+                count -= n
+                if len(row) == x_length:
+                    rows.append(row)
+                    row = []
+        del o['format']
+        o['layer'] = rows
+        return o
+
     def _decode(self, o):
         """マテリアル、レイヤーなどをデコードする。"""
         # リストならば各要素を_decodeし、中のマテリアルなどを再帰的にデコードする。
@@ -269,6 +387,8 @@ class JsonDecoder(json.JSONDecoder):
                 return self.object_from_json(o)
             elif kind == ITEM:
                 return self.item_from_json(o)
+            elif kind == LAYER and o.get('format') == COMPACT:
+                return self.layer_from_compact_json(o)
 
             for key, value in o.items():
                 o[key] = self._decode(value)
@@ -284,3 +404,434 @@ class JsonDecoder(json.JSONDecoder):
 
         # そのPythonオブジェクトの中から、マテリアルやレイヤー、関数部分を更にデコードする。
         return self._decode(o)
+
+
+def get_cell_copier(o):
+    """デコードしたセルの内容をコピーする関数を返す。
+
+    パレットの同じセルから作ったマテリアル同士で、varsなどが共有されないようにするためです。
+    コピーするのはリストや辞書だけで、関数やクラス、数値や文字列はそのまま使います。
+    どこをコピーすべきかは最初に1度だけ調べるので、同じセルを何度もコピーする場合に速くなります。
+
+    """
+    cls = type(o)
+    if cls is dict:
+        copiers = {key: get_cell_copier(value) for key, value in o.items() if type(value) in CONTAINER_TYPES}
+        if not copiers:
+            return o.copy
+
+        def copy_dict():
+            result = o.copy()
+            for key, copier in copiers.items():
+                result[key] = copier()
+            return result
+        return copy_dict
+
+    elif cls is list or cls is tuple:
+        copiers = [get_cell_copier(value) for value in o]
+        if cls is tuple and not any(type(value) in CONTAINER_TYPES for value in o):
+            return lambda: o
+        return lambda: cls([copier() for copier in copiers])
+
+    return lambda: o
+
+
+CONTAINER_TYPES = (list, tuple, dict)
+
+
+def copy_kwargs(kwargs):
+    """デコードしたマテリアルの引数の辞書を、リストや辞書の値もコピーして返す。
+
+    キャッシュしたデータのように、複数のマテリアルの作成に使うデータから、varsなどを共有しないようにするためです。
+
+    """
+    return {key: value.copy() if type(value) in (list, dict) else value for key, value in kwargs.items()}
+
+
+STREAM = 'stream'
+LAYER_NAMES = ('tile_layer', 'object_layer', 'item_layer')
+
+
+def dump_stream(o, file):
+    """マネージャーかレイヤーを、1行ずつ書き込むJSON Lines形式で保存する。
+
+    1行目はヘッダ(マネージャーならマップ名やvars、レイヤーならセル数)で、
+    レイヤーはヘッダの行の後に、マップの1行分のマテリアルを1行のJSONとして書き込みます。
+    レイヤー全体のJSONをメモリ上に作らないため、大きなマップでもメモリ使用量は1行分で済みます。
+
+        with open('save.jsonl', 'w', encoding='utf-8') as file:
+            serializers.dump_stream(manager, file)
+
+    """
+    from broccoli.manage import BaseManager
+    encoder = JsonEncoder()
+    if isinstance(o, BaseManager):
+        header = {
+            'kind': MANAGER,
+            'format': STREAM,
+            'name': o.current_canvas_name,
+            'vars': encoder.default(o.vars),
+        }
+        file.write(encoder.encode(header) + '\n')
+        canvas = o.current_canvas
+        for layer_name in LAYER_NAMES:
+            _dump_layer_stream(getattr(canvas, layer_name), file, encoder)
+    else:
+        _dump_layer_stream(o, file, encoder)
+
+
+def _dump_layer_stream(layer, file, encoder):
+    header = encoder.layer_header_to_json(layer)
+    header.update({
+        'format': STREAM,
+        'rows': len(layer.layer),
+    })
+    file.write(encoder.encode(header) + '\n')
+    for row in encoder.layer_rows_to_json(layer):
+        file.write(encoder.encode(row) + '\n')
+
+
+def iter_stream_rows(file, header, decoder=None):
+    """レイヤーのヘッダに続く行を、1行ずつデコードして返す。
+
+    バイナリモードで開いたファイルも渡せます。
+    ヘッダにread_stream_headerで読み込んだchangesがあれば、差分を反映した行を返します。
+
+    """
+    decoder = decoder or JsonDecoder()
+    changes = header.get('changes', {})
+    for y in range(header['rows']):
+        line = file.readline()
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        row = decoder.decode(line)
+        for x, cell in changes.get(y, {}).items():
+            row[x] = cell
+        yield row
+
+
+def load_stream(file):
+    """dump_streamで保存したファイルを読み込む。
+
+    json.load(file, cls=JsonDecoder)で読み込んだ場合と同じ形式のデータを返します。
+    start_journalで作ったジャーナルならば、追記された差分も反映したデータを返します。
+    マップ全体をメモリ上に作るので、マップの大きさに比例したメモリを使います。
+    1行ずつ読み込みながらレイヤーを作成したい場合は、read_stream_headerとJsonTileLayerなどを使ってください。
+
+    """
+    decoder = JsonDecoder()
+    header = decoder.decode(file.readline())
+    if header['kind'] == MANAGER:
+        for layer_name in LAYER_NAMES:
+            layer_header = decoder.decode(file.readline())
+            layer_header['layer'] = list(iter_stream_rows(file, layer_header, decoder))
+            header[layer_name] = layer_header
+        # dump_deltaで追記された差分があれば、順番に反映する
+        for line in file:
+            apply_delta(header, decoder.decode(line))
+    else:
+        header['layer'] = list(iter_stream_rows(file, header, decoder))
+    return header
+
+
+def read_stream_header(file):
+    """dump_streamで保存したファイルから、マテリアルの行をデコードせずにヘッダだけを読み込む。
+
+    fileはバイナリモードで開いてください。各レイヤーのヘッダには、最初の行の位置をoffsetとして加えます。
+    マネージャーならば、各レイヤーのヘッダをtile_layerなどのキーに格納します。
+    ジャーナルに追記された差分もここで読み込み、varsと各レイヤーのヘッダのchanges({y: {x: セル}})に反映します。
+    行はiter_stream_rowsで後から読み込むので、メモリ使用量はヘッダと差分の分だけです。
+
+    """
+    decoder = JsonDecoder()
+    header = decoder.decode(file.readline().decode('utf-8'))
+    if header['kind'] == MANAGER:
+        for layer_name in LAYER_NAMES:
+            header[layer_name] = _skip_stream_rows(file, decoder.decode(file.readline().decode('utf-8')))
+        for line in file:
+            delta = decoder.decode(line.decode('utf-8'))
+            if 'vars' in delta:
+                header['vars'] = delta['vars']
+            for layer_name, changes in delta['cells'].items():
+                rows = header[layer_name]['changes']
+                for x, y, cell in changes:
+                    rows.setdefault(y, {})[x] = cell
+    else:
+        _skip_stream_rows(file, header)
+    return header
+
+
+def _skip_stream_rows(file, header):
+    header['offset'] = file.tell()
+    header['changes'] = {}
+    for _ in range(header['rows']):
+        file.readline()
+    return header
+
+
+def is_stream_file(file_path):
+    """dump_streamで保存したファイルかを返す。"""
+    # バイナリ形式のファイルも渡されるので、テキストとしてデコードする前に判別する
+    with open(file_path, 'rb') as file:
+        first_line = file.readline()
+    try:
+        header = json.loads(first_line.decode('utf-8'))
+    except ValueError:
+        return False
+    return isinstance(header, dict) and header.get('format') == STREAM
+
+
+def load_file(file_path):
+    """保存したファイルを、形式を判別して読み込む。"""
+    if is_binary_file(file_path):
+        raise Exception('バイナリ形式のセーブデータは、BinaryMapで読み込んでください。')
+    with open(file_path, 'r', encoding='utf-8') as file:
+        if is_stream_file(file_path):
+            return load_stream(file)
+        return json.load(file, cls=JsonDecoder)
+
+
+# load_layer_headerで読み込んだデータのキャッシュ。キーは(ファイルの絶対パス, 更新日時, サイズ, レイヤー名)です
+layer_header_cache = LRUCache(max_entries=16)
+
+
+def load_layer_header(file_path, layer_name=None):
+    """レイヤーを保存したファイルから、セル数などのヘッダを読み込む。
+
+    dump_streamで保存したファイルならばread_stream_headerでヘッダだけを読み、マテリアルはiter_layer_rowsで後から読み込みます。
+    そうでなければファイル全体を読み込み、マテリアルもヘッダのlayerに含めて返します。
+    layer_nameを指定すると、マネージャーを保存したファイルから、そのレイヤーのヘッダを返します。
+
+    読み込んだデータはキャッシュされ、ファイルが更新されていなければ同じデータを返します。
+    複数のレイヤーで共有されるので、返したデータは書き換えないでください。
+
+    """
+    # ジャーナルへの追記が同じ更新日時になっても気付けるよう、ファイルサイズもキーに含める
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size, layer_name)
+    header = layer_header_cache.get(key)
+    if header is None:
+        if layer_name is not None:
+            header = load_layer_header(file_path)[layer_name]
+        elif is_stream_file(file_path):
+            with open(file_path, 'rb') as file:
+                header = read_stream_header(file)
+        else:
+            header = load_file(file_path)
+        layer_header_cache.put(key, header)
+    return header
+
+
+def iter_layer_rows(file_path, layer_name=None):
+    """レイヤーを保存したファイルから、マテリアルを1行ずつ読み込んで返す。
+
+    layer_nameを指定すると、マネージャーを保存したファイルから、そのレイヤーの行を返します。
+
+    """
+    header = load_layer_header(file_path, layer_name)
+    if header.get('layer') is not None:
+        yield from header['layer']
+        return
+    with open(file_path, 'rb') as file:
+        file.seek(header['offset'])
+        yield from iter_stream_rows(file, header)
+
+
+BINARY = 'binary'
+BINARY_MAGIC = b'BRCB'
+BINARY_VERSION = 1
+
+# マジックナンバー, バージョン, 横のセル数, 縦のセル数, メタデータの位置, メタデータの長さ,
+# レイヤーごとに(セルの配列の型コード, 配列の位置)。全てリトルエンディアンです。
+BINARY_HEADER = struct.Struct('<4sH2xIIQQ' + '1s7xQ' * len(LAYER_NAMES))
+
+
+def dump_binary(o, file):
+    """マネージャーを、mmapで読み込めるバイナリ形式で保存する。
+
+    ファイルは
+    - ヘッダ(BINARY_HEADER)
+    - マップ名、vars、レイヤーごとのパレットを入れたJSON(メタデータ)
+    - レイヤーごとの、各セルのパレットでの番号の配列(uint16、パレットが大きければuint32)
+    の順に並びます。パレットはCompactJsonEncoderと同じく、重複しないセルの内容のリストです。
+    セルの配列は8バイト境界に揃えるので、読み込む際はmmapした領域をそのまま配列として使えます。
+
+        with open('save.bin', 'wb') as file:
+            serializers.dump_binary(manager, file)
+
+    """
+    encoder = JsonEncoder()
+    canvas = o.current_canvas
+    palettes = {}
+    arrays = []
+    for layer_name in LAYER_NAMES:
+        palette = []
+        cells = array('I', encoder.layer_to_palette_indexes(getattr(canvas, layer_name), palette))
+        # 0xFFFFは、FlyweightTileLayerで使えない番号
+        if len(palette) < 0xFFFF:
+            cells = array('H', cells)
+        elif layer_name == 'tile_layer':
+            raise Exception('タイルの種類が多すぎるため、バイナリ形式では保存できません。')
+        if sys.byteorder != 'little':
+            cells.byteswap()
+        palettes[layer_name] = palette
+        arrays.append(cells)
+
+    meta = encoder.encode({
+        'kind': MANAGER,
+        'format': BINARY,
+        'name': o.current_canvas_name,
+        'vars': encoder.default(o.vars),
+        'palettes': palettes,
+    }).encode('utf-8')
+
+    position = BINARY_HEADER.size + len(meta)
+    offsets = []
+    layer_entries = []
+    for cells in arrays:
+        position = (position + 7) & ~7
+        offsets.append(position)
+        layer_entries.extend((cells.typecode.encode('ascii'), position))
+        position += len(cells) * cells.itemsize
+
+    tile_layer = canvas.tile_layer
+    file.write(BINARY_HEADER.pack(
+        BINARY_MAGIC, BINARY_VERSION, tile_layer.x_length, tile_layer.y_length,
+        BINARY_HEADER.size, len(meta), *layer_entries
+    ))
+    file.write(meta)
+    position = BINARY_HEADER.size + len(meta)
+    for cells, offset in zip(arrays, offsets):
+        file.write(bytes(offset - position))
+        file.write(cells.tobytes())
+        position = offset + len(cells) * cells.itemsize
+
+
+def is_binary_file(file_path):
+    """dump_binaryで保存したファイルかを返す。"""
+    with open(file_path, 'rb') as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+class BinaryMap:
+    """dump_binaryで保存したファイルを読み込むクラス。
+
+    読み込むのはヘッダとメタデータ(マップ名、vars、パレット)だけで、
+    各セルの配列は、get_cellsを呼んだ際にファイルをmmapした領域をそのまま返します。
+    実際にファイルから読み込まれるのは、配列のうちアクセスした部分だけです。
+
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            values = BINARY_HEADER.unpack(file.read(BINARY_HEADER.size))
+            magic, version, self.x_length, self.y_length, meta_offset, meta_length = values[:6]
+            if magic != BINARY_MAGIC:
+                raise Exception('バイナリ形式のセーブデータではありません。')
+            if version != BINARY_VERSION:
+                raise Exception('対応していないバージョンのセーブデータです。')
+            file.seek(meta_offset)
+            meta = JsonDecoder().decode(file.read(meta_length).decode('utf-8'))
+
+        self.layer_entries = {
+            layer_name: (typecode.decode('ascii'), offset)
+            for layer_name, typecode, offset in zip(LAYER_NAMES, values[6::2], values[7::2])
+        }
+        self.name = meta['name']
+        self.vars = meta['vars']
+        self.palettes = meta['palettes']
+        self.buffers = []  # get_cellsでmmapした領域
+
+    def get_palette(self, layer_name):
+        """レイヤーのパレットを返す。各セルの内容は、JsonDecoderでデコードした形式です。"""
+        return self.palettes[layer_name]
+
+    def get_cells(self, layer_name):
+        """レイヤーの各セルの、パレットでの番号の配列を返す。
+
+        呼ぶたびにファイルを新しくmmapし、書き込みはファイルに反映されない(ACCESS_COPY)領域を返します。
+
+        """
+        typecode, offset = self.layer_entries[layer_name]
+        size = self.x_length * self.y_length * array(typecode).itemsize
+        with open(self.file_path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        if sys.byteorder != 'little':
+            cells = array(typecode, buffer[offset:offset + size])
+            buffer.close()
+            cells.byteswap()
+            return cells
+        self.buffers.append(buffer)
+        return memoryview(buffer)[offset:offset + size].cast(typecode)
+
+    def close(self):
+        """get_cellsでmmapした領域を、全て閉じる。
+
+        Windowsでは、mmapしたままのファイルは置き換えられません。同じファイルに保存する前に呼んでください。
+        get_cellsで返した配列を、先に全てreleaseしておく必要があります。
+
+        """
+        for buffer in self.buffers:
+            buffer.close()
+        self.buffers = []
+
+
+JOURNAL = 'journal'
+DELTA = 'Delta'
+
+
+def start_journal(o, file):
+    """マネージャー全体をdump_streamで書き込み、以降に変更されたセルの記録を始める。
+
+    ジャーナルは、dump_streamの形式のファイルの後ろに、dump_deltaで差分を1行ずつ追記していくファイルです。
+    load_fileやload_streamで読み込むと、差分を全て反映したデータになります。
+    書き込んだvarsのJSONを返すので、次のdump_deltaに渡してください。
+
+    """
+    dump_stream(o, file)
+    for layer_name in LAYER_NAMES:
+        getattr(o.current_canvas, layer_name).start_tracking(JOURNAL)
+    encoder = JsonEncoder()
+    return encoder.encode(encoder.default(o.vars))
+
+
+def dump_delta(o, file, last_vars=None):
+    """前回の書き込みから変更されたセルとvarsを、1行のJSONとしてジャーナルに追記する。
+
+    {
+        "kind": "Delta",
+        "vars": {...},
+        "cells": {"tile_layer": [[x, y, セル], ...], "object_layer": [...], "item_layer": [...]}
+    }
+
+    という表現になります。varsは、前回書き込んだvarsのJSON(last_vars)と異なる場合だけ含めます。
+    書き込んだvarsのJSONを返します。
+
+    """
+    encoder = JsonEncoder()
+    canvas = o.current_canvas
+    cells = {}
+    for layer_name in LAYER_NAMES:
+        layer = getattr(canvas, layer_name)
+        changes = [[x, y, encoder.layer_cell_to_json(layer, x, y)] for x, y in sorted(layer.pop_dirty(JOURNAL))]
+        if changes:
+            cells[layer_name] = changes
+
+    vars_json = encoder.encode(encoder.default(o.vars))
+    delta = {'kind': DELTA, 'cells': cells}
+    if vars_json != last_vars:
+        delta['vars'] = json.loads(vars_json)
+    if cells or 'vars' in delta:
+        file.write(encoder.encode(delta) + '\n')
+    return vars_json
+
+
+def apply_delta(data, delta):
+    """load_streamで読み込んだマネージャーのデータに、デコードした差分を反映する。"""
+    if 'vars' in delta:
+        data['vars'] = delta['vars']
+    for layer_name, changes in delta['cells'].items():
+        rows = data[layer_name]['layer']
+        for x, y, cell in changes:
+            rows[y][x] = cell
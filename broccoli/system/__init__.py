@@ -1,3 +1,3 @@
 from .base import *
 from .rogue import *
-
+from .profiler import *
@@ -10,6 +10,26 @@ class BaseSystem:
         # ゲームキャンバス
         self.canvas = None
 
+    @property
+    def is_block(self):
+        return self._is_block
+
+    @is_block.setter
+    def is_block(self, value):
+        """is_blockがTrueからFalseになったら、resumeを呼ぶ。"""
+        was_block = getattr(self, '_is_block', False)
+        self._is_block = value
+        if was_block and not value:
+            self.resume()
+
+    def resume(self):
+        """ブロックが解除された際に呼ばれる。
+
+        ブロック中に待たせておいた処理があれば、ここで再開してください。
+
+        """
+        pass
+
     def setup(self):
         """システムのセットアップを行う。
 
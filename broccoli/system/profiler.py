@@ -0,0 +1,163 @@
+"""ゲームシステムの処理時間を計測するモジュール。
+
+ターンが重くなった際に、敵AI、アニメーション、メッセージ表示、ゲーム情報の更新のどこに時間がかかっているかを調べるために使います。
+
+    profiler = system.enable_profiling()
+    ...(ゲームを進める)
+    print(profiler.stats)
+    profiler.stats.dump('profile.json')
+
+Profilerは、有効にした間だけシステムのメソッドを計測用の関数で包みます。
+アニメーションはcanvas.timelineで後から再生されるので、move_to_animationなどの時間はアニメーションを予約するまでの時間です。
+実際に描画にかかった時間は、timeline.next_frameを包んで、animation_frameとして計測します。
+無効にすると元のメソッドに戻るので、計測していない時の処理は一切遅くなりません。
+
+"""
+import json
+import time
+
+
+class ProfileStats:
+    """計測結果を保持するクラス。
+
+    - totals: {メソッド名: 合計秒数}
+    - calls: {メソッド名: 呼ばれた回数}
+    - turns: {ターン数: {メソッド名: 合計秒数}}
+    - classes: {メソッド名: {マテリアルのクラス名: [呼ばれた回数, 合計秒数]}}
+
+    act_objectsの時間には、その中で呼ばれたact_objectの時間も含まれます。
+    animation_frameは、canvas.timelineがアニメーションの1フレームを描画するのにかかった時間です。
+
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+        self.turns = {}
+        self.classes = {}
+
+    def add(self, name, turn, seconds, material=None):
+        """1回分の計測結果を追加する。"""
+        self.totals[name] = self.totals.get(name, 0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        turn_stats = self.turns.setdefault(turn, {})
+        turn_stats[name] = turn_stats.get(name, 0) + seconds
+        if material is not None:
+            class_stats = self.classes.setdefault(name, {}).setdefault(type(material).__name__, [0, 0])
+            class_stats[0] += 1
+            class_stats[1] += seconds
+
+    def clear(self):
+        """計測結果を全て破棄する。"""
+        self.__init__()
+
+    def get_turn_total(self, turn, name='act_objects'):
+        """そのターンで、nameのメソッドにかかった合計秒数を返す。"""
+        return self.turns.get(turn, {}).get(name, 0)
+
+    def get_slowest_turns(self, n=10, name='act_objects'):
+        """nameのメソッドに時間がかかったターンを、(ターン数, 秒数)として遅い順にn個返す。"""
+        turns = [(turn, stats[name]) for turn, stats in self.turns.items() if name in stats]
+        turns.sort(key=lambda turn_seconds: turn_seconds[1], reverse=True)
+        return turns[:n]
+
+    def to_dict(self):
+        """JSONに保存できる辞書として返す。"""
+        return {
+            'totals': self.totals,
+            'calls': self.calls,
+            'turns': {str(turn): stats for turn, stats in self.turns.items()},
+            'classes': self.classes,
+        }
+
+    def dump(self, file_path):
+        """計測結果を、JSONファイルとして保存する。"""
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=4)
+
+    def __str__(self):
+        lines = ['{:<24} {:>8} {:>12} {:>12}'.format('method', 'calls', 'total(ms)', 'average(ms)')]
+        for name, total in sorted(self.totals.items(), key=lambda item: item[1], reverse=True):
+            calls = self.calls[name]
+            lines.append('{:<24} {:>8} {:>12.3f} {:>12.3f}'.format(name, calls, total * 1000, total / calls * 1000))
+            for class_name, (class_calls, class_total) in sorted(
+                    self.classes.get(name, {}).items(), key=lambda item: item[1][1], reverse=True):
+                lines.append('  {:<22} {:>8} {:>12.3f} {:>12.3f}'.format(
+                    class_name, class_calls, class_total * 1000, class_total / class_calls * 1000
+                ))
+        return '\n'.join(lines)
+
+
+class Profiler:
+    """ゲームシステムのメソッドの、処理時間を計測するクラス。
+
+    methodsに書いたメソッドを、enableで計測用の関数に差し替え、disableで元に戻します。
+    material_methodsに書いたメソッドは、最初の引数(行動するオブジェクト等)のクラスごとにも集計します。
+
+    """
+    material_methods = ['act_object']
+    timeline_method_name = 'animation_frame'  # アニメーションの1フレームの描画時間を記録する名前
+
+    def __init__(self, system, methods):
+        self.system = system
+        self.methods = list(methods)
+        self.stats = ProfileStats()
+        self.enabled = False
+        self.timeline = None
+
+    def enable(self):
+        """計測を始める。既に計測中ならば、system.canvasのtimelineを包みなおすだけです。"""
+        if not self.enabled:
+            for name in self.methods:
+                # インスタンスの属性にすることで、クラスのメソッドより優先して呼ばれる
+                setattr(self.system, name, self.wrap(name, getattr(self.system, name)))
+            self.enabled = True
+        self.bind_timeline()
+
+    def disable(self):
+        """計測をやめ、元のメソッドに戻す。計測結果は残ります。"""
+        if not self.enabled:
+            return
+        for name in self.methods:
+            self.system.__dict__.pop(name, None)
+        self.unbind_timeline()
+        self.enabled = False
+
+    def bind_timeline(self):
+        """system.canvasのtimelineのnext_frameを、計測用の関数で包む。
+
+        アニメーションの各フレームは、Timelineがafterで呼び出します。
+        マップを移動するとキャンバスごとTimelineが作りなおされるので、
+        システムが新しいキャンバスで準備されるたびに呼んで、前のTimelineは元に戻します。
+
+        """
+        canvas = getattr(self.system, 'canvas', None)
+        timeline = getattr(canvas, 'timeline', None)
+        if timeline is self.timeline:
+            return
+        self.unbind_timeline()
+        if timeline is not None:
+            timeline.next_frame = self.wrap(self.timeline_method_name, timeline.next_frame)
+        self.timeline = timeline
+
+    def unbind_timeline(self):
+        """包んでいたtimelineのnext_frameを、元に戻す。"""
+        if self.timeline is not None:
+            self.timeline.__dict__.pop('next_frame', None)
+            self.timeline = None
+
+    def wrap(self, name, method):
+        """methodを、処理時間を計測する関数で包んで返す。"""
+        system = self.system
+        stats = self.stats
+        perf_counter = time.perf_counter
+        use_material = name in self.material_methods
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                material = args[0] if use_material and args else None
+                stats.add(name, system.turn, perf_counter() - start, material=material)
+        return wrapper
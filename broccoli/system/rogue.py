@@ -5,11 +5,13 @@
 """
 import tkinter as tk
 import tkinter.ttk as ttk
-from broccoli import register, parse_xy
+from broccoli import register, parse_xy, const
 from broccoli.conf import settings
 from broccoli.dialog import LogAndActiveMessageDialog, ListDialog
+from broccoli.layer.pathfinding import FlowField
 from broccoli.material.object import *
 from .base import BaseSystem
+from .profiler import Profiler
 
 
 class RogueLikeSystem(BaseSystem):
@@ -20,17 +22,48 @@ class RogueLikeSystem(BaseSystem):
     font = (text_font, text_size)
     color = settings.DEFAULT_TEXT_COLOR
 
+    # enable_profilingで、処理時間を計測するメソッド
+    profile_methods = ['act_objects', 'act_object', 'move_to_animation', 'add_message', 'update_game_info']
+
     def __init__(self, message_class=LogAndActiveMessageDialog, show_item_dialog_class=ListDialog):
         super().__init__()
         # 現在ターンを表す変数
         self.turn = 0
 
+        # ブロック中に行動しようとして、待たされているオブジェクト
+        self.waiting_objects = []
+
+        # このターンに作った、プレイヤー達を起点とするFlowField。{移動するオブジェクトのkind: FlowField}
+        self.flow_fields = {}
+
         self.message_class = message_class
         self.show_item_dialog_class = show_item_dialog_class
 
+        # 処理時間の計測。enable_profilingを呼ぶまではNoneです
+        self.profiler = None
+
     def setup(self):
         # メッセージクラスのインスタンス化
         self.message = self.message_class(parent=self, canvas=self.canvas)
+        # 計測中に前に訪れたマップへ戻った場合も、新しいキャンバスのtimelineを計測しなおす
+        if settings.PROFILE or (self.profiler is not None and self.profiler.enabled):
+            self.enable_profiling()
+
+    def enable_profiling(self, methods=None):
+        """profile_methodsに書いたメソッドの、処理時間の計測を始める。
+
+        計測結果はprofiler.statsで確認できます。計測していない間は、メソッドの呼び出しは遅くなりません。
+
+        """
+        if self.profiler is None:
+            self.profiler = Profiler(self, methods or self.profile_methods)
+        self.profiler.enable()
+        return self.profiler
+
+    def disable_profiling(self):
+        """処理時間の計測をやめる。それまでの計測結果は、profiler.statsに残ります。"""
+        if self.profiler is not None:
+            self.profiler.disable()
 
     def start(self):
         # 0.1 秒ぐらいごとに、ゲームの状態を監視する
@@ -51,6 +84,7 @@ class RogueLikeSystem(BaseSystem):
             ('<{}>'.format(settings.TALK_KEY), self.talk),
             ('<{}>'.format(settings.SAVE_KEY), self.canvas.manager.save),
             ('<{}>'.format(settings.LOAD_KEY), self.canvas.manager.load),
+            ('<{}>'.format(settings.SKIP_ANIMATION_KEY), self.skip_animation),
         ]
 
     def move(self, event):
@@ -83,30 +117,95 @@ class RogueLikeSystem(BaseSystem):
     def act_object(self, obj):
         """オブジェクトの行動を呼び出す。
 
-        このメソッドは、ゲームがロック状態ならば解除されるまで待ち
-        解除されてからオブジェクトの行動を呼びます。
+        このメソッドは、ゲームがロック状態ならばwaiting_objectsに追加して待たせ、
+        解除された際(resumeメソッド)にオブジェクトの行動を呼びます。
         基本的に、特定のオブジェクトを行動させるにはこのメソッドを呼んでください。
 
         """
         if self.is_block:
-            self.canvas.after(100, self.act_object, obj)
+            self.waiting_objects.append(obj)
         else:
             obj.action()
 
+    def resume(self):
+        """ブロック中に待たされていたオブジェクトを、順番に行動させる。"""
+        waiting_objects, self.waiting_objects = self.waiting_objects, []
+        scheduler = self.canvas.object_layer.scheduler
+        for i, obj in enumerate(waiting_objects):
+            # 途中でまたブロックされたら、残りは次の解除まで待たせる
+            if self.is_block:
+                self.waiting_objects.extend(waiting_objects[i:])
+                break
+            # 待っている間に、倒されたりマップから消えていることもある
+            if obj.hp > 0 and obj in scheduler:
+                self.act_object(obj)
+
+    def get_action_delay(self, obj):
+        """オブジェクトが行動してから、次に行動するまでの時間を返す。
+
+        object_layer.scheduler.turn_lengthが1ターンの長さで、オブジェクトのspeed属性で割った値になります。
+
+        """
+        turn_length = self.canvas.object_layer.scheduler.turn_length
+        speed = getattr(obj, 'speed', 1)
+        if speed <= 0:
+            return turn_length
+        return max(1, round(turn_length / speed))
+
     def act_objects(self, exclude=()):
-        """全てのオブジェクトの行動を呼びだします。
+        """このターンに行動するオブジェクトの行動を呼びだします。
 
+        オブジェクトはobject_layer.schedulerに、次に行動する時刻の順で管理されています。
+        このターンに順番が来たオブジェクトだけが取り出され、行動後はspeedに応じた時刻に再び登録されます。
         action呼び出しを無視したいキャラクターがいれば、exclude引数に渡してください。
 
         """
-        # オブジェクト一覧を取得
-        objects = [obj for _, _, obj in self.canvas.object_layer.all(include_none=False) if obj not in exclude]
-        for obj in objects:
-            # 生きていれば行動する。objectsリストはビューオブジェクトのようなものではなく、その時点でのリスト
-            # そのため、取得時は生きていても今生きているかはわからない。
-            if obj.hp > 0:
+        scheduler = self.canvas.object_layer.scheduler
+        for obj in scheduler.pop_due():
+            # 先に次の行動時刻を登録しておく。行動中に倒された場合は、削除時に登録も解除される
+            scheduler.add(obj, delay=self.get_action_delay(obj))
+            if obj not in exclude and obj.hp > 0 and getattr(obj, 'speed', 1) > 0:
                 self.act_object(obj)
 
+    def next_turn(self, exclude=()):
+        """ターンを進める。
+
+        オブジェクト達を行動させ、ターン数を1増やします。
+        プレイヤーの行動後に呼ぶ場合は、exclude引数にプレイヤーを渡してください。
+
+        """
+        self.flow_fields = {}
+        self.canvas.tile_layer.fov.new_turn(self.turn)
+        self.act_objects(exclude=exclude)
+        self.turn += 1
+
+    def get_flow_field(self, obj):
+        """プレイヤー達を起点とした、objのためのFlowFieldを返す。
+
+        FlowFieldはターンごとに(next_turnのたびに)、移動するオブジェクトのkindごとに1度だけ作られ、
+        同じターンに行動するモンスター達で共有されます。
+        ターンの途中でタイルが変更された場合は作りなおします。
+
+        """
+        field = self.flow_fields.get(obj.kind)
+        if field is None or not field.is_valid():
+            sources, see_x, see_y = self.get_flow_field_sources()
+            field = FlowField(self.canvas.tile_layer, sources, see_x, see_y, obj=obj)
+            self.flow_fields[obj.kind] = field
+        return field
+
+    def get_flow_field_sources(self):
+        """FlowFieldの起点となるプレイヤー達と、オブジェクトの視界(see_x, see_y)の最大値を返す。"""
+        sources = []
+        see_x = 0
+        see_y = 0
+        for obj in self.canvas.object_layer.positions:
+            if obj.kind == const.PLAYER:
+                sources.append(obj)
+            see_x = max(see_x, getattr(obj, 'see_x', 0))
+            see_y = max(see_y, getattr(obj, 'see_y', 0))
+        return sources, see_x, see_y
+
     def add_message(self, message):
         """メッセージを表示する。
 
@@ -120,26 +219,33 @@ class RogueLikeSystem(BaseSystem):
         """アイテムリストを表示する。"""
         pass
 
+    def skip_animation(self, event=None):
+        """再生中のアニメーションを、全て最後まで早送りする。"""
+        self.canvas.timeline.finish()
+
     def show_map_name(self):
         """マップ名をかっこよく表示する。"""
         x, y = self.canvas.get_current_position_center()
-        text = ''
-        for char in self.canvas.name:
-            text += char
+
+        def animation():
+            text = ''
+            for char in self.canvas.name:
+                text += char
+                self.canvas.delete('start_message')
+                self.canvas.create_text(
+                    x,
+                    y,
+                    anchor='center',
+                    text=text,
+                    font=self.font,
+                    fill=self.color,
+                    tag='start_message',
+                )
+                yield 100
+            yield 1000
             self.canvas.delete('start_message')
-            self.canvas.create_text(
-                x,
-                y,
-                anchor='center',
-                text=text,
-                font=self.font,
-                fill=self.color,
-                tag='start_message',
-            )
-            self.canvas.after(100)
-            self.canvas.update_idletasks()
-        self.canvas.after(1000)
-        self.canvas.delete('start_message')
+
+        self.canvas.timeline.add(animation(), key='start_message')
 
     def game_over(self):
         """ゲームオーバー処理。"""
@@ -155,9 +261,18 @@ class RogueLikeSystem(BaseSystem):
         )
 
     def simple_move(self, obj_id, x=None, y=None, material=None):
-        """layer[y][x]にキャラクターを移動する、ショートカットメソッドです。"""
+        """layer[y][x]にキャラクターを移動する、ショートカットメソッドです。
+
+        そのキャラクターのアニメーションが再生中ならば、終わってから移動します。
+
+        """
+        # 表示範囲外で、描画されていないキャラクター
+        if obj_id is None:
+            return
         x, y = parse_xy(x, y, material)
-        self.canvas.coords(obj_id, x*settings.CELL_WIDTH, y*settings.CELL_HEIGHT)
+        self.canvas.timeline.call(
+            self.canvas.coords, obj_id, x*settings.CELL_WIDTH, y*settings.CELL_HEIGHT, key=obj_id
+        )
 
     def move_to_animation(
             self, obj_id,
@@ -167,8 +282,14 @@ class RogueLikeSystem(BaseSystem):
         """今の場所から、layer[y][x]に向かって移動するアニメーションを行います。
 
         timesの時間をかけて、frame回描画します。
+        アニメーションはcanvas.timelineで再生されるので、このメソッドはすぐに戻ります。
+        他のキャラクターのアニメーションとは同時に、同じキャラクターのアニメーションとは順番に再生されます。
 
         """
+        # 表示範囲外で、描画されていないキャラクター
+        if obj_id is None:
+            return
+
         # まずレイヤ内の座標に変換する。
         from_x, from_y = parse_xy(from_x, from_y, from_material)
         to_x, to_y = parse_xy(to_x, to_y, to_material)
@@ -181,30 +302,42 @@ class RogueLikeSystem(BaseSystem):
         diff_y = target_y - current_y
         step_x = diff_x / frame
         step_y = diff_y / frame
-        for i in range(1, frame+1):
-            self.canvas.coords(obj_id, current_x+step_x*i, current_y+step_y*i)
-            self.canvas.update_idletasks()
-            self.canvas.after(int(times/frame*1000))
-            self.canvas.lift(obj_id)
 
-    def simple_damage_line(self, x=None, y=None, material=None, width=2, fill='red', times=0.1):
+        def animation():
+            for i in range(1, frame+1):
+                self.canvas.coords(obj_id, current_x+step_x*i, current_y+step_y*i)
+                self.canvas.lift(obj_id)
+                yield times/frame*1000
+
+        self.canvas.timeline.add(animation(), key=obj_id)
+
+    def simple_damage_line(self, x=None, y=None, material=None, width=2, fill='red', times=0.1, key=None):
         """キャラの右上から左下にかけて、線をつける。
 
         x, yはlayer内の座標です。
+        keyを渡すと、そのトラックのアニメーション(攻撃したキャラクターの動きなど)が終わってから線を表示します。
+        省略した場合は、materialのトラックに追加します。
 
         """
         x, y = parse_xy(x, y, material)
-        damage_line = self.canvas.create_line(
-            x*settings.CELL_WIDTH+settings.CELL_WIDTH,  # セルの幅も加えることを忘れずに
-            y*settings.CELL_HEIGHT,
-            x*settings.CELL_WIDTH,
-            y*settings.CELL_HEIGHT+settings.CELL_HEIGHT,  # セルの高さも加えることを忘れずに
-            width=width, fill=fill,
-        )
-        self.canvas.update_idletasks()  # すぐに描画する
-        # デフォルトでは、0.1秒後にダメージ線を消す
-        self.canvas.after(int(times*1000))
-        self.canvas.delete(damage_line)
+        if key is None and material is not None:
+            key = material.id
+
+        def animation():
+            damage_line = self.canvas.create_line(
+                x*settings.CELL_WIDTH+settings.CELL_WIDTH,  # セルの幅も加えることを忘れずに
+                y*settings.CELL_HEIGHT,
+                x*settings.CELL_WIDTH,
+                y*settings.CELL_HEIGHT+settings.CELL_HEIGHT,  # セルの高さも加えることを忘れずに
+                width=width, fill=fill,
+            )
+            # デフォルトでは、0.1秒後にダメージ線を消す
+            try:
+                yield times*1000
+            finally:
+                self.canvas.delete(damage_line)
+
+        self.canvas.timeline.add(animation(), key=key)
 
     def talk(self, event):
         """話しかける。"""
@@ -252,7 +385,7 @@ class RogueWithPlayer(RogueLikeSystem):
         if self.canvas.check_position(x, y):
             tile = self.canvas.tile_layer[y][x]
             obj = self.canvas.object_layer[y][x]
-            if obj is None and tile.is_public(obj=self.player):
+            if obj is None and self.canvas.tile_layer.is_public(x, y, obj=self.player):
                 self.player.move(tile)
                 try:
                     self.canvas.move_camera(material=self.player)
@@ -262,8 +395,7 @@ class RogueWithPlayer(RogueLikeSystem):
                     # destroy済みで例外が送出され、ここにきます。act_objectsなどの他の処理をする必要はないため、pass
                     pass
                 else:
-                    self.act_objects(exclude=[self.player])
-                    self.turn += 1
+                    self.next_turn(exclude=[self.player])
 
     def attack(self, event):
         """主人公の攻撃処理。"""
@@ -285,8 +417,7 @@ class RogueWithPlayer(RogueLikeSystem):
         obj = self.canvas.object_layer[y][x]
         self.player.attack(tile, obj)
         self.canvas.move_camera(material=self.player)
-        self.act_objects(exclude=[self.player])
-        self.turn += 1
+        self.next_turn(exclude=[self.player])
 
     def create_game_info(self):
         """ターン数やプレイヤーHPなどの表示枠を作成する。"""
@@ -392,8 +523,7 @@ class RogueNoPlayer(RogueLikeSystem):
 
     def attack(self, event):
         """攻撃キーで次ターンになります。"""
-        self.act_objects()
-        self.turn += 1
+        self.next_turn()
 
     def create_game_info(self):
         """ターン数やプレイヤーHPなどの表示枠を作成する。"""
@@ -2,7 +2,7 @@
 import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter import filedialog
-from broccoli import register
+from broccoli import register, const
 from broccoli.layer import RandomTileLayer, SimpleTileLayer, JsonTileLayer, JsonObjectLayer, ExpandTileLayer, JsonItemLayer
 from broccoli.material import BaseObject, BaseItem, BaseTile
 from .list import UserDataFrame
@@ -281,17 +281,17 @@ class MapEditor(ttk.Frame):
 
     def show_public(self):
         """通行可能タイルを強調ボタンで呼ばれる"""
-        self.canvas_frame.canvas.delete('highlight')
-        for x, y, tile in self.canvas_frame.canvas.tile_layer.all(include_none=False):
-            if tile.is_public.name == 'generic.return_true':
-                self.canvas_frame.canvas.highlight_material(tile)
+        canvas = self.canvas_frame.canvas
+        canvas.delete('highlight')
+        for x, y in canvas.tile_layer.filter_passability(const.PUBLIC):
+            canvas.highlight_material(canvas.tile_layer[y][x])
 
     def show_private(self):
         """通行不可タイルを強調で呼ばれる"""
-        self.canvas_frame.canvas.delete('highlight')
-        for x, y, tile in self.canvas_frame.canvas.tile_layer.all(include_none=False):
-            if tile.is_public.name == 'generic.return_false':
-                self.canvas_frame.canvas.highlight_material(tile)
+        canvas = self.canvas_frame.canvas
+        canvas.delete('highlight')
+        for x, y in canvas.tile_layer.filter_passability(const.PRIVATE):
+            canvas.highlight_material(canvas.tile_layer[y][x])
 
     def show_mass(self):
         """マス目をつけるで呼ばれる"""
@@ -155,6 +155,7 @@ def tutorial_sheep_talk(self, obj):
         self.system.add_message('「z」キーは攻撃ができるけど、友好的っぽい動物にはしないようにしようね。   ')
         self.system.add_message('ちなみに、ここまでの会話はログに保存されてるよ。\n「l」キーで確認ができて、同じキーを押すと閉じる。')
         obj.vars['tutorial'] = 1
+        obj.mark_dirty()
 
     # インストラクション2
     elif flag == 1:
@@ -162,6 +163,7 @@ def tutorial_sheep_talk(self, obj):
         self.system.add_message('悪い羊を召喚するから、そいつを倒してみよう!')
         self.layer.create_material(material_cls=Sheep, x=5, y=3, name='悪い羊', die=tutorial_enemy_die)
         obj.vars['tutorial'] = 2
+        obj.mark_dirty()
 
     # インストラクション3
     elif flag == 2:
@@ -176,6 +178,7 @@ def tutorial_sheep_talk(self, obj):
         self.canvas.item_layer.create_material(material_cls=HealingHerb, x=5, y=3, use=tutorial_use)
         self.canvas.item_layer.create_material(material_cls=HealingHerb, x=5, y=3, use=tutorial_use)
         obj.vars['tutorial'] = 4
+        obj.mark_dirty()
 
     elif flag == 4:
         self.system.add_message('拾ったアイテムは、「i」キーで使えるよ。\nアイテムウィンドウを閉じるのも「i」キーさ。')
@@ -195,6 +198,7 @@ def tutorial_enemy_die(self, tile, obj):
     roguelike.die(self, tile, obj)
     player = self.layer.get(name='あなた')
     player.vars['tutorial'] = 3
+    player.mark_dirty()
 
 
 @register.function('roguelike.object.tutorial_use', system='roguelike', attr='use', material='item')
@@ -207,6 +211,7 @@ def tutorial_use(self):
     roguelike.healing_use(self)
     player = self.system.player
     player.vars['tutorial'] = 5
+    player.mark_dirty()
 
 
 @register.object
@@ -0,0 +1,81 @@
+"""JSONファイルから作成するレイヤーのテスト。"""
+import json
+import os
+import tempfile
+import unittest
+from broccoli import register, serializers
+from broccoli.canvas import HeadlessGameCanvas2D
+from broccoli.layer import JsonTileLayer, PythonTileLayer
+from broccoli.material import BaseTile
+from broccoli.system import RogueNoPlayer
+
+
+@register.tile
+class LayerTestFloor(BaseTile):
+    image = None
+
+
+@register.tile
+class LayerTestWater(BaseTile):
+    image = None
+
+
+def dump_tiles(file_path, tile_cls, x_length, y_length, stream=False):
+    """全てのセルがtile_clsの背景を、file_pathに保存する。"""
+    class Canvas(HeadlessGameCanvas2D):
+        tile_layer = PythonTileLayer([[(tile_cls, {}) for _ in range(x_length)] for _ in range(y_length)])
+        system = RogueNoPlayer()
+
+    canvas = Canvas()
+    with open(file_path, 'w', encoding='utf-8') as file:
+        if stream:
+            serializers.dump_stream(canvas.tile_layer, file)
+        else:
+            json.dump(canvas.tile_layer, file, cls=serializers.JsonEncoder)
+
+
+class JsonTileLayerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'tile.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_canvas(self, tile_layer):
+        class Canvas(HeadlessGameCanvas2D):
+            system = RogueNoPlayer()
+        Canvas.tile_layer = tile_layer
+        return Canvas()
+
+    def touch_later(self):
+        """ファイルの更新時刻を、確実に進める。"""
+        stat = os.stat(self.file_path)
+        os.utime(self.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def assert_reloads(self, stream):
+        dump_tiles(self.file_path, LayerTestFloor, 3, 2, stream=stream)
+        tile_layer = JsonTileLayer(self.file_path)
+        tile_layer.prepare()
+        canvas = self.create_canvas(tile_layer)
+        self.assertEqual((canvas.tile_layer.x_length, canvas.tile_layer.y_length), (3, 2))
+        self.assertIsInstance(canvas.tile_layer[1][2], LayerTestFloor)
+
+        dump_tiles(self.file_path, LayerTestWater, 4, 3, stream=stream)
+        self.touch_later()
+        canvas = self.create_canvas(tile_layer)
+        self.assertEqual((canvas.tile_layer.x_length, canvas.tile_layer.y_length), (4, 3))
+        self.assertIsInstance(canvas.tile_layer[2][3], LayerTestWater)
+
+    def test_reload_updated_file(self):
+        """ファイルが更新されたら、次にレイヤーを作成する際に読み込みなおす。"""
+        self.assert_reloads(stream=False)
+
+    def test_reload_updated_stream_file(self):
+        """1行ずつ読み込むファイルでも、prepareで読み込んだ古い行は使わない。"""
+        self.assert_reloads(stream=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
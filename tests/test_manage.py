@@ -0,0 +1,281 @@
+"""SimpleGameManagerのセーブ・ロードと、マップの移動のテスト。
+
+ディスプレイがなくても動くように、HeadlessGameCanvas2Dを使います。
+
+    python -m unittest discover tests
+
+"""
+import os
+import tempfile
+import unittest
+from broccoli import register, const, serializers
+from broccoli.autosave import AutoSaver
+from broccoli.canvas import HeadlessGameCanvas2D
+from broccoli.funcstions import healing_use
+from broccoli.funcstions.generic import return_false
+from broccoli.layer import JsonTileLayer, PythonTileLayer
+from broccoli.manage import SimpleGameManager
+from broccoli.material import BaseTile, RogueLikeItem, RogueLikeObject
+from broccoli.system import RogueNoPlayer, RogueWithPlayer
+
+
+@register.tile
+class ManageTestFloor(BaseTile):
+    image = None
+
+
+@register.tile
+class ManageTestWall(BaseTile):
+    image = None
+    is_public = return_false
+
+
+def create_tiles(rows):
+    return [[(ManageTestWall if char == '#' else ManageTestFloor, {}) for char in row] for row in rows]
+
+
+class FirstCanvas(HeadlessGameCanvas2D):
+    tile_layer = PythonTileLayer(create_tiles([
+        '#####',
+        '#...#',
+        '#.#.#',
+        '#####',
+    ]))
+    system = RogueNoPlayer()
+
+
+class SecondCanvas(HeadlessGameCanvas2D):
+    tile_layer = PythonTileLayer(create_tiles([
+        '####',
+        '#..#',
+        '####',
+    ]))
+    system = RogueNoPlayer()
+
+
+class SampleManager(SimpleGameManager):
+    canvas_list = {'first': FirstCanvas, 'second': SecondCanvas}
+    prefetch_next_canvas = False
+
+
+@register.object
+class ManageTestPlayer(RogueLikeObject):
+    image = None
+
+
+class PlayerFirstCanvas(HeadlessGameCanvas2D):
+    tile_layer = PythonTileLayer(create_tiles([
+        '#####',
+        '#...#',
+        '#...#',
+        '#####',
+    ]))
+    system = RogueWithPlayer(x=1, y=1)
+
+
+class PlayerSecondCanvas(HeadlessGameCanvas2D):
+    tile_layer = PythonTileLayer(create_tiles([
+        '####',
+        '#..#',
+        '####',
+    ]))
+    system = RogueWithPlayer(x=1, y=1)
+
+
+class PlayerManager(SimpleGameManager):
+    canvas_list = {'first': PlayerFirstCanvas, 'second': PlayerSecondCanvas}
+    vars = {'player': (ManageTestPlayer, {'name': 'player'})}
+    prefetch_next_canvas = False
+    map_cache_size = 4
+
+
+@register.item
+class ManageTestHerb(RogueLikeItem):
+    image = None
+    power = 5
+    use = healing_use
+
+
+class ItemManager(SimpleGameManager):
+    canvas_list = {'first': PlayerFirstCanvas}
+    vars = {'player': (ManageTestPlayer, {
+        'name': 'player', 'hp': 5, 'max_hp': 20, 'items': [(ManageTestHerb, {}), (ManageTestHerb, {})],
+    })}
+    prefetch_next_canvas = False
+
+
+def get_tile_names(canvas):
+    layer = canvas.tile_layer
+    return [[layer[y][x].__class__.__name__ for x in range(layer.x_length)] for y in range(layer.y_length)]
+
+
+class BinarySaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'save.bin')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_save_over_loaded_file(self):
+        """ロードしたバイナリのセーブデータに、そのまま上書き保存できる。"""
+        manager = SampleManager()
+        manager.save_format = 'binary'
+        manager.jump('first')
+        expected = get_tile_names(manager.current_canvas)
+        manager.save_file(self.file_path)
+
+        manager.load_file(self.file_path)
+        binary_map = manager.current_canvas.tile_layer.binary_map
+        buffers = list(binary_map.buffers)
+        manager.save_file(self.file_path)
+        # Windowsでも置き換えられるよう、保存する前にmmapを閉じている
+        self.assertTrue(buffers)
+        self.assertTrue(all(buffer.closed for buffer in buffers))
+        self.assertEqual(get_tile_names(manager.current_canvas), expected)
+        manager.load_file(self.file_path)
+
+        self.assertEqual(manager.current_canvas_name, 'first')
+        self.assertEqual(get_tile_names(manager.current_canvas), expected)
+        self.assertEqual(os.listdir(self.temp_dir.name), ['save.bin'])
+
+    def test_detect_binary_file(self):
+        """バイナリのセーブデータを、JSONとして読み込もうとしない。"""
+        manager = SampleManager()
+        manager.save_format = 'binary'
+        manager.jump('first')
+        manager.save_file(self.file_path)
+
+        self.assertFalse(serializers.is_stream_file(self.file_path))
+        with self.assertRaisesRegex(Exception, 'BinaryMap'):
+            serializers.load_file(self.file_path)
+
+
+class StreamLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'save.jsonl')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_load_journal_by_rows(self):
+        """ジャーナルは、差分を反映しながら1行ずつ読み込んでレイヤーを作成する。"""
+        manager = SampleManager()
+        manager.save_format = serializers.JOURNAL
+        manager.jump('first')
+        manager.save_file(self.file_path)
+        manager.current_canvas.tile_layer.create_material(ManageTestWall, x=1, y=1)
+        manager.save_file(self.file_path)
+        expected = get_tile_names(manager.current_canvas)
+
+        manager.load_file(self.file_path)
+        self.assertIsInstance(manager.current_canvas.tile_layer, JsonTileLayer)
+        self.assertEqual(get_tile_names(manager.current_canvas), expected)
+        self.assertEqual(manager.current_canvas.tile_layer[1][1].__class__, ManageTestWall)
+
+    def test_journal_item_use(self):
+        """プレイヤーのitemsからアイテムを取り除くと、ジャーナルの差分に含まれる。"""
+        manager = ItemManager()
+        manager.save_format = serializers.JOURNAL
+        manager.jump('first')
+        manager.save_file(self.file_path)
+        player = manager.current_canvas.system.player
+        # リストの中身の書き換えは、mark_dirtyで記録させる
+        player.items.remove(player.items[0])
+        player.mark_dirty()
+        manager.save_file(self.file_path)
+        self.assert_player_items(player, hp=5, items=[ManageTestHerb])
+
+        # アイテムを使った場合は、使った関数が記録させる
+        player.items[0].use()
+        manager.save_file(self.file_path)
+        self.assert_player_items(player, hp=10, items=[])
+
+    def assert_player_items(self, player, hp, items):
+        """全体を読み込む場合も、1行ずつ読み込む場合も、差分を反映したプレイヤーになっているか。"""
+        data = serializers.load_file(self.file_path)
+        rows = list(serializers.iter_layer_rows(self.file_path, 'object_layer'))
+        for layer_rows in (data['object_layer']['layer'], rows):
+            player_cls, kwargs = layer_rows[player.y][player.x]
+            self.assertIs(player_cls, ManageTestPlayer)
+            self.assertEqual(kwargs['hp'], hp)
+            self.assertEqual([item_cls for item_cls, _ in kwargs['items']], items)
+
+
+class AutoSaverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'autosave.jsonl')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_save_on_stop(self):
+        """stopすると、最後の状態を保存してから終了する。"""
+        manager = SampleManager()
+        manager.jump('first')
+        autosaver = AutoSaver(manager, self.file_path)
+        autosaver.start()
+        autosaver.save_now()
+        manager.current_canvas.tile_layer.create_material(ManageTestWall, x=1, y=1)
+        expected = get_tile_names(manager.current_canvas)
+        autosaver.stop()
+
+        manager.load_file(self.file_path)
+        self.assertEqual(get_tile_names(manager.current_canvas), expected)
+
+    def test_report_error(self):
+        """ワーカースレッドで保存に失敗したら、stopで例外を送出する。"""
+        manager = SampleManager()
+        manager.jump('first')
+        autosaver = AutoSaver(manager, os.path.join(self.temp_dir.name, 'missing', 'autosave.jsonl'))
+        autosaver.start()
+        with self.assertRaisesRegex(Exception, 'オートセーブ'):
+            autosaver.stop()
+        self.assertIsNone(autosaver.error)
+
+
+class MapCacheTest(unittest.TestCase):
+
+    def test_single_player_after_return(self):
+        """前に訪れたマップに戻っても、プレイヤーは1人だけ。"""
+        manager = PlayerManager()
+        manager.jump('first')
+        canvas = manager.current_canvas
+        canvas.object_layer.move_material(canvas.system.player, 3, 2)
+        manager.jump('second')
+        manager.jump('first')
+
+        canvas = manager.current_canvas
+        players = [obj for obj in canvas.object_layer.positions if obj.kind == const.PLAYER]
+        self.assertEqual(players, [canvas.system.player])
+        self.assertEqual((players[0].x, players[0].y), (1, 1))
+        self.assertIn(players[0], canvas.object_layer.scheduler)
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_profile_revisited_map(self):
+        """計測中に前に訪れたマップへ戻ると、新しいキャンバスのアニメーションを計測する。"""
+        manager = SampleManager()
+        manager.jump('first')
+        system = manager.current_canvas.system
+        profiler = system.enable_profiling()
+        old_timeline = manager.current_canvas.timeline
+        manager.jump('second')
+        manager.jump('first')
+
+        timeline = manager.current_canvas.timeline
+        self.assertIs(profiler.timeline, timeline)
+        self.assertIn('next_frame', timeline.__dict__)
+        self.assertNotIn('next_frame', old_timeline.__dict__)
+        system.disable_profiling()
+        self.assertNotIn('next_frame', timeline.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()